@@ -0,0 +1,506 @@
+import asyncio
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import audit
+import controller
+import database as db
+import models
+import security
+
+# --- API SERVER SETTINGS ---
+API_HOST = os.environ.get("LIBRARY_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("LIBRARY_API_PORT", "8080"))
+# Threads that run the (blocking) controller/SQLite calls; also the DB pool size
+API_WORKERS = int(os.environ.get("LIBRARY_API_WORKERS", "8"))
+# Requests processed at the same time; the rest wait up to API_QUEUE_TIMEOUT seconds, then get 503
+API_MAX_CONCURRENT = int(os.environ.get("LIBRARY_API_MAX_CONCURRENT", "64"))
+API_QUEUE_TIMEOUT = float(os.environ.get("LIBRARY_API_QUEUE_TIMEOUT", "5"))
+# Idle keep-alive connections are closed after this many seconds
+API_KEEPALIVE_TIMEOUT = 15
+API_MAX_BODY_BYTES = 64 * 1024
+# Login sessions expire after this many seconds without use
+SESSION_TTL = int(os.environ.get("LIBRARY_API_SESSION_TTL", "3600"))
+# ---------------------
+
+class ApiError(Exception):
+    """Raised by a handler to answer with an error status and message"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Request:
+    """A parsed HTTP request"""
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'client_ip')
+
+    def __init__(self, method, path, query, headers, body, client_ip):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.client_ip = client_ip
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be valid JSON.")
+        if not isinstance(data, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object.")
+        return data
+
+    def param(self, name, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+# ===============================================
+# ===== SESSIONS =====
+# ===============================================
+
+class SessionStore:
+    """
+    Bearer tokens for logged-in users: token -> (user_id, expires_at).
+    The user object itself comes from controller_get_user() (identity cache).
+    """
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, user_id):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (user_id, time.monotonic() + self.ttl)
+        return token
+
+    def resolve(self, token):
+        """Returns the user_id for a valid token (and extends the session), else None"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            user_id, expires_at = session
+            if expires_at <= now:
+                del self._sessions[token]
+                return None
+            self._sessions[token] = (user_id, now + self.ttl)
+            return user_id
+
+    def remove(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for token in [t for t, (_, expires_at) in self._sessions.items() if expires_at <= now]:
+                del self._sessions[token]
+
+# ===============================================
+# ===== HANDLERS (run in the worker thread pool) =====
+# ===============================================
+
+def _user_to_dict(user):
+    data = {'user_id': user.user_id, 'username': user.username, 'name': user.name}
+    if isinstance(user, models.Admin):
+        data.update(role='admin', staff_id=user.staff_id, admin_id=user.admin_id)
+    elif isinstance(user, models.Librarian):
+        data.update(role='librarian', staff_id=user.staff_id)
+    elif isinstance(user, models.Reader):
+        data.update(role='reader', reader_id=user.reader_id)
+    else:
+        data.update(role='user')
+    return data
+
+def _book_to_dict(book):
+    return {'book_id': book.book_id, 'title': book.title, 'author': book.author,
+            'genre': book.genre, 'status': book.status,
+            'total_copies': book.total_copies, 'available_copies': book.available_copies}
+
+def _require_int(data, name):
+    value = data.get(name)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be an integer.")
+    return value
+
+def _page_params(request):
+    """(page_size, cursor) of a paged search; the cursor is a JSON [sort key, book_id] pair"""
+    try:
+        page_size = min(max(int(request.param('page_size', db.DEFAULT_PAGE_SIZE)), 1), 100)
+        cursor = request.param('cursor')
+        cursor = json.loads(cursor) if cursor else None
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid 'page_size' or 'cursor'.")
+    if cursor is None:
+        return page_size, None
+    if (not isinstance(cursor, list) or len(cursor) != 2
+            or isinstance(cursor[0], (bool, list, dict))
+            or isinstance(cursor[1], bool) or not isinstance(cursor[1], int)):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "'cursor' must be the 'next_cursor' of the previous page.")
+    return page_size, tuple(cursor)
+
+class LibraryApi:
+    """Maps API routes to controller functions"""
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.routes = {
+            ('GET', '/api/health'): self.health,
+            ('POST', '/api/login'): self.login,
+            ('POST', '/api/logout'): self.logout,
+            ('POST', '/api/register'): self.register,
+            ('GET', '/api/books'): self.search_books,
+            ('GET', '/api/books/search'): self.faceted_search,
+            ('POST', '/api/borrow'): self.borrow,
+            ('POST', '/api/checkout'): self.checkout,
+            ('POST', '/api/return'): self.return_book,
+            ('GET', '/api/holds'): self.list_holds,
+            ('POST', '/api/holds'): self.place_hold,
+            ('POST', '/api/holds/cancel'): self.cancel_hold,
+        }
+
+    def authenticate(self, request):
+        """Returns the logged-in user for the request's bearer token"""
+        auth = request.headers.get('authorization', '')
+        token = auth[7:].strip() if auth.lower().startswith('bearer ') else ''
+        user_id = self.sessions.resolve(token) if token else None
+        user = controller.controller_get_user(user_id) if user_id is not None else None
+        if user is None:
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "Login required.")
+        return user
+
+    def health(self, request):
+        return HTTPStatus.OK, {'status': 'ok'}
+
+    def login(self, request):
+        data = request.json()
+        username, password = data.get('username'), data.get('password')
+        if not isinstance(username, str) or not isinstance(password, str):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'username' and 'password' are required.")
+        user = controller.controller_login(username, password, client_ip=request.client_ip)
+        if user is None:
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "Invalid username or password.")
+        token = self.sessions.create(user.user_id)
+        return HTTPStatus.OK, {'token': token, 'user': _user_to_dict(user)}
+
+    def logout(self, request):
+        user = self.authenticate(request)
+        self.sessions.remove(request.headers.get('authorization', '')[7:].strip())
+        controller.controller_logout(user)
+        return HTTPStatus.OK, {'logged_out': True}
+
+    def register(self, request):
+        data = request.json()
+        fields = ('username', 'password', 'name', 'email', 'phone')
+        if not all(isinstance(data.get(field), str) and data.get(field) for field in fields[:3]):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'username', 'password' and 'name' are required.")
+        # Registration hashes a password too: it shares the login buckets, so it
+        # cannot be used to burn CPU or probe for existing usernames
+        if not security.allow_login_attempt(data['username'], request.client_ip):
+            raise ApiError(HTTPStatus.TOO_MANY_REQUESTS, "Too many attempts. Please wait and try again.")
+        reader_id = controller.controller_register_reader(*(data.get(field) for field in fields))
+        if reader_id is None:
+            raise ApiError(HTTPStatus.CONFLICT, "Registration failed (username or email may already exist).")
+        return HTTPStatus.CREATED, {'reader_id': reader_id}
+
+    def search_books(self, request):
+        keyword = request.param('q', '')
+        if request.param('fuzzy') in ('1', 'true'):
+            books = controller.controller_search_book(keyword, fuzzy=True)
+            return HTTPStatus.OK, {'books': [_book_to_dict(book) for book in books], 'next_cursor': None}
+        page_size, cursor = _page_params(request)
+        page = controller.controller_search_book_page(keyword, cursor, page_size)
+        return HTTPStatus.OK, {'books': [_book_to_dict(book) for book in page],
+                               'next_cursor': json.dumps(page.next_cursor) if page.has_next() else None}
+
+    def faceted_search(self, request):
+        page_size, cursor = _page_params(request)
+        sort = request.param('sort')
+        if sort is not None and sort not in db.SEARCH_SORT_KEYS:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"'sort' must be one of: {', '.join(db.SEARCH_SORT_KEYS)}.")
+        result = controller.controller_search_books_faceted(
+            request.param('q', ''), request.param('genre'), request.param('status'),
+            request.param('author'), sort, cursor, page_size)
+        if result is None:
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "Search failed, please try again.")
+        page, facets = result
+        return HTTPStatus.OK, {
+            'books': [_book_to_dict(book) for book in page],
+            'facets': {'genre': [{'genre': genre, 'count': count} for genre, count in facets['genre']],
+                       'status': [{'status': status, 'count': count} for status, count in facets['status']],
+                       'total': facets['total']},
+            'next_cursor': json.dumps(page.next_cursor) if page.has_next() else None}
+
+    def _acting_reader(self, user, data, action):
+        # Librarians act for any reader; readers only for themselves
+        if isinstance(user, models.Librarian):
+            return _require_int(data, 'reader_id')
+        if isinstance(user, models.Reader):
+            return user.reader_id
+        raise ApiError(HTTPStatus.FORBIDDEN, f"This account cannot {action}.")
+
+    def borrow(self, request):
+        user = self.authenticate(request)
+        data = request.json()
+        book_id = _require_int(data, 'book_id')
+        # Self-checkout: readers can only borrow for themselves
+        reader_id = self._acting_reader(user, data, "borrow books")
+        if not controller.controller_borrow_book(reader_id, book_id):
+            raise ApiError(HTTPStatus.CONFLICT, f"Book {book_id} could not be borrowed.")
+        return HTTPStatus.OK, {'borrowed': True, 'reader_id': reader_id, 'book_id': book_id}
+
+    def checkout(self, request):
+        user = self.authenticate(request)
+        data = request.json()
+        book_ids = data.get('book_ids')
+        if (not isinstance(book_ids, list) or not book_ids
+                or any(isinstance(b, bool) or not isinstance(b, int) for b in book_ids)):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "'book_ids' must be a non-empty list of integers.")
+        if len(book_ids) > controller.MAX_CHECKOUT_ITEMS:
+            raise ApiError(HTTPStatus.BAD_REQUEST,
+                           f"At most {controller.MAX_CHECKOUT_ITEMS} books can be checked out at once.")
+        reader_id = self._acting_reader(user, data, "borrow books")
+        results = controller.controller_checkout_batch(reader_id, book_ids)
+        if not results:
+            raise ApiError(HTTPStatus.CONFLICT, "The checkout could not be recorded.")
+        return HTTPStatus.OK, {'reader_id': reader_id, 'items': [
+            {'book_id': book_id, 'borrowed': borrowed, 'message': message}
+            for book_id, borrowed, message in results]}
+
+    def return_book(self, request):
+        user = self.authenticate(request)
+        data = request.json()
+        # Librarians take back any loan; readers only their own
+        reader_id = None if isinstance(user, models.Librarian) else self._acting_reader(user, data, "return books")
+        barcode = data.get('barcode')
+        if barcode is not None:
+            if not isinstance(barcode, str) or not barcode:
+                raise ApiError(HTTPStatus.BAD_REQUEST, "'barcode' must be a non-empty string.")
+            book_id = None
+        else:
+            book_id = _require_int(data, 'book_id')
+        fine_amount = controller.controller_process_return(book_id, barcode=barcode, reader_id=reader_id)
+        if fine_amount is None:
+            owner = "" if reader_id is None else f" to reader {reader_id}"
+            raise ApiError(HTTPStatus.CONFLICT, f"{barcode or f'Book {book_id}'} is not on loan{owner}.")
+        return HTTPStatus.OK, {'returned': True, 'book_id': book_id, 'barcode': barcode,
+                               'fine_amount': fine_amount}
+
+    def list_holds(self, request):
+        user = self.authenticate(request)
+        if isinstance(user, models.Librarian):
+            try:
+                reader_id = int(request.param('reader_id', ''))
+            except ValueError:
+                raise ApiError(HTTPStatus.BAD_REQUEST, "'reader_id' must be an integer.")
+        else:
+            reader_id = self._acting_reader(user, {}, "hold books")
+        holds = controller.controller_get_reader_holds(reader_id)
+        return HTTPStatus.OK, {'holds': [
+            {'hold_id': hold_id, 'book_id': book_id, 'title': title, 'status': status,
+             'placed_date': placed_date, 'expires_on': expires_on, 'position': position}
+            for hold_id, book_id, title, status, placed_date, expires_on, position in holds]}
+
+    def place_hold(self, request):
+        user = self.authenticate(request)
+        data = request.json()
+        book_id = _require_int(data, 'book_id')
+        reader_id = self._acting_reader(user, data, "hold books")
+        hold_id = controller.controller_place_hold(reader_id, book_id)
+        if hold_id is None:
+            raise ApiError(HTTPStatus.CONFLICT, f"A hold on book {book_id} could not be placed.")
+        return HTTPStatus.OK, {'hold_id': hold_id, 'reader_id': reader_id, 'book_id': book_id}
+
+    def cancel_hold(self, request):
+        user = self.authenticate(request)
+        hold_id = _require_int(request.json(), 'hold_id')
+        if not isinstance(user, (models.Librarian, models.Reader)):
+            raise ApiError(HTTPStatus.FORBIDDEN, "This account cannot hold books.")
+        # Readers can only cancel their own holds
+        owner = user.reader_id if isinstance(user, models.Reader) else None
+        if not controller.controller_cancel_hold(hold_id, owner):
+            raise ApiError(HTTPStatus.NOT_FOUND, f"No active hold {hold_id}.")
+        return HTTPStatus.OK, {'cancelled': True, 'hold_id': hold_id}
+
+# ===============================================
+# ===== ASYNC HTTP SERVER =====
+# ===============================================
+
+class LibraryApiServer:
+    """
+    Minimal HTTP/1.1 JSON server on asyncio streams.
+    The event loop only parses requests and writes responses; every handler
+    (and so every blocking SQLite call) runs in a bounded thread pool.
+    """
+    def __init__(self, host=API_HOST, port=API_PORT, workers=API_WORKERS,
+                 max_concurrent=API_MAX_CONCURRENT):
+        self.host = host
+        self.port = port
+        self.sessions = SessionStore()
+        self.api = LibraryApi(self.sessions)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        self.max_concurrent = max_concurrent
+        self._slots = None
+        self._server = None
+        self._purge_task = None
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self._purge_task = asyncio.create_task(self._purge_sessions())
+        return self._server
+
+    async def _purge_sessions(self):
+        while True:
+            await asyncio.sleep(60)
+            self.sessions.purge_expired()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        print(f"Library API listening on http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        client_ip = peer[0] if peer else None
+        try:
+            while True:
+                request, keep_alive = await self.read_request(reader, client_ip)
+                if request is None:
+                    break
+                if isinstance(request, ApiError):
+                    status, payload = request.status, {'error': request.message}
+                    keep_alive = False
+                else:
+                    status, payload = await self.dispatch(request)
+                await self.write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def read_request(self, reader, client_ip):
+        """Returns (Request, keep_alive), (ApiError, False) for bad input, or (None, False) on EOF"""
+        line = await asyncio.wait_for(reader.readline(), timeout=API_KEEPALIVE_TIMEOUT)
+        if not line:
+            return None, False
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3:
+            return ApiError(HTTPStatus.BAD_REQUEST, "Malformed request line."), False
+        method, target, version = parts
+
+        headers = {}
+        while True:
+            header_line = await asyncio.wait_for(reader.readline(), timeout=API_KEEPALIVE_TIMEOUT)
+            if header_line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header_line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            return ApiError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length."), False
+        if length > API_MAX_BODY_BYTES:
+            return ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large."), False
+        body = await reader.readexactly(length) if length > 0 else b''
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, parse_qs(url.query), headers, body, client_ip), keep_alive
+
+    async def dispatch(self, request):
+        handler = self.api.routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self.api.routes)
+            if known_path:
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Method not allowed."}
+            return HTTPStatus.NOT_FOUND, {'error': "Not found."}
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=API_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {'error': "Server busy, please retry."}
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._run_handler, handler, request)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _run_handler(handler, request):
+        try:
+            return handler(request)
+        except ApiError as e:
+            return e.status, {'error': e.message}
+        except Exception as e:
+            print(f"Error handling {request.method} {request.path}: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal server error."}
+
+    async def write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+async def run_server(host=API_HOST, port=API_PORT):
+    server = LibraryApiServer(host, port)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+if __name__ == '__main__':
+    # Usage: python api_server.py [port]
+    port_arg = int(sys.argv[1]) if len(sys.argv) > 1 else API_PORT
+
+    init_conn = db.connect_db()
+    if init_conn is None:
+        print("FATAL ERROR: Could not connect to database.")
+        sys.exit(1)
+    db.create_tables(init_conn)
+    init_conn.close()
+
+    # One pooled connection per worker thread
+    db.configure_pool(size=API_WORKERS)
+    db.start_checkpointer()
+    audit.start_writer()
+    try:
+        asyncio.run(run_server(API_HOST, port_arg))
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        audit.stop_writer()
+        db.stop_checkpointer()
+        db.close_pool()
@@ -0,0 +1,287 @@
+import argparse
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+import database as db
+
+# --- AUDIT SETTINGS ---
+# LIBRARY_AUDIT=0 turns the audit log off
+AUDIT_ENABLED = os.environ.get("LIBRARY_AUDIT", "1") != "0"
+# Longest time an event waits in memory before its batch is written
+FLUSH_INTERVAL = float(os.environ.get("LIBRARY_AUDIT_FLUSH_MS", "200")) / 1000
+# Events per transaction, and events waiting at most (record() then waits PUT_TIMEOUT seconds)
+BATCH_SIZE = 500
+QUEUE_SIZE = 10000
+PUT_TIMEOUT = 0.5
+# Batches that could not be written to the database are appended here (one JSON event per line)
+FALLBACK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit_fallback.jsonl")
+# ---------------------
+
+EVENT_TYPES = ('borrowed', 'returned', 'reader_registered', 'book_added', 'catalog_imported',
+               'hold_placed', 'hold_cancelled', 'login_succeeded', 'login_failed')
+
+# ===============================================
+# ===== BACKGROUND WRITER =====
+# ===============================================
+# Controllers only put a tuple on an in-memory queue; this thread writes the events
+# in batches (one transaction per batch), so no borrow or return waits for an
+# extra commit. A batch is written when it is full or FLUSH_INTERVAL after its first
+# event arrived, whichever comes first.
+
+_STOP = object()
+
+class AuditWriter(threading.Thread):
+    """Background thread that drains the event queue into AUDIT_EVENT"""
+    def __init__(self, database=None, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE):
+        super().__init__(name="audit-writer", daemon=True)
+        self.database = database or db.get_pool().database
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, event):
+        """Queues one event; False if the queue stayed full for PUT_TIMEOUT seconds"""
+        try:
+            self.queue.put(event, timeout=PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _next_batch(self):
+        """Blocks for the first event, then collects more until the batch is full or due"""
+        first = self.queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is _STOP:
+                # Write what we have; run() sees the sentinel again and stops
+                self.queue.task_done()
+                self.queue.put(_STOP)
+                break
+            batch.append(event)
+        return batch
+
+    def _write(self, conn, batch):
+        if conn is not None and db.db_append_audit_events(conn, batch) is not None:
+            self.written += len(batch)
+            return
+        # Keep the events rather than lose them; they can be loaded back later
+        self.failed += len(batch)
+        try:
+            with open(FALLBACK_FILE, "a", encoding="utf-8") as f:
+                for event in batch:
+                    f.write(json.dumps(dict(zip(db.AUDIT_EVENT_COLUMNS[1:], event)), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error: {len(batch)} audit event(s) lost: {e}")
+
+    def run(self):
+        conn = db.connect_db(self.database)
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    self.queue.task_done()
+                    return
+                self._write(conn, batch)
+                for _ in batch:
+                    self.queue.task_done()
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def flush(self):
+        """Waits until every queued event has been written"""
+        self.queue.join()
+
+    def stop(self):
+        """Writes the remaining events, then ends the thread"""
+        self.queue.put(_STOP)
+        self.join()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def start_writer(database=None):
+    """Starts the background writer (done automatically by the first record())"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(database)
+            _writer.start()
+            atexit.register(stop_writer)
+        return _writer
+
+def stop_writer():
+    """Writes the queued events and stops the writer (call on shutdown)"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+def flush():
+    """Waits until every event recorded so far is in the database"""
+    if _writer is not None:
+        _writer.flush()
+
+def record(event_type, user_id=None, reader_id=None, book_id=None, record_id=None, **details):
+    """
+    Records one event without touching the database (the writer thread stores it).
+    Extra keyword arguments are kept as JSON details, e.g. fine=5000.
+    """
+    if not AUDIT_ENABLED:
+        return False
+    writer = _writer or start_writer()
+    event = (datetime.now().isoformat(timespec="milliseconds"), event_type, user_id, reader_id,
+             book_id, record_id, json.dumps(details, ensure_ascii=False) if details else None)
+    return writer.put(event)
+
+def get_audit_stats():
+    """Counters of the writer: events written, waiting, dropped (queue full) and failed"""
+    writer = _writer
+    if writer is None:
+        return {"written": 0, "queued": 0, "dropped": 0, "failed": 0}
+    return {"written": writer.written, "queued": writer.queue.qsize(),
+            "dropped": writer.dropped, "failed": writer.failed}
+
+# ===============================================
+# ===== QUERY & REPLAY =====
+# ===============================================
+
+def _event_from_row(row):
+    event = dict(zip(db.AUDIT_EVENT_COLUMNS, row))
+    event['details'] = json.loads(event['details']) if event['details'] else {}
+    return event
+
+def iter_events(reader_id=None, book_id=None, event_types=None, since=None, until=None,
+                after_event_id=0, batch_size=500):
+    """
+    Generator over matching events, oldest first, as dicts.
+    Events are read one keyset page at a time, so memory use stays flat.
+    """
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return
+        while True:
+            rows = db.db_query_audit_events(conn, reader_id, book_id, event_types, since, until,
+                                            after_event_id, batch_size)
+            for row in rows:
+                yield _event_from_row(row)
+            if len(rows) < batch_size:
+                return
+            after_event_id = rows[-1][0]
+
+def query_events(reader_id=None, book_id=None, event_types=None, since=None, until=None,
+                 after_event_id=0, limit=100):
+    """Up to 'limit' matching events (oldest first) as a list of dicts"""
+    events = []
+    for event in iter_events(reader_id, book_id, event_types, since, until, after_event_id,
+                             batch_size=min(limit, 500)):
+        events.append(event)
+        if len(events) >= limit:
+            break
+    return events
+
+def replay(handler, **filters):
+    """Calls handler(event) for every matching event in order; returns how many were replayed"""
+    count = 0
+    for event in iter_events(**filters):
+        handler(event)
+        count += 1
+    return count
+
+def replay_open_loans(until=None):
+    """
+    Rebuilds the open loans from 'borrowed'/'returned' events up to 'until'.
+    Returns {record_id: (reader_id, book_id, borrowed_at)}.
+    """
+    open_loans = {}
+
+    def apply(event):
+        if event['event_type'] == 'borrowed':
+            open_loans[event['record_id']] = (event['reader_id'], event['book_id'], event['event_time'])
+        else:
+            open_loans.pop(event['record_id'], None)
+
+    replay(apply, event_types=('borrowed', 'returned'), until=until)
+    return open_loans
+
+def check_open_loans():
+    """
+    Compares the replayed log with BORROWING_RECORD.
+    Returns (not_logged, not_open): open loans missing from the log (e.g. made before
+    the log existed) and logged loans the database no longer has open.
+    """
+    flush()
+    logged = replay_open_loans()
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+        cur = conn.cursor()
+        cur.execute("SELECT record_id FROM BORROWING_RECORD WHERE return_date IS NULL")
+        actual = {row[0] for row in cur.fetchall()}
+    return sorted(actual - logged.keys()), sorted(logged.keys() - actual)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query and replay the circulation audit log.")
+    parser.add_argument("--db", help="database file (default: library.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("events", help="list events, oldest first")
+    p.add_argument("--reader", type=int)
+    p.add_argument("--book", type=int)
+    p.add_argument("--type", action="append", choices=EVENT_TYPES, help="event type (repeatable)")
+    p.add_argument("--since", help="ISO date/time (inclusive)")
+    p.add_argument("--until", help="ISO date/time (exclusive)")
+    p.add_argument("--limit", type=int, default=100)
+    p.add_argument("--json", action="store_true", help="one JSON object per line")
+
+    commands.add_parser("replay", help="rebuild the open loans from the log and compare with the database")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure_pool(args.db)
+    ok = True
+    if args.command == "events":
+        for event in query_events(args.reader, args.book, args.type, args.since, args.until, limit=args.limit):
+            if args.json:
+                print(json.dumps(event, ensure_ascii=False))
+                continue
+            subjects = ", ".join(f"{name} {event[key]}" for name, key in
+                                 (("reader", "reader_id"), ("book", "book_id"), ("record", "record_id"),
+                                  ("user", "user_id")) if event[key] is not None)
+            details = " ".join(f"{key}={value}" for key, value in event['details'].items())
+            print(f"#{event['event_id']} {event['event_time']} {event['event_type']}: {subjects} {details}".rstrip())
+    elif args.command == "replay":
+        result = check_open_loans()
+        ok = result is not None
+        if result:
+            not_logged, not_open = result
+            print(f"Open loans not in the log: {len(not_logged)} {not_logged[:20]}")
+            print(f"Logged as open but returned/missing in the database: {len(not_open)} {not_open[:20]}")
+            ok = not not_open
+    db.close_pool()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,503 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database as db
+
+# --- BACKUP SETTINGS ---
+# Pages copied per backup step; the source is only read-locked during a step,
+# so the desk keeps working while a large database is copied
+BACKUP_PAGES_PER_STEP = int(os.environ.get("LIBRARY_BACKUP_PAGES", "1024"))
+# Seconds to wait before retrying a step that found the database busy
+BACKUP_SLEEP = 0.05
+# Rows read per fetchmany() during exports (memory use does not depend on table size)
+EXPORT_BATCH_SIZE = 1000
+# Rows inserted per transaction when restoring an export
+RESTORE_BATCH_SIZE = 5000
+MANIFEST_NAME = "manifest.json"
+# Stands for NULL in CSV exports (an empty field is an empty string)
+CSV_NULL = "\\N"
+# ---------------------
+
+def print_backup_progress(status, remaining, total):
+    done = total - remaining
+    print(f"  ... {done}/{total} pages copied ({done / total:.0%})" if total else "  ... copying")
+
+def _open_text(path, mode):
+    """Opens a text file, gzip-compressed when the name ends in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# ===============================================
+# ===== ONLINE BACKUP =====
+# ===============================================
+
+def backup_database(dest_path, source=None, pages=BACKUP_PAGES_PER_STEP, progress=print_backup_progress):
+    """
+    Copies the live database to 'dest_path' with the SQLite online backup API,
+    'pages' pages per step. In WAL mode the copy is taken inside one read transaction:
+    a consistent snapshot that never blocks borrows and returns. In other journal modes
+    a read transaction would lock out every writer until the end, so each step only
+    read-locks the file and a write by the desk restarts the copy instead.
+    A destination ending in .gz is compressed after the copy.
+    The copy is checked with PRAGMA integrity_check. Returns True on success.
+    """
+    source = source or db.get_pool().database
+    src = db.connect_db(source)
+    if src is None:
+        return False
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(dest_path)))
+        os.close(fd)
+    except OSError as e:
+        print(f"Error: Could not write '{dest_path}': {e}")
+        src.close()
+        return False
+    try:
+        dst = sqlite3.connect(tmp_path)
+        try:
+            pin_snapshot = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+            if pin_snapshot:
+                # Pin one snapshot: other connections' commits no longer restart the backup
+                src.execute("BEGIN")
+                src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            start = time.perf_counter()
+            src.backup(dst, pages=pages, progress=progress, sleep=BACKUP_SLEEP)
+            if pin_snapshot:
+                src.rollback()
+            check = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            dst.close()
+    except sqlite3.Error as e:
+        print(f"Error: Backup failed: {e}")
+        os.remove(tmp_path)
+        return False
+    finally:
+        src.close()
+
+    if check != "ok":
+        print(f"Error: Backup copy failed the integrity check: {check}")
+        os.remove(tmp_path)
+        return False
+
+    try:
+        if dest_path.endswith(".gz"):
+            with open(tmp_path, "rb") as f_in, gzip.open(dest_path, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, dest_path)
+    except OSError as e:
+        print(f"Error: Could not write '{dest_path}': {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    print(f"Backup of '{source}' written to '{dest_path}' in {time.perf_counter() - start:.1f}s.")
+    return True
+
+def _open_backup(path):
+    """Returns (path of a plain SQLite file, temporary file to delete or None)"""
+    if not path.endswith(".gz"):
+        return path, None
+    fd, tmp_path = tempfile.mkstemp(suffix=".db")
+    with os.fdopen(fd, "wb") as f_out, gzip.open(path, "rb") as f_in:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
+    return tmp_path, tmp_path
+
+def verify_backup(path):
+    """
+    Checks a backup file (plain or .gz): integrity, foreign keys, schema version.
+    Returns a dict with the result (and row counts per table), or None if it cannot be read.
+    """
+    try:
+        plain_path, tmp_path = _open_backup(path)
+    except (OSError, EOFError) as e:
+        print(f"Error: Cannot read '{path}': {e}")
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{plain_path}?mode=ro", uri=True)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            fk_errors = len(conn.execute("PRAGMA foreign_key_check").fetchall())
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            counts = {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+                      for name in _data_tables(conn)}
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error: '{path}' is not a valid library database: {e}")
+        return None
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+    return {'ok': integrity == "ok" and fk_errors == 0, 'integrity': integrity,
+            'foreign_key_errors': fk_errors, 'schema_version': version, 'rows': counts}
+
+def restore_backup(backup_path, target=None, pages=BACKUP_PAGES_PER_STEP, progress=print_backup_progress):
+    """
+    Overwrites the database 'target' (default: the live database) with a verified
+    backup, using the backup API in the other direction. Returns True on success.
+    """
+    report = verify_backup(backup_path)
+    if report is None or not report['ok']:
+        print(f"Error: '{backup_path}' failed verification, nothing restored.")
+        return False
+
+    target = target or db.get_pool().database
+    plain_path, tmp_path = _open_backup(backup_path)
+    try:
+        src = sqlite3.connect(f"file:{plain_path}?mode=ro", uri=True)
+        dst = db.connect_db(target)
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=BACKUP_SLEEP)
+        finally:
+            dst.close()
+            src.close()
+    except sqlite3.Error as e:
+        print(f"Error: Restore failed: {e}")
+        return False
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+        # Cached rows describe the old content
+        db.clear_caches()
+
+    print(f"Restored '{backup_path}' into '{target}' (schema version {report['schema_version']}).")
+    return True
+
+# ===============================================
+# ===== STREAMING EXPORT =====
+# ===============================================
+
+def _virtual_tables(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'")]
+
+def _data_tables(conn):
+    """Tables holding data: no sqlite_* tables, virtual tables or their shadow tables"""
+    virtual = _virtual_tables(conn)
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+    return [name for name in names
+            if name not in virtual and not any(name.startswith(v + "_") for v in virtual)]
+
+def iter_table_rows(conn, table, batch_size=EXPORT_BATCH_SIZE):
+    """Streams the rows of a table in rowid order, 'batch_size' rows at a time"""
+    cur = conn.cursor()
+    cur.execute(f'SELECT * FROM "{table}"')
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def export_tables(out_dir, fmt="jsonl", compress=True, tables=None, source=None):
+    """
+    Writes every data table to its own CSV or JSONL file in 'out_dir' (gzip-compressed
+    by default) plus a manifest with the schema, row counts and file checksums.
+    All tables come from one read transaction (a consistent snapshot) and rows are
+    streamed, so memory use stays flat. Returns the manifest dict, or None on error.
+    """
+    if fmt not in ("csv", "jsonl"):
+        print(f"Error: Unknown export format '{fmt}' (use csv or jsonl).")
+        return None
+    os.makedirs(out_dir, exist_ok=True)
+
+    conn = db.connect_db(source or db.get_pool().database)
+    if conn is None:
+        return None
+    manifest = {'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'format': fmt,
+                'schema_version': db.db_get_schema_version(conn), 'tables': []}
+    try:
+        conn.execute("BEGIN")
+        manifest['schema'] = [
+            {'type': kind, 'name': name, 'table': table, 'sql': sql}
+            for kind, name, table, sql in conn.execute(
+                "SELECT type, name, tbl_name, sql FROM sqlite_master "
+                "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid")]
+        for table in tables or _data_tables(conn):
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+            file_name = f"{table}.{fmt}" + (".gz" if compress else "")
+            path = os.path.join(out_dir, file_name)
+            count = 0
+            with _open_text(path, "w") as f:
+                if fmt == "csv":
+                    writer = csv.writer(f)
+                    writer.writerow(columns)
+                    for row in iter_table_rows(conn, table):
+                        writer.writerow([CSV_NULL if value is None else value for value in row])
+                        count += 1
+                else:
+                    for row in iter_table_rows(conn, table):
+                        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+                        count += 1
+            manifest['tables'].append({'name': table, 'file': file_name, 'columns': columns,
+                                       'rows': count, 'sha256': _file_sha256(path)})
+            print(f"  {table}: {count} row(s) -> {file_name}")
+        conn.rollback()
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error: Export failed: {e}")
+        return None
+    finally:
+        conn.close()
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+def _read_manifest(export_dir):
+    try:
+        with open(os.path.join(export_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error: Cannot read the manifest in '{export_dir}': {e}")
+        return None
+
+def _csv_converter(declared_type):
+    """
+    Turns a CSV field back into the type its column declares, following SQLite's
+    affinity rules (INT -> integer, REAL/FLOA/DOUB -> real, NUMERIC -> either).
+    Fields that do not parse (SQLite allows text in any column) stay text.
+    """
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        parsers = (int,)
+    elif any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        parsers = (float,)
+    elif not declared_type or any(name in declared_type for name in ("CHAR", "CLOB", "TEXT", "BLOB")):
+        return None
+    else:
+        parsers = (int, float)
+
+    def convert(value):
+        for parse in parsers:
+            try:
+                return parse(value)
+            except ValueError:
+                pass
+        return value
+    return convert
+
+def iter_export_rows(export_dir, entry, fmt, column_types=None):
+    """
+    Streams one exported table back as tuples in manifest column order.
+    CSV fields are text: 'column_types' (declared type per column) converts them back.
+    """
+    columns = entry['columns']
+    with _open_text(os.path.join(export_dir, entry['file']), "r") as f:
+        if fmt == "csv":
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            converters = [_csv_converter(column_types.get(column)) if column_types else None
+                          for column in columns]
+            for row in reader:
+                yield tuple(None if value == CSV_NULL else convert(value) if convert else value
+                            for value, convert in zip(row, converters))
+        else:
+            for line in f:
+                data = json.loads(line)
+                yield tuple(data.get(column) for column in columns)
+
+def verify_export(export_dir):
+    """
+    Re-reads every exported file and compares checksums and row counts with the
+    manifest. Returns a list of problems (empty if the export is intact), or None.
+    """
+    manifest = _read_manifest(export_dir)
+    if manifest is None:
+        return None
+    problems = []
+    for entry in manifest['tables']:
+        path = os.path.join(export_dir, entry['file'])
+        if not os.path.isfile(path):
+            problems.append(f"{entry['file']}: missing")
+            continue
+        if _file_sha256(path) != entry['sha256']:
+            problems.append(f"{entry['file']}: checksum mismatch")
+        try:
+            count = sum(1 for _ in iter_export_rows(export_dir, entry, manifest['format']))
+        except (OSError, EOFError, ValueError, csv.Error) as e:
+            problems.append(f"{entry['file']}: unreadable ({e})")
+            continue
+        if count != entry['rows']:
+            problems.append(f"{entry['file']}: {count} row(s), manifest says {entry['rows']}")
+    return problems
+
+def restore_export(export_dir, target):
+    """
+    Rebuilds a database from an export into the new file 'target': tables first,
+    then the data in batches, then indexes, virtual tables and triggers (so triggers do
+    not fire during the load), then the search index. The database is built in a
+    temporary file that replaces 'target' only once it is complete. CSV fields get the
+    declared type of their column back. Returns True on success.
+    """
+    if os.path.exists(target):
+        print(f"Error: '{target}' already exists; restore an export into a new file.")
+        return False
+    problems = verify_export(export_dir)
+    if problems is None or problems:
+        for problem in problems or []:
+            print(f"  {problem}")
+        print(f"Error: '{export_dir}' failed verification, nothing restored.")
+        return False
+    manifest = _read_manifest(export_dir)
+
+    schema = manifest['schema']
+    virtual = [item['name'] for item in schema
+               if item['type'] == 'table' and item['sql'].upper().startswith("CREATE VIRTUAL TABLE")]
+    def is_shadow(name):
+        return any(name.startswith(v + "_") for v in virtual)
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(target)))
+        os.close(fd)
+    except OSError as e:
+        print(f"Error: Could not write '{target}': {e}")
+        return False
+    conn = db.connect_db(tmp_path)
+    if conn is None:
+        _remove_database_files(tmp_path)
+        return False
+    restored = False
+    try:
+        conn.execute("PRAGMA foreign_keys = OFF")
+        plain = [item for item in schema if item['type'] != 'table'
+                 or (item['name'] not in virtual and not is_shadow(item['name']))]
+        for item in plain:
+            if item['type'] == 'table':
+                conn.execute(item['sql'])
+        conn.commit()
+
+        for entry in manifest['tables']:
+            column_types = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{entry["name"]}")')}
+            column_list = ", ".join(f'"{column}"' for column in entry['columns'])
+            placeholders = ", ".join("?" * len(entry['columns']))
+            sql = f'INSERT INTO "{entry["name"]}" ({column_list}) VALUES ({placeholders})'
+            batch = []
+            for row in iter_export_rows(export_dir, entry, manifest['format'], column_types):
+                batch.append(row)
+                if len(batch) >= RESTORE_BATCH_SIZE:
+                    db.run_in_transaction(conn, lambda cur, rows=batch: cur.executemany(sql, rows))
+                    batch = []
+            if batch:
+                db.run_in_transaction(conn, lambda cur, rows=batch: cur.executemany(sql, rows))
+            print(f"  {entry['name']}: {entry['rows']} row(s) restored")
+
+        for name in virtual:
+            conn.execute(next(item['sql'] for item in schema if item['name'] == name))
+        for kind in ('index', 'trigger'):
+            for item in plain:
+                if item['type'] == kind:
+                    conn.execute(item['sql'])
+        conn.commit()
+        fk_errors = conn.execute("PRAGMA foreign_key_check").fetchall()
+        conn.execute("PRAGMA foreign_keys = ON")
+        if "books_fts" in virtual:
+            db.db_rebuild_search_index(conn)
+        if "books_trigram" in virtual:
+            db.db_rebuild_trigram_index(conn)
+        # Everything into the main file before it is moved (the -wal file is not)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        restored = True
+    except (sqlite3.Error, OSError, ValueError, csv.Error) as e:
+        print(f"Error: Restore failed: {e}")
+    finally:
+        conn.close()
+
+    try:
+        if restored:
+            os.replace(tmp_path, target)
+    except OSError as e:
+        print(f"Error: Could not write '{target}': {e}")
+        restored = False
+    finally:
+        _remove_database_files(tmp_path)
+    if not restored:
+        return False
+
+    if fk_errors:
+        print(f"Warning: {len(fk_errors)} row(s) violate foreign keys in the restored database.")
+    print(f"Export '{export_dir}' restored into '{target}' (schema version {manifest['schema_version']}).")
+    return True
+
+def _remove_database_files(path):
+    """Deletes a database file and its -wal/-shm companions, if they exist"""
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up, export, verify and restore the library database.")
+    parser.add_argument("--db", help="database file (default: library.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("backup", help="online snapshot to a file (.gz to compress)")
+    p.add_argument("dest")
+    p.add_argument("--pages", type=int, default=BACKUP_PAGES_PER_STEP, help="pages per backup step")
+
+    p = commands.add_parser("export", help="stream every table to CSV/JSONL files")
+    p.add_argument("out_dir")
+    p.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    p.add_argument("--no-compress", action="store_true")
+
+    p = commands.add_parser("verify", help="check a backup file or an export directory")
+    p.add_argument("path")
+
+    p = commands.add_parser("restore", help="restore a backup file (over --db) or an export (into a new file)")
+    p.add_argument("path")
+    p.add_argument("target", nargs="?", help="new database file (exports only)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure_pool(args.db)
+    ok = True
+    if args.command == "backup":
+        ok = backup_database(args.dest, pages=args.pages)
+    elif args.command == "export":
+        ok = export_tables(args.out_dir, args.format, not args.no_compress) is not None
+    elif args.command == "verify":
+        if os.path.isdir(args.path):
+            problems = verify_export(args.path)
+            ok = problems == []
+            for problem in problems or []:
+                print(f"  {problem}")
+        else:
+            report = verify_backup(args.path)
+            ok = report is not None and report['ok']
+            if report:
+                print(f"Integrity: {report['integrity']}, foreign key errors: {report['foreign_key_errors']}, "
+                      f"schema version: {report['schema_version']}")
+                for table, count in report['rows'].items():
+                    print(f"  {table}: {count} row(s)")
+        print("Verification passed." if ok else "Verification FAILED.")
+    elif args.command == "restore":
+        if os.path.isdir(args.path):
+            if not args.target:
+                print("Error: Give the new database file to restore the export into.")
+                ok = False
+            else:
+                ok = restore_export(args.path, args.target)
+        else:
+            ok = restore_backup(args.path, args.target)
+    db.close_pool()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import controller
+import database as db
+import security
+
+try:
+    import resource  # Unix only: used for peak RSS
+except ImportError:
+    resource = None
+
+# --- BENCHMARK DEFAULTS ---
+DEFAULT_BOOKS = 10000
+DEFAULT_READERS = 2000
+DEFAULT_LOANS = 50000
+DEFAULT_YEARS = 3
+DEFAULT_ITERATIONS = 200
+INSERT_BATCH_SIZE = 10000
+# All synthetic readers share this password (hashed once, see generate_dataset)
+SYNTHETIC_PASSWORD = "bench-pass"
+# ---------------------
+
+# Word lists for synthetic titles and authors (with and without Vietnamese accents)
+TITLE_WORDS = ["Truyện", "Kiều", "Đất", "rừng", "phương", "Nam", "Số", "đỏ", "Dế", "Mèn",
+               "History", "Python", "Garden", "River", "Mountain", "Secret", "Harry", "Potter",
+               "Data", "Night", "Ocean", "Light", "Shadow", "Winter", "Code", "Journey"]
+AUTHOR_NAMES = ["Nguyễn Du", "Tô Hoài", "Vũ Trọng Phụng", "Đoàn Giỏi", "Nam Cao",
+                "J. K. Rowling", "Jane Austen", "Mark Twain", "Haruki Murakami", "Leo Tolstoy"]
+GENRES = ["Novel", "Poetry", "Science", "History", "Children", "Technology", "Fantasy"]
+
+# ===============================================
+# ===== SYNTHETIC DATA =====
+# ===============================================
+
+def _batched(rows, size=INSERT_BATCH_SIZE):
+    """Groups a row generator into lists of 'size' rows"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _random_title(rng):
+    return " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 5)))
+
+def generate_dataset(path, books=DEFAULT_BOOKS, readers=DEFAULT_READERS, loans=DEFAULT_LOANS,
+                     years=DEFAULT_YEARS, seed=42, progress=print):
+    """
+    Creates a scratch database with a synthetic catalog, readers and 'years' years of loan
+    history. Rows are generated lazily and inserted in batches, so memory stays flat at any scale.
+    """
+    rng = random.Random(seed)
+    conn = db.connect_db(path)
+    db.create_tables(conn)
+
+    # Maintenance triggers are dropped during the load and their tables rebuilt once at the end
+    db.db_suspend_search_index(conn)
+    conn.executescript("""
+    DROP TRIGGER IF EXISTS stat_after_borrow;
+    DROP TRIGGER IF EXISTS stat_after_return;
+    """)
+
+    start = time.perf_counter()
+    book_rows = ((_random_title(rng), rng.choice(AUTHOR_NAMES), rng.choice(GENRES), 'available')
+                 for _ in range(books))
+    for batch in _batched(book_rows):
+        db.db_add_books_bulk(conn, batch, index=False)
+    progress(f"  {books} books in {time.perf_counter() - start:.1f}s")
+
+    # One hash for every reader: hashing is benchmarked separately (controller_login)
+    password_hash = security.hash_password(SYNTHETIC_PASSWORD)
+    membership = date.today().isoformat()
+    start = time.perf_counter()
+    first_user_id = conn.execute("SELECT COALESCE(MAX(user_id), 0) FROM User").fetchone()[0] + 1
+    user_rows = ((f"bench_reader_{i}", password_hash, f"Reader {i}", f"bench_reader_{i}@example.com",
+                  f"09{i:08d}", 'reader') for i in range(readers))
+    for batch in _batched(user_rows):
+        db.run_in_transaction(conn, lambda cur, rows=batch: cur.executemany(
+            "INSERT INTO User(username, password, name, email, phone, user_type) VALUES (?,?,?,?,?,?)", rows))
+    reader_rows = ((user_id, membership) for user_id in range(first_user_id, first_user_id + readers))
+    for batch in _batched(reader_rows):
+        db.run_in_transaction(conn, lambda cur, rows=batch: cur.executemany(
+            "INSERT INTO READER(user_id, membership_date) VALUES (?,?)", rows))
+    progress(f"  {readers} readers in {time.perf_counter() - start:.1f}s")
+
+    # Loan history: spread over 'years' years; the most recent ~2% are still open
+    first_book = conn.execute("SELECT MIN(book_id) FROM books").fetchone()[0] or 1
+    first_copy = conn.execute("SELECT MIN(copy_id) FROM BOOK_COPY").fetchone()[0] or 1
+    last_book = db.db_get_max_book_id(conn)
+    first_reader = conn.execute("SELECT MIN(reader_id) FROM READER").fetchone()[0] or 1
+    last_reader = conn.execute("SELECT MAX(reader_id) FROM READER").fetchone()[0] or 1
+    today = date.today()
+    history_days = max(1, years * 365)
+    open_loans = loans // 50
+
+    def loan_rows():
+        open_books = set()
+        for i in range(loans):
+            is_open = i >= loans - open_loans
+            book_id = rng.randint(first_book, last_book)
+            if is_open:
+                if book_id in open_books:
+                    continue  # a book can only be on loan once
+                open_books.add(book_id)
+                borrowed = today - timedelta(days=rng.randint(0, 30))
+                returned, fine = None, 0
+            else:
+                borrowed = today - timedelta(days=rng.randint(31, history_days))
+                returned = borrowed + timedelta(days=rng.randint(1, 21))
+                fine = max(0, (returned - borrowed).days - 14) * 1000
+            due = borrowed + timedelta(days=14)
+            # Each generated book has exactly one copy, created in the same order
+            copy_id = book_id - first_book + first_copy
+            yield (book_id, copy_id, rng.randint(first_reader, last_reader), borrowed.isoformat(),
+                   due.isoformat(), returned.isoformat() if returned else None, fine)
+
+    start = time.perf_counter()
+    for batch in _batched(loan_rows()):
+        db.run_in_transaction(conn, lambda cur, rows=batch: cur.executemany(
+            """INSERT INTO BORROWING_RECORD(book_id, copy_id, reader_id, borrow_date, due_date, return_date, fine_amount)
+               VALUES (?,?,?,?,?,?,?)""", rows))
+    db.run_in_transaction(conn, lambda cur: cur.execute(
+        """UPDATE BOOK_COPY SET status = 'borrowed' WHERE copy_id IN
+           (SELECT copy_id FROM BORROWING_RECORD WHERE return_date IS NULL)"""))
+    progress(f"  {loans} loans in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    db.db_resume_search_index(conn, 0)
+    db.create_statistics_tables(conn)
+    db.db_rebuild_statistics(conn)
+    db.db_reconcile_reader_counters(conn)
+    conn.execute("ANALYZE")
+    progress(f"  indexes and summaries rebuilt in {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+# ===============================================
+# ===== TIMING =====
+# ===============================================
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def peak_rss_kb():
+    """Peak resident memory of this process in KB (None where unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def time_operation(name, operation, iterations):
+    """
+    Calls operation(i) 'iterations' times (controller output is discarded) and
+    returns a result dict with p50/p95/p99 latency in ms, ops/sec and peak RSS.
+    """
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        wall_start = time.perf_counter()
+        for i in range(iterations):
+            start = time.perf_counter()
+            operation(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "p50_ms": round(_percentile(latencies, 0.50), 4),
+        "p95_ms": round(_percentile(latencies, 0.95), 4),
+        "p99_ms": round(_percentile(latencies, 0.99), 4),
+        "max_ms": round(latencies[-1], 4) if latencies else 0.0,
+        "ops_per_sec": round(iterations / wall, 1) if wall > 0 else None,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+def run_benchmarks(path, iterations=DEFAULT_ITERATIONS, seed=7):
+    """Times the main data-layer and controller functions against the database at 'path'"""
+    rng = random.Random(seed)
+    db.configure_pool(path)
+    results = []
+
+    with db.pooled_connection() as conn:
+        max_book = db.db_get_max_book_id(conn)
+        reader_ids = [row[0] for row in conn.execute("SELECT reader_id FROM READER ORDER BY reader_id")]
+        usernames = [row[0] for row in conn.execute(
+            "SELECT username FROM User WHERE username LIKE 'bench_reader_%' ORDER BY user_id")]
+        available = [row[0] for row in conn.execute(
+            "SELECT book_id FROM books WHERE status = 'available' LIMIT ?", (iterations,))]
+    keywords = [rng.choice(TITLE_WORDS + AUTHOR_NAMES) for _ in range(iterations)]
+    book_ids = [rng.randint(1, max_book) for _ in range(iterations)]
+
+    def with_conn(func):
+        def operation(i):
+            with db.pooled_connection() as conn:
+                func(conn, i)
+        return operation
+
+    db.clear_caches()
+    results.append(time_operation("db_get_book_by_id (cold cache)",
+                                  with_conn(lambda conn, i: db.db_get_book_by_id(conn, book_ids[i])),
+                                  iterations))
+    results.append(time_operation("db_get_book_by_id (warm cache)",
+                                  with_conn(lambda conn, i: db.db_get_book_by_id(conn, book_ids[i])),
+                                  iterations))
+    db.clear_caches()
+    results.append(time_operation("db_search_books (cold cache)",
+                                  with_conn(lambda conn, i: db.db_search_books(conn, keywords[i])),
+                                  iterations))
+    # One typo per keyword: drop a letter
+    typos = [word[:len(word) // 2] + word[len(word) // 2 + 1:] for word in keywords]
+    db.clear_caches()
+    results.append(time_operation("db_fuzzy_search_books (cold cache)",
+                                  with_conn(lambda conn, i: db.db_fuzzy_search_books(conn, typos[i])),
+                                  iterations))
+    db.clear_caches()
+    results.append(time_operation("db_faceted_search (genre filter, by title)",
+                                  with_conn(lambda conn, i: db.db_faceted_search(
+                                      conn, genre=GENRES[i % len(GENRES)], status='available')),
+                                  iterations))
+    results.append(time_operation("controller_search_book_page",
+                                  lambda i: controller.controller_search_book_page(keywords[i]),
+                                  iterations))
+    results.append(time_operation("controller_list_books",
+                                  lambda i: controller.controller_list_books(book_ids[i]),
+                                  iterations))
+
+    # Borrow then return the same book, so the catalog state is unchanged afterwards
+    loan_cycles = min(iterations, len(available), len(reader_ids))
+    if loan_cycles:
+        old_limit = controller.MAX_LOANS_PER_READER
+        controller.MAX_LOANS_PER_READER = 0
+        try:
+            results.append(time_operation("controller_borrow_book",
+                                          lambda i: controller.controller_borrow_book(reader_ids[i], available[i]),
+                                          loan_cycles))
+            results.append(time_operation("controller_process_return",
+                                          lambda i: controller.controller_process_return(available[i]),
+                                          loan_cycles))
+        finally:
+            controller.MAX_LOANS_PER_READER = old_limit
+
+    # One login per reader account, so the per-username rate limit never kicks in
+    logins = min(iterations, len(usernames), 50)
+    if logins:
+        results.append(time_operation("controller_login",
+                                      lambda i: controller.controller_login(usernames[i], SYNTHETIC_PASSWORD),
+                                      logins))
+
+    results.append(time_operation("controller_get_statistics",
+                                  lambda i: controller.controller_get_statistics(days=30),
+                                  min(iterations, 50)))
+    db.close_pool()
+    return results
+
+# ===============================================
+# ===== REPORTING =====
+# ===============================================
+
+def print_results(results, previous=None):
+    """Prints a results table; with 'previous' (an earlier run) also the p50 change"""
+    before = {r["name"]: r for r in previous["results"]} if previous else {}
+    print(f"{'operation':<34}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}"
+          + ("   p50 vs previous" if previous else ""))
+    for r in results:
+        line = f"{r['name']:<34}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['ops_per_sec']:>10}"
+        old = before.get(r["name"])
+        if old and old["p50_ms"]:
+            change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+            line += f"   {change:+.1f}%"
+        print(line)
+    rss = results[-1]["peak_rss_kb"] if results else None
+    if rss is not None:
+        print(f"Peak RSS: {rss / 1024:.1f} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the library data and controller layers.")
+    parser.add_argument("--books", type=int, default=DEFAULT_BOOKS)
+    parser.add_argument("--readers", type=int, default=DEFAULT_READERS)
+    parser.add_argument("--loans", type=int, default=DEFAULT_LOANS)
+    parser.add_argument("--years", type=int, default=DEFAULT_YEARS)
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="scratch database path (default: a temporary file)")
+    parser.add_argument("--reuse", action="store_true", help="benchmark an existing --db without generating data")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="library-bench-"), "bench.db")
+    if not args.reuse:
+        if os.path.exists(path):
+            print(f"Error: '{path}' already exists (use --reuse to benchmark it as is).")
+            return 1
+        print(f"Generating synthetic data in {path} ...")
+        generate_dataset(path, args.books, args.readers, args.loans, args.years, args.seed)
+
+    print(f"Running benchmarks ({args.iterations} iterations) ...")
+    results = run_benchmarks(path, args.iterations)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": {"books": args.books, "readers": args.readers, "loans": args.loans, "years": args.years},
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "platform": platform.platform()},
+        "storage_profile": db.STORAGE_PROFILE,
+        "results": results,
+    }
+
+    previous = None
+    if args.compare:
+        try:
+            with open(args.compare, encoding="utf-8") as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading '{args.compare}': {e}")
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if not args.keep and not args.reuse:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+import sys
+
+import database as db
+
+# --- IMPORT SETTINGS ---
+# Rows inserted per transaction (one commit/fsync per batch instead of per book)
+DEFAULT_BATCH_SIZE = 5000
+# How many rejected rows are kept in memory for the final report
+MAX_REPORTED_REJECTS = 100
+VALID_STATUSES = ('available', 'borrowed')
+# ---------------------
+
+class ImportReport:
+    """
+    Result of a catalog import: counters plus the first rejected rows.
+    """
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.batches = 0
+        self.rejects = []  # (line number, reason), at most MAX_REPORTED_REJECTS
+
+    def reject(self, line_no, reason, reject_file=None):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append((line_no, reason))
+        if reject_file is not None:
+            reject_file.write(f"{line_no}\t{reason}\n")
+
+    def get_summary(self) -> str:
+        return f"{self.imported} book(s) imported, {self.rejected} row(s) rejected in {self.batches} batch(es)"
+
+def iter_catalog_rows(path):
+    """
+    Streams (line_no, row) pairs from a CSV file (with a header row) or a JSONL file.
+    Rows are read one at a time, so memory use does not depend on the file size.
+    A JSONL line that cannot be parsed is yielded as (line_no, None).
+    """
+    if path.lower().endswith(('.jsonl', '.json')):
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, None
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            # Line 1 is the header row
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                yield line_no, row
+
+def validate_book_row(row):
+    """Returns a (title, author, genre, status) tuple or raises ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError("malformed row")
+
+    title = str(row.get('title') or '').strip()
+    if not title:
+        raise ValueError("missing title")
+    author = str(row.get('author') or '').strip() or None
+    genre = str(row.get('genre') or '').strip() or None
+    status = str(row.get('status') or 'available').strip().lower()
+    if status not in VALID_STATUSES:
+        raise ValueError(f"invalid status '{status}'")
+
+    return (title, author, genre, status)
+
+def print_progress(report):
+    print(f"  ... {report.imported} imported, {report.rejected} rejected")
+
+def import_catalog(path, batch_size=DEFAULT_BATCH_SIZE, rebuild_indexes=True,
+                   progress=print_progress, reject_path=None):
+    """
+    Bulk-loads books from a CSV/JSONL file.
+    Valid rows are inserted in batches of 'batch_size' (one transaction per batch);
+    invalid rows are counted, reported and optionally written to 'reject_path'.
+    Secondary indexes on books and the search index are rebuilt once after the load.
+    Returns an ImportReport, or None if the import could not start.
+    """
+    if not os.path.isfile(path):
+        print(f"Error: File '{path}' not found.")
+        return None
+
+    report = ImportReport()
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        first_new_id = db.db_get_max_book_id(conn)
+        saved_indexes = []
+        if rebuild_indexes:
+            # SUSPENDED_INDEX records what is dropped, in case the load never finishes
+            if not db.run_migrations(conn):
+                return None
+            saved_indexes = db.db_drop_secondary_indexes(conn, 'books')
+            db.db_suspend_search_index(conn)
+
+        reject_file = open(reject_path, 'w', encoding='utf-8') if reject_path else None
+        try:
+            batch = []
+            for line_no, row in iter_catalog_rows(path):
+                try:
+                    batch.append(validate_book_row(row))
+                except ValueError as e:
+                    report.reject(line_no, str(e), reject_file)
+                    continue
+
+                if len(batch) >= batch_size:
+                    report.imported += db.db_add_books_bulk(conn, batch, index=not rebuild_indexes)
+                    report.batches += 1
+                    batch = []
+                    if progress:
+                        progress(report)
+
+            if batch:
+                report.imported += db.db_add_books_bulk(conn, batch, index=not rebuild_indexes)
+                report.batches += 1
+                if progress:
+                    progress(report)
+        except (OSError, UnicodeDecodeError, csv.Error, db.Error) as e:
+            # Batches committed so far stay in the catalog
+            print(f"Error: Import stopped after {report.imported} book(s): {e}")
+        finally:
+            if reject_file is not None:
+                reject_file.close()
+            if rebuild_indexes:
+                db.db_restore_indexes(conn, saved_indexes)
+                db.db_resume_search_index(conn, first_new_id)
+
+    return report
+
+if __name__ == '__main__':
+    # Usage: python catalog_import.py books.csv [batch_size] [rejects.tsv]
+    if len(sys.argv) < 2:
+        print("Usage: python catalog_import.py <file.csv|file.jsonl> [batch_size] [reject_file]")
+        sys.exit(1)
+
+    file_path = sys.argv[1]
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BATCH_SIZE
+    rejects_out = sys.argv[3] if len(sys.argv) > 3 else None
+
+    result = import_catalog(file_path, batch_size=size, reject_path=rejects_out)
+    db.close_pool()
+    if result is None:
+        sys.exit(1)
+    print(result.get_summary())
+    for bad_line, bad_reason in result.rejects:
+        print(f"  Line {bad_line}: {bad_reason}")
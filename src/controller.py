@@ -1,90 +1,137 @@
 import database as db  
 import models as models 
+import catalog_import
+import security
+import audit
+import notices
+import os
 from datetime import date, timedelta
 
-def controller_login(username, password):
+# Maximum number of books a reader may hold at the same time (0 = no limit)
+MAX_LOANS_PER_READER = int(os.environ.get("LIBRARY_MAX_LOANS_PER_READER", "5"))
+# Largest basket accepted by controller_checkout_batch (one IN (...) parameter per book)
+MAX_CHECKOUT_ITEMS = 50
+# Days a returned copy waits on the hold shelf for the reader at the head of the queue
+HOLD_SHELF_DAYS = int(os.environ.get("LIBRARY_HOLD_SHELF_DAYS", "3"))
+
+# --- IDENTITY CACHE ---
+# Identity rows of logged-in users by user_id, so later actions do not re-query the
+# role tables. Bounded like the book cache; entries expire after IDENTITY_CACHE_TTL
+# seconds and are dropped on logout. Password hashes are never cached.
+IDENTITY_CACHE_SIZE = 10000
+IDENTITY_CACHE_TTL = 300
+_identity_cache = db.LRUCache(IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL)  # user_id -> identity row
+
+def _cache_identity(identity_row):
+    _identity_cache.put(identity_row[0], identity_row[:2] + (None,) + identity_row[3:])
+
+def _build_user(identity_row):
+    """Builds the right models.User subclass from a db_get_identity_* row (None on data errors)"""
+    (db_user_id, db_username, db_password, db_name, db_email, db_phone, db_user_type,
+     reader_id, staff_id, role, admin_id, privilege_level) = identity_row
+
+    if db_user_type == 'reader':
+        if reader_id is not None:
+            return models.Reader(db_user_id, db_username, db_name, db_email, db_password, 
+                                 reader_id=reader_id)
+        print(f"Data Error: User {db_username} is 'reader' but no READER record found.")
+
+    elif db_user_type == 'librarian':
+        if staff_id is not None:
+            return models.Librarian(db_user_id, db_username, db_name, db_email, db_password, 
+                                    staff_id=staff_id, role=role)
+        print(f"Data Error: User {db_username} is 'librarian' but no LIBRARIAN record found.")
+
+    elif db_user_type == 'admin':
+        if staff_id is not None and admin_id is not None:
+            return models.Admin(db_user_id, db_username, db_name, db_email, db_password, 
+                                staff_id=staff_id, role=role, 
+                                admin_id=admin_id, privilege_level=privilege_level)
+        print(f"Data Error: User {db_username} is 'admin' but missing LIBRARIAN or ADMIN record.")
+
+    else: 
+        return models.User(db_user_id, db_username, db_name, db_email, db_password)
+
+    return None
+
+def controller_login(username, password, client_ip=None):
     
-    conn = db.connect_db()
-    if conn is None:
+    # Checked before any hashing, so a burst of guesses cannot tie up the CPU
+    if not security.allow_login_attempt(username, client_ip):
+        print("Error: Too many login attempts. Please wait and try again.")
+        audit.record('login_failed', username=username, ip=client_ip, reason='rate_limited')
         return None
 
-    try:
-        
-        user_data = db.db_get_user_by_username(conn, username)
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
 
-        if user_data is None:
+        # User row and role details in a single query
+        identity = db.db_get_identity_by_username(conn, username)
+
+        if identity is None:
+            security.burn_verification_time(password)
             print("Error: Username does not exist.")
+            audit.record('login_failed', username=username, ip=client_ip, reason='unknown_user')
             return None
 
-        
-        db_user_id, db_username, db_password, db_name, db_email, db_phone, db_user_type = user_data
+        db_user_id, db_password, db_name, db_user_type = identity[0], identity[2], identity[3], identity[6]
 
-        
-        if password == db_password:
-            print(f"Login successful! Welcome {db_name} (Role: {db_user_type})")
-
-            
-            user_obj = None
-            
-            if db_user_type == 'reader':
-                reader_details = db.db_get_reader_by_user_id(conn, db_user_id)
-                if reader_details:
-                    actual_reader_id = reader_details[0] 
-                    user_obj = models.Reader(db_user_id, db_username, db_name, db_email, password, 
-                                            reader_id=actual_reader_id)
-                else:
-                    print(f"Data Error: User {username} is 'reader' but no READER record found.")
-            
-            elif db_user_type == 'librarian':
-                librarian_details = db.db_get_librarian_by_user_id(conn, db_user_id)
-                if librarian_details:
-                    actual_staff_id = librarian_details[1] 
-                    actual_role = librarian_details[2]     
-                    user_obj = models.Librarian(db_user_id, db_username, db_name, db_email, password, 
-                                                staff_id=actual_staff_id, role=actual_role)
-                else:
-                    print(f"Data Error: User {username} is 'librarian' but no LIBRARIAN record found.")
-            
-            elif db_user_type == 'admin':
-                
-                librarian_details = db.db_get_librarian_by_user_id(conn, db_user_id)
-                admin_details = db.db_get_admin_by_user_id(conn, db_user_id)
-                
-                if librarian_details and admin_details:
-                    staff_id = librarian_details[1]
-                    role = librarian_details[2]
-                    admin_id = admin_details[0]
-                    privilege_level = admin_details[1]
-                    
-                    user_obj = models.Admin(db_user_id, db_username, db_name, db_email, password, 
-                                            staff_id=staff_id, role=role, 
-                                            admin_id=admin_id, privilege_level=privilege_level)
-                else:
-                    print(f"Data Error: User {username} is 'admin' but missing LIBRARIAN or ADMIN record.")
-
-            else: 
-                
-                user_obj = models.User(db_user_id, db_username, db_name, db_email, password)
-
-            return user_obj
-        
-        else:
+        if not security.verify_password(password, db_password):
             print("Error:Incorrect password.")
+            audit.record('login_failed', db_user_id, username=username, ip=client_ip, reason='wrong_password')
             return None
 
-    finally:
-        
-        conn.close() 
+        print(f"Login successful! Welcome {db_name} (Role: {db_user_type})")
+        audit.record('login_succeeded', db_user_id, username=username, ip=client_ip)
+
+        # Upgrade plain-text passwords and hashes made with an old cost setting
+        if security.needs_rehash(db_password):
+            new_hash = security.hash_password(password)
+            if db.db_update_user_password(conn, db_user_id, new_hash):
+                identity = identity[:2] + (new_hash,) + identity[3:]
+
+        user_obj = _build_user(identity)
+        if user_obj is not None:
+            _cache_identity(identity)
+        return user_obj
+
+def controller_get_user(user_id):
+    """
+    Returns the logged-in user object for user_id: built from the cached identity row
+    if it is still fresh, otherwise with one joined query. None if the user does not exist.
+    Users built from the cache carry no password hash.
+    """
+    identity = _identity_cache.get(user_id)
+    if identity is not None:
+        return _build_user(identity)
+
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+        identity = db.db_get_identity_by_user_id(conn, user_id)
+
+    if identity is None:
+        return None
+    user_obj = _build_user(identity)
+    if user_obj is not None:
+        _cache_identity(identity)
+    return user_obj
+
+def controller_logout(user):
+    """Logs a user out and drops them from the identity cache"""
+    _identity_cache.invalidate(user.user_id)
+    user.logout()
         
 def controller_register_reader(username, password, name, email, phone):
     
-    conn = db.connect_db()
-    if conn is None:
-        return None
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
 
-    try:
         
-        user_id = db.db_add_user(conn, username, password, name, email, phone, 'reader')
+        password_hash = security.hash_password(password)
+        user_id = db.db_add_user(conn, username, password_hash, name, email, phone, 'reader')
 
         if user_id is None:
             return None 
@@ -95,94 +142,454 @@ def controller_register_reader(username, password, name, email, phone):
 
         if reader_id:
             print(f"Reader '{name}' registered successfully!")
+            audit.record('reader_registered', user_id, reader_id, username=username)
             return reader_id
         else:
             print("Reader registration failed at Reader creation step.")
             return None
 
-    finally:
-        conn.close()
 
 
 
 def controller_add_new_book(title, author, genre):
 
-    conn = db.connect_db()
-    if conn is None:
-        return False
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return False
 
-    try:
         book_id = db.db_add_book(conn, title, author, genre, 'available')
         if book_id:
             print(f"Added book '{title}' (ID: {book_id}) to the system.")
+            audit.record('book_added', book_id=book_id, title=title)
             return True
         else:
             print("Failed to add book.")
             return False
-    finally:
-        conn.close()
 
-def controller_search_book(keyword):
-    
-    conn = db.connect_db()
-    if conn is None:
-        return [] 
 
-    try:
-        results = db.db_search_books(conn, keyword)
+def controller_add_copies(book_id, count=1, barcodes=None):
+    """Adds physical copies of an existing title (automatic barcodes unless given)"""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return False
 
-        book_list = []
-        for row in results:
-            
-            book_obj = models.Book(book_id=row[0], title=row[1], author=row[2], genre=row[3], status=row[4])
-            book_list.append(book_obj)
+        added = db.db_add_copies(conn, book_id, count, barcodes, date.today().isoformat(), HOLD_SHELF_DAYS)
+        if added:
+            print(f"Added {added} cop{'y' if added == 1 else 'ies'} of book {book_id}.")
+        return added > 0
 
-        return book_list
-    finally:
-        conn.close()
+def controller_get_copies(book_id):
+    """Rows (copy_id, barcode, status, added_date) of a title's copies"""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return []
+        return db.db_get_copies(conn, book_id)
 
-def controller_borrow_book(reader_id, book_id):
+def controller_import_books(file_path, batch_size=catalog_import.DEFAULT_BATCH_SIZE):
     """
-    Handles logic for borrowing a book.
+    Bulk-imports a CSV/JSONL catalog file. Returns an ImportReport (None on failure).
     """
-    conn = db.connect_db()
-    if conn is None:
-        return False
+    report = catalog_import.import_catalog(file_path, batch_size=batch_size)
+    if report is None:
+        print("Import failed.")
+        return None
 
-    try:
-        
-        book_data = db.db_get_book_by_id(conn, book_id)
-        if book_data is None:
-            print(f"Error: Book with ID {book_id} not found.")
-            return False
+    print(f"Import finished: {report.get_summary()}.")
+    audit.record('catalog_imported', file=os.path.basename(file_path), summary=report.get_summary())
+    for line_no, reason in report.rejects:
+        print(f"  Rejected line {line_no}: {reason}")
+    if report.rejected > len(report.rejects):
+        print(f"  ... and {report.rejected - len(report.rejects)} more rejected row(s).")
+    return report
 
-        book_status = book_data[4] 
+def controller_search_book(keyword, fuzzy=False, threshold=None):
+    """
+    Returns the matching books as a models.ResultView:
+    rows are turned into models.Book objects only when they are accessed.
+    fuzzy=True tolerates typos ('harry poter'): closest titles/authors first,
+    keeping those that share at least 'threshold' of the keyword's trigrams.
+    """
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return [] 
 
-        if book_status == 'borrowed':
-            print(f"Error: Book '{book_data[1]}' is currently borrowed.")
-            return False
+        if fuzzy:
+            results = db.db_fuzzy_search_books(conn, keyword, threshold)
+        else:
+            results = db.db_search_books(conn, keyword)
+        return models.ResultView(results, models.Book.from_row)
 
-        
-        success_update = db.db_update_book_status(conn, book_id, 'borrowed')
+def controller_search_book_page(keyword, cursor=None, page_size=db.DEFAULT_PAGE_SIZE):
+    """
+    Returns one models.Page of search results (best matches first).
+    Pass page.next_cursor back in to get the next page.
+    """
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return models.Page([])
+
+        rows, next_cursor = db.db_search_books_page(conn, keyword, cursor, page_size)
+        return models.Page(models.ResultView(rows, models.Book.from_row), next_cursor)
 
-        if not success_update:
-            print("Error: Could not update book status.")
+def controller_search_books_faceted(keyword="", genre=None, status=None, author=None, sort=None,
+                                    cursor=None, page_size=db.DEFAULT_PAGE_SIZE):
+    """
+    Structured search: keyword (optional) plus exact genre/status/author filters and a
+    sort key (relevance, title, author, newest).
+    Returns (models.Page, facets) where facets holds the matching books per genre and
+    per status, e.g. {"genre": [("Novel", 12), ...], "status": [...], "total": 15};
+    None on error.
+    """
+    if sort is not None and sort not in db.SEARCH_SORT_KEYS:
+        print(f"Error: Unknown sort key '{sort}' (use one of: {', '.join(db.SEARCH_SORT_KEYS)}).")
+        return None
+
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        result = db.db_faceted_search(conn, keyword, genre, status, author, sort, cursor, page_size)
+        if result is None:
+            return None
+        rows, next_cursor, facets = result
+        return models.Page(models.ResultView(rows, models.Book.from_row), next_cursor), facets
+
+def controller_list_books(after_book_id=0, page_size=db.DEFAULT_PAGE_SIZE):
+    """Returns one models.Page of the catalog, ordered by book ID"""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return models.Page([])
+
+        # Fetch one extra row to know whether another page exists
+        rows = db.db_list_books_page(conn, after_book_id, page_size + 1)
+        next_cursor = rows[page_size - 1][0] if len(rows) > page_size else None
+        return models.Page(models.ResultView(rows[:page_size], models.Book.from_row), next_cursor)
+
+def controller_list_readers(after_reader_id=0, page_size=db.DEFAULT_PAGE_SIZE):
+    """Returns one models.Page of readers, ordered by reader ID"""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return models.Page([])
+
+        rows = db.db_list_readers_page(conn, after_reader_id, page_size + 1)
+        readers = []
+        for row in rows[:page_size]:
+            reader_id, user_id, username, name, email, phone, membership_date, total_borrowed = row
+            # Listings never carry passwords
+            readers.append(models.Reader(user_id, username, name, email, None, reader_id=reader_id))
+        next_cursor = readers[-1].reader_id if len(rows) > page_size else None
+        return models.Page(readers, next_cursor)
+
+def controller_borrow_book(reader_id, book_id):
+    """
+    Handles logic for borrowing a book.
+    The availability check, the status update and the borrow record
+    happen in one transaction, so two desks can never lend the same copy.
+    """
+    with db.pooled_connection() as conn:
+        if conn is None:
             return False
 
-        
         borrow_date = date.today()
         due_date = borrow_date + timedelta(days=14) 
 
-        record_id = db.db_create_borrow_record(conn, book_id, reader_id, 
-                                               borrow_date.isoformat(), 
-                                               due_date.isoformat())
+        record_id, reason = db.db_borrow_book(conn, book_id, reader_id,
+                                              borrow_date.isoformat(),
+                                              due_date.isoformat(),
+                                              MAX_LOANS_PER_READER or None)
 
         if record_id:
             print(f"Reader {reader_id} successfully borrowed book {book_id}.")
+            audit.record('borrowed', reader_id=reader_id, book_id=book_id, record_id=record_id,
+                         due_date=due_date.isoformat())
             return True
+        elif reason == 'not_found':
+            print(f"Error: Book with ID {book_id} not found.")
+        elif reason == 'borrowed':
+            print(f"Error: All copies of book {book_id} are currently borrowed (a hold can be placed).")
+        elif reason == 'invalid_reader':
+            print(f"Error: Reader with ID {reader_id} not found.")
+        elif reason == 'limit_reached':
+            print(f"Error: Reader {reader_id} already has {MAX_LOANS_PER_READER} book(s) on loan (the limit).")
         else:
             print("Error: Could not create borrow record.")
+        return False
+
+_CHECKOUT_MESSAGES = {
+    'not_found': "not found",
+    'borrowed': "all copies are borrowed",
+    'duplicate': "listed twice",
+    'limit_reached': "loan limit reached",
+}
+
+def controller_checkout_batch(reader_id, book_ids):
+    """
+    Borrows a basket of books for one reader in a single transaction.
+    Returns a list of (book_id, borrowed, message) in the order given
+    (an empty list if the checkout could not run at all).
+    """
+    book_ids = list(book_ids)
+    if not book_ids:
+        return []
+    if len(book_ids) > MAX_CHECKOUT_ITEMS:
+        print(f"Error: At most {MAX_CHECKOUT_ITEMS} books can be checked out at once.")
+        return []
+
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return []
+
+        borrow_date = date.today()
+        due_date = borrow_date + timedelta(days=14)
+        outcomes, reason = db.db_checkout_batch(conn, reader_id, book_ids,
+                                                borrow_date.isoformat(), due_date.isoformat(),
+                                                MAX_LOANS_PER_READER or None)
+        if outcomes is None:
+            if reason == 'invalid_reader':
+                print(f"Error: Reader with ID {reader_id} not found.")
+            else:
+                print("Error: Could not record the checkout.")
+            return []
+
+        results = []
+        for book_id, record_id, failure in outcomes:
+            if record_id:
+                results.append((book_id, True, f"borrowed (record {record_id})"))
+                audit.record('borrowed', reader_id=reader_id, book_id=book_id, record_id=record_id,
+                             due_date=due_date.isoformat(), checkout=True)
+            else:
+                results.append((book_id, False, _CHECKOUT_MESSAGES.get(failure, failure)))
+        borrowed = sum(1 for _, ok, _ in results if ok)
+        print(f"Reader {reader_id} checked out {borrowed} of {len(results)} book(s), due {due_date.isoformat()}.")
+        return results
+
+def controller_process_return(book_id, return_date=None, barcode=None, reader_id=None):
+    """
+    Handles logic for returning a book: closes the open loan, computes the fine
+    and makes the copy available again, all in one transaction.
+    With 'barcode' the loan of that copy is closed (book_id may then be None).
+    With 'reader_id' only a loan of that reader can be closed (self-service returns).
+    Returns the fine amount, or None if the return failed.
+    """
+    return_date = return_date or date.today()
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        copy_id = None
+        if barcode:
+            copy = db.db_get_copy_by_barcode(conn, barcode)
+            if copy is None:
+                print(f"Error: No copy with barcode '{barcode}'.")
+                return None
+            copy_id, book_id, _ = copy
+
+        record_id, fine_amount, hold, reason = db.db_return_book(conn, book_id, return_date.isoformat(),
+                                                                 models.FINE_PER_DAY, copy_id, HOLD_SHELF_DAYS,
+                                                                 reader_id)
+        if record_id:
+            print(f"Book {book_id} returned (record {record_id}).")
+            # The writer fills in the reader from the loan record
+            audit.record('returned', book_id=book_id, record_id=record_id, fine=fine_amount,
+                         **({'barcode': barcode} if barcode else {}))
+            if hold:
+                print(f"Put the copy on the hold shelf for reader {hold[1]} (hold {hold[0]}).")
+            if fine_amount > 0:
+                print(f"Late return: fine of {fine_amount:,.0f} VND.")
+            return fine_amount
+        elif reason == 'not_borrowed':
+            print(f"Error: Book {book_id} is not currently on loan.")
+        else:
+            print("Error: Could not process the return.")
+        return None
+
+def controller_place_hold(reader_id, book_id):
+    """
+    Queues a reader for a title whose copies are all out.
+    Returns the hold ID, or None if the hold was not placed.
+    """
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        hold_id, reason = db.db_place_hold(conn, book_id, reader_id, date.today().isoformat())
+        if hold_id:
+            position = db.db_get_hold_position(conn, hold_id)
+            print(f"Hold {hold_id} placed for reader {reader_id} on book {book_id} (position {position} in the queue).")
+            audit.record('hold_placed', reader_id=reader_id, book_id=book_id, hold_id=hold_id)
+            return hold_id
+        elif reason == 'not_found':
+            print(f"Error: Book with ID {book_id} not found.")
+        elif reason == 'invalid_reader':
+            print(f"Error: Reader with ID {reader_id} not found.")
+        elif reason == 'available':
+            print(f"Error: Book {book_id} has a free copy; it can be borrowed now.")
+        elif reason == 'duplicate':
+            print(f"Error: Reader {reader_id} already has a hold on book {book_id}.")
+        else:
+            print("Error: Could not place the hold.")
+        return None
+
+def controller_cancel_hold(hold_id, reader_id=None):
+    """Cancels a hold (only the reader's own when reader_id is given). Returns True on success."""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return False
+
+        cancelled, detail = db.db_cancel_hold(conn, hold_id, date.today().isoformat(),
+                                              HOLD_SHELF_DAYS, reader_id)
+        if cancelled:
+            print(f"Hold {hold_id} cancelled.")
+            audit.record('hold_cancelled', reader_id=reader_id, hold_id=hold_id)
+            if detail:
+                print(f"Its copy now waits on the hold shelf for reader {detail[1]} (hold {detail[0]}).")
+            return True
+        if detail == 'not_found':
+            print(f"Error: No active hold with ID {hold_id}.")
+        return False
+
+def controller_get_reader_holds(reader_id):
+    """Active holds of a reader: rows (hold_id, book_id, title, status, placed_date, expires_on, position)"""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return []
+        return db.db_get_reader_holds(conn, reader_id)
+
+def controller_expire_holds(as_of=None):
+    """
+    End-of-day run: expires hold-shelf copies that were not picked up in time
+    and passes them to the next reader in line. Returns (expired, reassigned) or None.
+    """
+    as_of = as_of or date.today()
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        summary = db.db_expire_holds(conn, as_of.isoformat(), HOLD_SHELF_DAYS)
+        if summary is None:
+            print("Error: Hold expiry failed.")
+            return None
+        expired, reassigned = summary
+        print(f"Hold expiry for {as_of.isoformat()}: {expired} hold(s) expired, "
+              f"{reassigned} cop(ies) passed to the next reader.")
+        return summary
+
+def controller_assess_fines(as_of=None):
+    """
+    End-of-day run: updates the accrued fine of every overdue open loan.
+    Returns (overdue_loans, total_fines), or None on failure.
+    """
+    as_of = as_of or date.today()
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        summary = db.db_assess_overdue_fines(conn, as_of.isoformat(), models.FINE_PER_DAY)
+        if summary is None:
+            print("Error: Fine assessment failed.")
+            return None
+
+        overdue_loans, total_fines = summary
+        print(f"Fine assessment for {as_of.isoformat()}: {overdue_loans} overdue loan(s), "
+              f"{total_fines:,.0f} VND accrued.")
+        return overdue_loans, total_fines
+
+def controller_refresh_fuzzy_index():
+    """
+    End-of-day run: indexes books still queued for fuzzy search (changed by direct
+    SQL or by a write that stopped before indexing). Returns the number indexed, or None.
+    """
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        indexed = db.db_refresh_trigram_index(conn)
+        if indexed:
+            print(f"Fuzzy search index: {indexed} book(s) indexed.")
+        return indexed
+
+def controller_queue_notices(as_of=None):
+    """
+    End-of-day run: queues overdue and due-soon notices in the outbox
+    (python notices.py export hands them to the mail/SMS gateway).
+    Returns {notice_type: (loans_scanned, notices_queued)}, or None on failure.
+    """
+    summary = notices.run_all(as_of)
+    if summary is None:
+        print("Error: Notice run failed.")
+        return None
+
+    for notice_type, (scanned, queued) in summary.items():
+        label = notice_type.replace('_', '-')
+        print(f"{label.capitalize()} notices: {queued} new notice(s) queued ({scanned} loan(s) scanned).")
+    return summary
+
+def controller_get_statistics(days=30, top_n=5, as_of=None):
+    """
+    Builds the library report for the last 'days' days from the summary tables:
+    loans/returns per day, fines collected, top borrowed books, active readers
+    and current overdue loans. Returns a dict (None on failure).
+    """
+    as_of = as_of or date.today()
+    since = (as_of - timedelta(days=days - 1)).isoformat()
+    until = as_of.isoformat()
+
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        try:
+            daily = db.db_get_daily_activity(conn, since, until)
+            return {
+                'since': since,
+                'until': until,
+                'daily': daily,
+                'total_loans': sum(row[1] for row in daily),
+                'total_returns': sum(row[2] for row in daily),
+                'fines_collected': sum(row[3] for row in daily),
+                'top_books': db.db_get_top_borrowed_books(conn, top_n),
+                'active_readers': db.db_count_active_readers(conn, since),
+                'overdue_loans': db.db_count_overdue_loans(conn, until),
+            }
+        except db.Error as e:
+            print(f"Error building statistics: {e}")
+            return None
+
+def controller_rebuild_statistics():
+    """Recomputes the statistics summary tables from the full loan history"""
+    with db.pooled_connection() as conn:
+        if conn is None:
             return False
+        if db.db_rebuild_statistics(conn):
+            print("Statistics rebuilt from the loan history.")
+            return True
+        return False
 
-    finally:
-        conn.close()
+def controller_reconcile_reader_counters():
+    """Recomputes every reader's loan counters and reports the ones that had drifted"""
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        drift = db.db_reconcile_reader_counters(conn)
+        if drift is None:
+            return None
+        for reader_id, old_total, old_current, new_total, new_current in drift:
+            print(f"Reader {reader_id}: total {old_total} -> {new_total}, current {old_current} -> {new_current}")
+        print(f"{len(drift)} reader(s) had drifted counters (now corrected).")
+        return drift
+
+def controller_get_performance_stats(top_statements=10):
+    """Counters of the data-layer caches, the most expensive SQL statements and the audit writer"""
+    return {'caches': db.get_cache_stats(), 'queries': db.get_query_stats(top=top_statements),
+            'audit': audit.get_audit_stats()}
+
+def controller_dump_query_stats(file_path):
+    """Writes the statistics of every SQL statement to a JSON file"""
+    if db.dump_query_stats(file_path):
+        print(f"Query statistics written to '{file_path}'.")
+        return True
+    return False
+
+def controller_reset_query_stats():
+    db.reset_query_stats()
@@ -1,6 +1,19 @@
 import sqlite3
 from sqlite3 import Error
 import os # <-- Added 'os' library
+import json
+import math
+import queue
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import security
 
 # --- PATH FIX ---
 # Get the absolute path of the directory containing this file (i.e., 'src')
@@ -9,19 +22,715 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_NAME = os.path.join(BASE_DIR, "library.db")
 # ---------------------
 
-def connect_db():
+# --- CONNECTION POOL SETTINGS ---
+# Number of connections kept open by the pool (override with LIBRARY_DB_POOL_SIZE)
+POOL_SIZE = int(os.environ.get("LIBRARY_DB_POOL_SIZE", "5"))
+# Seconds to wait for a free connection before giving up
+POOL_TIMEOUT = float(os.environ.get("LIBRARY_DB_POOL_TIMEOUT", "10"))
+# Size of each connection's prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+# How many times a write transaction is retried when the database is busy,
+# and the first back-off delay in seconds (doubled after each attempt)
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+# Rows per page for listings and searches
+DEFAULT_PAGE_SIZE = 20
+# ---------------------
+
+# --- READ CACHE SETTINGS ---
+# Book rows by ID, and search results by query (override with LIBRARY_*_CACHE_* variables)
+BOOK_CACHE_SIZE = int(os.environ.get("LIBRARY_BOOK_CACHE_SIZE", "10000"))
+BOOK_CACHE_TTL = float(os.environ.get("LIBRARY_BOOK_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.environ.get("LIBRARY_SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.environ.get("LIBRARY_SEARCH_CACHE_TTL", "60"))
+# Larger search results are not cached (they would push out many small popular ones)
+SEARCH_CACHE_MAX_ROWS = 500
+# ---------------------
+
+# --- QUERY INSTRUMENTATION ---
+# Every statement is timed per SQL text (LIBRARY_DB_INSTRUMENT=0 turns this off).
+# Statements slower than SLOW_QUERY_MS are appended, with their query plan, to
+# SLOW_QUERY_LOG (an empty LIBRARY_DB_SLOW_QUERY_LOG disables the log).
+INSTRUMENT_QUERIES = os.environ.get("LIBRARY_DB_INSTRUMENT", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("LIBRARY_DB_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("LIBRARY_DB_SLOW_QUERY_LOG", os.path.join(BASE_DIR, "slow_queries.log"))
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+# Distinct statements tracked; any further ones are counted under '<other>'
+MAX_TRACKED_STATEMENTS = 500
+# ---------------------
+
+# --- FUZZY SEARCH ---
+# Minimum share of the query's trigrams a title/author must contain (0..1)
+FUZZY_THRESHOLD = float(os.environ.get("LIBRARY_FUZZY_THRESHOLD", "0.5"))
+# Postings counted per query (above this, candidates come from blocks of rare
+# trigrams that must all match), candidate books scored exactly, results returned
+FUZZY_MAX_POSTINGS = 20000
+FUZZY_BLOCKS = 4
+FUZZY_BLOCK_SIZE = 3
+FUZZY_MAX_CANDIDATES = 1000
+FUZZY_LIMIT = 20
+# ---------------------
+
+# --- STORAGE PROFILE ---
+# PRAGMA settings applied to every connection. Each one can be overridden in a JSON
+# config file (LIBRARY_DB_CONFIG, default: library_db.json next to this file)
+# or with an environment variable LIBRARY_DB_<NAME>, e.g. LIBRARY_DB_SYNCHRONOUS=FULL.
+DEFAULT_STORAGE_PROFILE = {
+    "journal_mode": "WAL",        # readers no longer block the writer (and vice versa)
+    "synchronous": "NORMAL",      # safe with WAL, one fsync per checkpoint instead of per commit
+    "cache_size": -65536,         # negative = KiB, i.e. 64 MB page cache per connection
+    "mmap_size": 268435456,       # 256 MB memory-mapped I/O
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,         # ms to wait for a lock before SQLITE_BUSY
+    "wal_autocheckpoint": 1000,   # pages
+    "checkpoint_interval": 30,    # seconds between background WAL checkpoints (0 = off)
+}
+CONFIG_FILE = os.environ.get("LIBRARY_DB_CONFIG", os.path.join(BASE_DIR, "library_db.json"))
+
+_ALLOWED_PRAGMA_VALUES = {
+    "journal_mode": ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"),
+    "synchronous": ("OFF", "NORMAL", "FULL", "EXTRA"),
+    "temp_store": ("DEFAULT", "FILE", "MEMORY"),
+}
+# ---------------------
+
+def load_storage_profile(config_path=None):
+    """
+    Builds the storage profile: defaults, then the config file, then environment variables.
+    Unknown keys and invalid values are reported and ignored.
+    """
+    profile = dict(DEFAULT_STORAGE_PROFILE)
+    overrides = {}
+
+    config_path = config_path or CONFIG_FILE
+    if os.path.isfile(config_path):
+        try:
+            with open(config_path, encoding="utf-8") as f:
+                data = json.load(f)
+            # Either a flat object or {"storage": {...}}
+            overrides.update(data.get("storage", data))
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Error reading config file '{config_path}': {e}")
+
+    for key in DEFAULT_STORAGE_PROFILE:
+        env_value = os.environ.get(f"LIBRARY_DB_{key.upper()}")
+        if env_value is not None:
+            overrides[key] = env_value
+
+    for key, value in overrides.items():
+        if key not in DEFAULT_STORAGE_PROFILE:
+            print(f"Warning: Unknown storage setting '{key}' ignored.")
+            continue
+        try:
+            if key in _ALLOWED_PRAGMA_VALUES:
+                value = str(value).upper()
+                if value not in _ALLOWED_PRAGMA_VALUES[key]:
+                    raise ValueError(f"must be one of {', '.join(_ALLOWED_PRAGMA_VALUES[key])}")
+            else:
+                value = int(value)
+        except ValueError as e:
+            print(f"Warning: Invalid value for storage setting '{key}' ignored ({e}).")
+            continue
+        profile[key] = value
+
+    return profile
+
+STORAGE_PROFILE = load_storage_profile()
+
+def apply_storage_profile(conn, profile=None):
+    """Applies the storage PRAGMAs to a connection"""
+    profile = profile or STORAGE_PROFILE
+    # Values are validated by load_storage_profile(), PRAGMAs cannot take parameters
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {int(profile['wal_autocheckpoint'])}")
+
+# ===============================================
+# ===== QUERY INSTRUMENTATION =====
+# ===============================================
+
+class StatementStats:
+    """Counters and latency histogram of one SQL statement"""
+    __slots__ = ('calls', 'errors', 'rows', 'total_ms', 'max_ms', 'fetch_ms', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.fetch_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def to_dict(self):
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'fetch_ms': round(self.fetch_ms, 3),
+            'histogram': dict(zip(labels, self.buckets)),
+        }
+
+class QueryStats:
+    """
+    Process-wide statement statistics, keyed by the SQL text with whitespace collapsed.
+    Time spent in BEGIN IMMEDIATE is also counted as lock wait (it blocks until the
+    write lock is free).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._keys = {}  # raw SQL -> normalized key
+        self.lock_wait_ms = 0.0
+        self.lock_waits = 0
+        self.slow_queries = 0
+
+    def _key(self, sql):
+        key = self._keys.get(sql)
+        if key is None:
+            key = " ".join(sql.split())
+            if len(self._keys) < MAX_TRACKED_STATEMENTS * 4:
+                self._keys[sql] = key
+        return key
+
+    def record(self, sql, elapsed_ms, rows=0, failed=False):
+        key = self._key(sql)
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                if len(self._statements) >= MAX_TRACKED_STATEMENTS:
+                    key = '<other>'
+                stats = self._statements.setdefault(key, StatementStats())
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            if elapsed_ms > stats.max_ms:
+                stats.max_ms = elapsed_ms
+            if rows > 0:
+                stats.rows += rows
+            if failed:
+                stats.errors += 1
+            stats.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            if key.startswith("BEGIN"):
+                self.lock_waits += 1
+                self.lock_wait_ms += elapsed_ms
+
+    def record_fetch(self, sql, elapsed_ms, rows):
+        key = self._key(sql)
+        with self._lock:
+            stats = self._statements.get(key) or self._statements.get('<other>')
+            if stats is not None:
+                stats.fetch_ms += elapsed_ms
+                stats.rows += rows
+
+    def snapshot(self, top=None, order_by='total_ms'):
+        """Statistics as a dict; 'top' keeps only the most expensive statements"""
+        with self._lock:
+            statements = [(sql, stats.to_dict()) for sql, stats in self._statements.items()]
+            summary = {
+                'statements': len(statements),
+                'calls': sum(stats['calls'] for _, stats in statements),
+                'errors': sum(stats['errors'] for _, stats in statements),
+                'lock_waits': self.lock_waits,
+                'lock_wait_ms': round(self.lock_wait_ms, 3),
+                'slow_queries': self.slow_queries,
+            }
+        statements.sort(key=lambda item: item[1][order_by], reverse=True)
+        if top is not None:
+            statements = statements[:top]
+        summary['top'] = [dict(stats, sql=sql) for sql, stats in statements]
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self.lock_wait_ms = 0.0
+            self.lock_waits = 0
+            self.slow_queries = 0
+
+query_stats = QueryStats()
+_slow_log_lock = threading.Lock()
+
+def _log_slow_query(conn, sql, params, elapsed_ms, explain=True):
+    """Appends a slow statement, its parameters and its EXPLAIN QUERY PLAN to SLOW_QUERY_LOG"""
+    with query_stats._lock:
+        query_stats.slow_queries += 1
+    if not SLOW_QUERY_LOG:
+        return
+    lines = [f"{time.strftime('%Y-%m-%d %H:%M:%S')} {elapsed_ms:.1f} ms: {' '.join(sql.split())}"]
+    if params:
+        lines.append(f"  params: {repr(params)[:200]}")
+    if explain and sql.split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+        try:
+            # The plain sqlite3 method, so the plan query is not instrumented itself
+            plan = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+            lines.extend(f"  plan: {row[3]}" for row in plan)
+        except Error as e:
+            lines.append(f"  plan unavailable: {e}")
+    try:
+        with _slow_log_lock, open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"Error writing slow query log: {e}")
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor that reports each statement to query_stats, with the rows it changed
+    or (through fetchone/fetchmany/fetchall) returned.
+    """
+
+    _sql = None  # SQL of the last execute(), for the fetch counters
+
+    def _timed(self, method, sql, params, many=False):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            result = method(self, sql, params)
+        except Error:
+            query_stats.record(sql, (time.perf_counter() - start) * 1000, failed=True)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # rowcount is -1 for SELECT: those rows are counted as they are fetched
+        query_stats.record(sql, elapsed_ms, self.rowcount)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            # executemany() parameters are an iterator that has been consumed: no plan
+            _log_slow_query(self.connection, sql, None if many else params, elapsed_ms, explain=not many)
+        return result
+
+    def execute(self, sql, params=()):
+        return self._timed(sqlite3.Cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._timed(sqlite3.Cursor.executemany, sql, seq_of_params, many=True)
+
+    def executescript(self, script):
+        self._sql = None
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executescript(self, script)
+        finally:
+            query_stats.record("<script> " + script.split(";", 1)[0],
+                               (time.perf_counter() - start) * 1000)
+
+    def _fetched(self, rows, start):
+        if rows and self._sql is not None:
+            query_stats.record_fetch(self._sql, (time.perf_counter() - start) * 1000, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = sqlite3.Cursor.fetchone(self)
+        self._fetched(1 if row is not None else 0, start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = sqlite3.Cursor.fetchmany(self, self.arraysize if size is None else size)
+        self._fetched(len(rows), start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = sqlite3.Cursor.fetchall(self)
+        self._fetched(len(rows), start)
+        return rows
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including conn.execute shortcuts) are instrumented"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+def get_query_stats(top=None, order_by='total_ms'):
+    """Statement statistics collected by the instrumented connections"""
+    return query_stats.snapshot(top, order_by)
+
+def reset_query_stats():
+    query_stats.reset()
+
+def dump_query_stats(path):
+    """Writes the full statement statistics as JSON; returns False on error"""
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(query_stats.snapshot(), f, indent=2, ensure_ascii=False)
+        return True
+    except OSError as e:
+        print(f"Error writing query statistics: {e}")
+        return False
+
+def connect_db(database=None, check_same_thread=True):
     """ Creates a connection to the SQLite database """
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
+        conn = sqlite3.connect(database or DATABASE_NAME,
+                               check_same_thread=check_same_thread,
+                               cached_statements=STATEMENT_CACHE_SIZE,
+                               factory=InstrumentedConnection if INSTRUMENT_QUERIES else sqlite3.Connection)
         # Enable Foreign Key support (very important)
         conn.execute("PRAGMA foreign_keys = ON")
+        apply_storage_profile(conn)
         return conn
     except Error as e:
         print(f"Error connecting to database: {e}")
     
     return conn
 
+# ===============================================
+# ===== WAL CHECKPOINTING =====
+# ===============================================
+
+class WalCheckpointer(threading.Thread):
+    """
+    Background thread that runs a PASSIVE WAL checkpoint every few seconds.
+    PASSIVE checkpoints never wait for readers or writers, so they keep the WAL file
+    short without stalling a borrow transaction or the readers behind it.
+    """
+    def __init__(self, database=None, interval=None):
+        super().__init__(name="wal-checkpointer", daemon=True)
+        self.database = database or DATABASE_NAME
+        self.interval = interval if interval is not None else STORAGE_PROFILE["checkpoint_interval"]
+        self._stop_event = threading.Event()
+
+    def checkpoint(self, conn):
+        try:
+            return conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        except Error as e:
+            print(f"Error during WAL checkpoint: {e}")
+            return None
+
+    def run(self):
+        conn = connect_db(self.database)
+        if conn is None:
+            return
+        try:
+            while not self._stop_event.wait(self.interval):
+                self.checkpoint(conn)
+            # One last checkpoint on shutdown
+            self.checkpoint(conn)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+_checkpointer = None
+
+def start_checkpointer(database=None, interval=None):
+    """Starts the background checkpointer (no-op outside WAL mode or when disabled)"""
+    global _checkpointer
+    interval = interval if interval is not None else STORAGE_PROFILE["checkpoint_interval"]
+    if STORAGE_PROFILE["journal_mode"] != "WAL" or interval <= 0:
+        return None
+    if _checkpointer is None:
+        _checkpointer = WalCheckpointer(database, interval)
+        _checkpointer.start()
+    return _checkpointer
+
+def stop_checkpointer():
+    """Stops the background checkpointer if it is running"""
+    global _checkpointer
+    if _checkpointer is not None:
+        _checkpointer.stop()
+        _checkpointer = None
+
+# ===============================================
+# ===== CONNECTION POOL =====
+# ===============================================
+
+class ConnectionPool:
+    """
+    Keeps a fixed number of warm connections open and hands them out per thread.
+    A thread that already holds a connection gets the same one back (nested use is safe).
+    """
+    def __init__(self, database=None, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database or DATABASE_NAME
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _new_connection(self):
+        # Connections move between threads, so the same-thread check is disabled.
+        # The pool guarantees only one thread uses a connection at a time.
+        return connect_db(self.database, check_same_thread=False)
+
+    def _is_healthy(self, conn):
+        """Health check: a cheap query that fails on a broken connection"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def acquire(self):
+        """Checks out a connection for the current thread (None if unavailable)"""
+        if self._closed:
+            print("Error: Connection pool is closed.")
+            return None
+
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        conn = None
+        while conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    conn = self._new_connection()
+                    if conn is None:
+                        with self._lock:
+                            self._created -= 1
+                        return None
+                    break
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    print("Error: Timed out waiting for a database connection.")
+                    return None
+
+            if not self._is_healthy(conn):
+                self._discard(conn)
+                conn = None
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        """Returns a connection checked out by the current thread"""
+        if conn is None or getattr(self._local, "conn", None) is not conn:
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+
+        # Never hand an open transaction to the next caller
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager API: with pool.connection() as conn: ..."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Closes every idle connection; busy ones are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the shared connection pool (created on first use)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+def configure_pool(database=None, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+    """Replaces the shared pool, e.g. to point it at another database file"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(database, size, timeout)
+        # Cached rows belong to the previous database
+        clear_caches()
+        return _pool
+
+def close_pool():
+    """Closes the shared pool (call on shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+def pooled_connection():
+    """Shortcut for get_pool().connection() - yields None if no connection is available"""
+    return get_pool().connection()
+
+# ===============================================
+# ===== READ-THROUGH CACHE =====
+# ===============================================
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a size bound and a time-to-live per entry.
+    Entries can carry tags (e.g. the book IDs inside a search result) so that
+    invalidate_tag() drops exactly the entries that mention a changed book.
+    """
+    _MISSING = object()
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Bumped by every invalidation. A reader that started before an invalidation
+        # must not store what it read (it may be stale): see put(version=...).
+        self.version = 0
+        self._data = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tag_index = {}        # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING or entry[0] <= now:
+                if entry is not self._MISSING:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, tags=(), version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if key in self._data:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._data[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+    def invalidate(self, key):
+        with self._lock:
+            self.version += 1
+            if key in self._data:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self.version += 1
+            for key in list(self._tag_index.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._tag_index.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+_book_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+_search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+# Tag of every cached faceted search: its counts change with any book, not only the listed ones
+FACETS_TAG = "facets"
+
+def invalidate_book(book_id):
+    """Call after any write that changes a book row (status, title, ...)"""
+    _book_cache.invalidate(book_id)
+    _search_cache.invalidate_tag(book_id)
+    _search_cache.invalidate_tag(FACETS_TAG)
+
+def invalidate_catalog():
+    """Call after books are added or removed: any cached search may now be incomplete"""
+    _search_cache.clear()
+
+def clear_caches():
+    """Call after bulk rewrites of book rows (merges, counter rebuilds): every cached row may be stale"""
+    _book_cache.clear()
+    _search_cache.clear()
+
+def get_cache_stats():
+    """Hit/miss/eviction counters of the read caches"""
+    return {"books": _book_cache.stats(), "searches": _search_cache.stats()}
+
 def create_tables(conn):
     """ Creates tables in the database based on the design """
     if conn is None:
@@ -114,135 +823,2127 @@ def create_tables(conn):
         print("Tables created successfully (or already exist).")
     except Error as e:
         print(f"Error creating tables: {e}")
+        return
+
+    if run_migrations(conn):
+        db_restore_suspended_indexes(conn)
 
 # ===============================================
-# ===== CRUD FUNCTIONS (CREATE, READ, UPDATE, DELETE) =====
+# ===== SCHEMA MIGRATIONS =====
 # ===============================================
+# Each migration runs once per database, in order. The applied versions are
+# recorded in the schema_version table. To change the schema, append a new
+# (version, description, function) entry - never edit one that has shipped.
 
-def db_add_user(conn, username, password, name, email, phone, user_type):
-    """Adds a new user and returns the user_id"""
-    sql = ''' INSERT INTO User(username, password, name, email, phone, user_type)
-              VALUES(?,?,?,?,?,?) '''
-    try:
-        cur = conn.cursor()
-        cur.execute(sql, (username, password, name, email, phone, user_type))
+def _check_step(result, step):
+    """
+    Raises if a helper called by a migration failed. Those helpers print their error
+    and return False/None instead of raising, and run_migrations must not record
+    the version of a migration that did not complete.
+    """
+    if result is None or result is False:
+        raise Error(f"{step} failed")
+    return result
+
+def _migrate_search_index(conn):
+    create_search_index(conn)
+
+def _migrate_circulation_indexes(conn):
+    conn.executescript("""
+    -- Open loan of a book (returns, "who has this book?")
+    CREATE INDEX IF NOT EXISTS idx_borrow_open_book
+        ON BORROWING_RECORD(book_id) WHERE return_date IS NULL;
+    -- Open loans by due date (overdue and due-soon lists)
+    CREATE INDEX IF NOT EXISTS idx_borrow_open_due
+        ON BORROWING_RECORD(due_date) WHERE return_date IS NULL;
+    -- Loan history of a reader, newest first
+    CREATE INDEX IF NOT EXISTS idx_borrow_reader_date
+        ON BORROWING_RECORD(reader_id, borrow_date);
+    -- Loan history of a book
+    CREATE INDEX IF NOT EXISTS idx_borrow_book_date
+        ON BORROWING_RECORD(book_id, borrow_date);
+    -- Browsing the catalog by genre and availability (covers both columns)
+    CREATE INDEX IF NOT EXISTS idx_books_genre_status
+        ON books(genre, status);
+    """)
+
+def _migrate_statistics(conn):
+    create_statistics_tables(conn)
+    _check_step(db_rebuild_statistics(conn), "rebuilding the statistics tables")
+
+def _migrate_reader_counters(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(READER)")]
+    if "current_borrowed" not in columns:
+        conn.execute("ALTER TABLE READER ADD COLUMN current_borrowed INTEGER NOT NULL DEFAULT 0")
+    # total_borrowed was never maintained before: recompute both counters
+    _check_step(db_reconcile_reader_counters(conn), "reconciling the reader counters")
+
+def _migrate_holdings(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(books)")]
+    if "total_copies" not in columns:
+        conn.execute("ALTER TABLE books ADD COLUMN total_copies INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE books ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 0")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(BORROWING_RECORD)")]
+    if "copy_id" not in columns:
+        conn.execute("ALTER TABLE BORROWING_RECORD ADD COLUMN copy_id INTEGER REFERENCES BOOK_COPY (copy_id)")
+    create_holdings_tables(conn)
+    # Every existing book row becomes one copy (copy_id = book_id) of its own title
+    conn.execute("""INSERT INTO BOOK_COPY(copy_id, book_id, barcode, status)
+                    SELECT book_id, book_id, printf('C%08d', book_id), status FROM books
+                    WHERE book_id NOT IN (SELECT book_id FROM BOOK_COPY)""")
+    conn.execute("UPDATE BORROWING_RECORD SET copy_id = book_id WHERE copy_id IS NULL")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_borrow_open_copy
+                    ON BORROWING_RECORD(copy_id) WHERE return_date IS NULL""")
+    _check_step(db_rebuild_copy_counters(conn), "rebuilding the copy counters")
+
+def _migrate_holds(conn):
+    cur = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'BOOK_COPY'")
+    if "'on_hold'" not in cur.fetchone()[0]:
+        # A CHECK constraint cannot be altered: rebuild BOOK_COPY with the new status.
+        # The swap is one transaction (foreign keys can only be switched off outside one),
+        # so a failure leaves the old table in place and the migration can simply rerun.
         conn.commit()
-        return cur.lastrowid # Return the ID of the just-created user
-    except sqlite3.IntegrityError as e:
-        print(f"Error: Username '{username}' or Email '{email}' already exists. {e}")
-        return None
-    except Error as e:
-        print(f"Error adding user: {e}")
-        return None
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DROP TABLE IF EXISTS BOOK_COPY_new")
+            conn.execute(_BOOK_COPY_TABLE_SQL.format(name="BOOK_COPY_new"))
+            conn.execute("INSERT INTO BOOK_COPY_new SELECT copy_id, book_id, barcode, status, added_date FROM BOOK_COPY")
+            conn.execute("DROP TRIGGER IF EXISTS books_after_insert_copy")
+            conn.execute("DROP TABLE BOOK_COPY")
+            conn.execute("ALTER TABLE BOOK_COPY_new RENAME TO BOOK_COPY")
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+    # Indexes and triggers on BOOK_COPY went with the old table (IF NOT EXISTS: safe on a rerun)
+    create_holdings_tables(conn)
+    create_hold_tables(conn)
 
-def db_add_reader(conn, user_id, membership_date):
-    """Adds a new reader (linked to user_id)"""
-    sql = ''' INSERT INTO READER(user_id, membership_date) VALUES(?,?) '''
-    try:
-        cur = conn.cursor()
-        cur.execute(sql, (user_id, membership_date))
+def _migrate_facets(conn):
+    conn.executescript("""
+    -- Catalog sorted by title / filtered by author (faceted search)
+    CREATE INDEX IF NOT EXISTS idx_books_title ON books(title);
+    CREATE INDEX IF NOT EXISTS idx_books_author ON books(author, genre, status);
+    """)
+    create_facet_tables(conn)
+    _check_step(db_rebuild_facet_counts(conn), "rebuilding the facet counts")
+
+def _migrate_audit_log(conn):
+    create_audit_tables(conn)
+
+def _migrate_notices(conn):
+    create_notice_tables(conn)
+
+def _migrate_suspended_indexes(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS SUSPENDED_INDEX (
+        name TEXT PRIMARY KEY,            -- index or trigger dropped for a bulk load
+        sql TEXT                          -- CREATE INDEX statement (NULL for the search trigger)
+    )""")
+
+def _migrate_trigram_index(conn):
+    if create_trigram_index(conn):
+        conn.execute("INSERT OR IGNORE INTO TRIGRAM_PENDING(book_id) SELECT book_id FROM books")
         conn.commit()
-        return cur.lastrowid
-    except Error as e:
-        print(f"Error adding reader: {e}")
-        return None
+        _check_step(db_refresh_trigram_index(conn), "building the fuzzy search index")
 
-def db_get_user_by_username(conn, username):
-    """Gets user info by username"""
-    sql = "SELECT * FROM User WHERE username = ?"
-    cur = conn.cursor()
-    cur.execute(sql, (username,))
-    # fetchone() returns one row as a tuple
-    return cur.fetchone()
+MIGRATIONS = [
+    (1, "full-text search index on books", _migrate_search_index),
+    (2, "indexes for circulation queries", _migrate_circulation_indexes),
+    (3, "summary tables for statistics", _migrate_statistics),
+    (4, "reader loan counters", _migrate_reader_counters),
+    (5, "physical copies (holdings)", _migrate_holdings),
+    (6, "hold queue", _migrate_holds),
+    (7, "fuzzy search trigram index", _migrate_trigram_index),
+    (8, "faceted search indexes and counters", _migrate_facets),
+    (9, "circulation audit log", _migrate_audit_log),
+    (10, "overdue and due-soon notice outbox", _migrate_notices),
+    (11, "bulk load recovery state", _migrate_suspended_indexes),
+]
 
-# --- NEW FUNCTION 1 ---
-def db_get_reader_by_user_id(conn, user_id):
-    """Gets Reader details by user_id"""
-    sql = "SELECT reader_id, membership_date, total_borrowed FROM READER WHERE user_id = ?"
+def db_get_schema_version(conn):
+    """Returns the highest applied migration version (0 for a new database)"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
     cur = conn.cursor()
-    cur.execute(sql, (user_id,))
-    return cur.fetchone()
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
 
-# --- NEW FUNCTION 2 ---
-def db_get_librarian_by_user_id(conn, user_id):
-    """Gets Librarian details by user_id"""
-    sql = "SELECT librarian_id, staff_id, role, hire_date FROM LIBRARIAN WHERE user_id = ?"
-    cur = conn.cursor()
-    cur.execute(sql, (user_id,))
-    return cur.fetchone()
+def run_migrations(conn):
+    """Applies every migration newer than the database's schema version"""
+    try:
+        current = db_get_schema_version(conn)
+    except Error as e:
+        print(f"Error reading schema version: {e}")
+        return False
 
-# --- NEW FUNCTION 3 ---
-def db_get_admin_by_user_id(conn, user_id):
-    """Gets Admin details by user_id"""
-    sql = "SELECT admin_id, privileged_level FROM ADMIN WHERE user_id = ?"
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            migrate(conn)
+            conn.execute("INSERT INTO schema_version(version, description) VALUES (?, ?)",
+                         (version, description))
+            conn.commit()
+            print(f"Applied migration {version}: {description}")
+        except Error as e:
+            conn.rollback()
+            print(f"Error applying migration {version} ({description}): {e}")
+            return False
+    return True
+
+# --- Hot queries and the index each one must use ---
+HOT_QUERIES = [
+    ("open loan of a book",
+     "SELECT record_id FROM BORROWING_RECORD WHERE book_id = ? AND return_date IS NULL",
+     (1,), "idx_borrow_open_book"),
+    ("overdue loans",
+     "SELECT record_id, reader_id FROM BORROWING_RECORD WHERE return_date IS NULL AND due_date < ?",
+     ("2000-01-01",), "idx_borrow_open_due"),
+    ("loan history of a reader",
+     "SELECT * FROM BORROWING_RECORD WHERE reader_id = ? ORDER BY borrow_date DESC",
+     (1,), "idx_borrow_reader_date"),
+    ("loan history of a book",
+     "SELECT * FROM BORROWING_RECORD WHERE book_id = ? ORDER BY borrow_date",
+     (1,), "idx_borrow_book_date"),
+    ("free copy of a title",
+     "SELECT copy_id FROM BOOK_COPY WHERE book_id = ? AND status = 'available' LIMIT 1",
+     (1,), "idx_copy_book_status"),
+    ("open loan of a copy",
+     "SELECT record_id FROM BORROWING_RECORD WHERE copy_id = ? AND return_date IS NULL",
+     (1,), "idx_borrow_open_copy"),
+    ("next hold in line for a title",
+     "SELECT hold_id, reader_id FROM HOLD WHERE book_id = ? AND status = 'waiting' ORDER BY hold_id LIMIT 1",
+     (1,), "idx_hold_queue"),
+    ("expired hold-shelf copies",
+     "SELECT hold_id FROM HOLD WHERE status = 'ready' AND expires_on < ?",
+     ("2000-01-01",), "idx_hold_shelf_expiry"),
+    ("available books of a genre",
+     "SELECT book_id FROM books WHERE genre = ? AND status = 'available'",
+     ("Novel",), "idx_books_genre_status"),
+    ("catalog by title, next page",
+     "SELECT * FROM books b WHERE (b.title, b.book_id) > (?, ?) ORDER BY b.title, b.book_id LIMIT 20",
+     ("M", 0), "idx_books_title"),
+    ("open loans due in a window, next chunk",
+     "SELECT record_id FROM BORROWING_RECORD WHERE return_date IS NULL AND due_date >= ? AND due_date < ? "
+     "AND (due_date, record_id) > (?, ?) ORDER BY due_date, record_id LIMIT 1000",
+     ("2000-01-01", "2000-01-02", "2000-01-01", 0), "idx_borrow_open_due"),
+    ("pending notices, next chunk",
+     "SELECT * FROM NOTICE_OUTBOX WHERE status = 'pending' AND notice_id > ? ORDER BY notice_id LIMIT 1000",
+     (0,), "idx_notice_pending"),
+    ("audit trail of a reader",
+     "SELECT * FROM AUDIT_EVENT WHERE reader_id = ? AND event_id > ? ORDER BY event_id LIMIT 100",
+     (1, 0), "idx_audit_reader"),
+    ("facet counts of an author",
+     "SELECT genre, status, COUNT(*) FROM books WHERE author = ? GROUP BY genre, status",
+     ("Nguyễn Du",), "idx_books_author"),
+]
+
+def db_check_query_plans(conn):
+    """
+    Runs EXPLAIN QUERY PLAN for every hot query.
+    Returns a list of (name, uses_expected_index, plan_text).
+    """
+    results = []
     cur = conn.cursor()
-    cur.execute(sql, (user_id,))
-    return cur.fetchone()
+    for name, sql, params, index_name in HOT_QUERIES:
+        cur.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = " | ".join(row[3] for row in cur.fetchall())
+        results.append((name, index_name in plan, plan))
+    return results
+
+# ===============================================
+# ===== FULL-TEXT SEARCH (FTS5) =====
+# ===============================================
+
+# Weights for bm25() ranking: a match in the title counts most, then author, then genre
+SEARCH_RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+def _fold_sql(column):
+    """
+    SQL expression that folds Vietnamese 'đ/Đ' to 'd/D'.
+    The unicode61 tokenizer strips all other diacritics by itself ('ễ' -> 'e'),
+    but 'đ' is a separate letter in Unicode, so it is replaced before indexing.
+    """
+    return f"replace(replace({column}, 'đ', 'd'), 'Đ', 'D')"
+
+def create_search_index(conn):
+    """
+    Migration: creates the books_fts index and its sync triggers,
+    then backfills it from an existing catalog.
+    """
+    sql_create_fts_table = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, genre,
+        tokenize = 'unicode61 remove_diacritics 2'
+    );
+    """
+
+    fold_new = ", ".join(_fold_sql(f"new.{col}") for col in ("title", "author", "genre"))
+    sql_create_fts_triggers = f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_after_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, genre) VALUES (new.book_id, {fold_new});
+    END;
+    CREATE TRIGGER IF NOT EXISTS books_fts_after_delete AFTER DELETE ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = old.book_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS books_fts_after_update AFTER UPDATE OF title, author, genre ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = old.book_id;
+        INSERT INTO books_fts(rowid, title, author, genre) VALUES (new.book_id, {fold_new});
+    END;
+    """
 
-def db_add_book(conn, title, author, genre, status='available'):
-    """Adds a new book"""
-    sql = ''' INSERT INTO books(title, author, genre, status)
-              VALUES(?,?,?,?) '''
     try:
-        cur = conn.cursor()
-        cur.execute(sql, (title, author, genre, status))
-        conn.commit()
-        return cur.lastrowid
+        conn.execute(sql_create_fts_table)
     except Error as e:
-        print(f"Error adding book: {e}")
-        return None
+        # SQLite builds without FTS5 keep working with the LIKE search
+        print(f"Full-text search is not available ({e}). Falling back to LIKE search.")
+        return False
 
-def db_get_book_by_id(conn, book_id):
-    """Gets book info by ID"""
-    sql = "SELECT * FROM books WHERE book_id = ?"
-    cur = conn.cursor()
-    cur.execute(sql, (book_id,))
-    return cur.fetchone()
+    try:
+        conn.executescript(sql_create_fts_triggers)
+        (indexed,) = conn.execute("SELECT COUNT(*) FROM books_fts").fetchone()
+        (total,) = conn.execute("SELECT COUNT(*) FROM books").fetchone()
+        if indexed != total:
+            db_rebuild_search_index(conn)
+            print(f"Search index backfilled with {total} book(s).")
+        return True
+    except Error as e:
+        print(f"Error creating search index: {e}")
+        return False
 
-def db_update_book_status(conn, book_id, new_status):
-    """Updates the status of a book (available/borrowed)"""
-    sql = "UPDATE books SET status = ? WHERE book_id = ?"
+def db_rebuild_search_index(conn):
+    """Rebuilds books_fts from the books table (used after bulk loads or for recovery)"""
+    fold_cols = ", ".join(_fold_sql(col) for col in ("title", "author", "genre"))
     try:
         cur = conn.cursor()
-        cur.execute(sql, (new_status, book_id))
+        cur.execute("DELETE FROM books_fts")
+        cur.execute(f"INSERT INTO books_fts(rowid, title, author, genre) "
+                    f"SELECT book_id, {fold_cols} FROM books")
         conn.commit()
+        invalidate_catalog()
         return True
     except Error as e:
-        print(f"Error updating book status: {e}")
+        print(f"Error rebuilding search index: {e}")
         return False
 
-def db_create_borrow_record(conn, book_id, reader_id, borrow_date, due_date):
-    """Creates a new borrow record"""
-    sql = ''' INSERT INTO BORROWING_RECORD(book_id, reader_id, borrow_date, due_date, fine_amount)
-              VALUES(?,?,?,?,?) '''
+def db_suspend_search_index(conn):
+    """
+    Stops indexing new books one by one (bulk loads index them in one pass afterwards).
+    Recorded in SUSPENDED_INDEX, so a load that dies before db_resume_search_index()
+    is repaired by the next create_tables().
+    """
     try:
-        cur = conn.cursor()
-        cur.execute(sql, (book_id, reader_id, borrow_date, due_date, 0))
+        conn.execute("INSERT OR REPLACE INTO SUSPENDED_INDEX(name, sql) VALUES ('books_fts_after_insert', NULL)")
+        conn.execute("DROP TRIGGER IF EXISTS books_fts_after_insert")
         conn.commit()
-        return cur.lastrowid
     except Error as e:
-        print(f"Error creating borrow record: {e}")
-        return None
+        print(f"Error suspending search index: {e}")
 
-def db_update_return_record(conn, record_id, return_date, fine_amount):
-    """Updates the record when a book is returned"""
-    sql = "UPDATE BORROWING_RECORD SET return_date = ?, fine_amount = ? WHERE record_id = ?"
+def db_resume_search_index(conn, after_book_id):
+    """Indexes every book with book_id > after_book_id, then restores the insert trigger"""
+    fold_cols = ", ".join(_fold_sql(col) for col in ("title", "author", "genre"))
     try:
-        cur = conn.cursor()
-        cur.execute(sql, (return_date, fine_amount, record_id))
+        conn.execute(f"INSERT INTO books_fts(rowid, title, author, genre) "
+                     f"SELECT book_id, {fold_cols} FROM books WHERE book_id > ?", (after_book_id,))
         conn.commit()
-        return True
     except Error as e:
-        print(f"Error updating return record: {e}")
-        return False
+        print(f"Error indexing imported books: {e}")
+    # Recreates the trigger (and backfills fully if the index is still out of sync)
+    if create_search_index(conn):
+        conn.execute("DELETE FROM SUSPENDED_INDEX WHERE name = 'books_fts_after_insert'")
+        conn.commit()
+    # New books were queued for the fuzzy index by its triggers (db_add_books_bulk
+    # left them there): index them in one pass
+    db_refresh_trigram_index(conn)
 
-def db_search_books(conn, keyword):
-    """Finds books by title or author"""
-    sql = "SELECT * FROM books WHERE title LIKE ? OR author LIKE ?"
-    cur = conn.cursor()
-    keyword_like = f"%{keyword}%" # Add % for wildcard search
-    cur.execute(sql, (keyword_like, keyword_like))
-    return cur.fetchall() # fetchall() returns a list of rows
+def _build_fts_query(keyword):
+    """
+    Turns user input into an FTS5 query: every word must match as a prefix.
+    'truyen ki' -> '"truyen"* "ki"*'. Returns None if there is nothing to search.
+    """
+    text = keyword.replace("đ", "d").replace("Đ", "D")
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+# ===============================================
+# ===== FUZZY SEARCH (TRIGRAM INDEX) =====
+# ===============================================
+# Typo-tolerant search over title + author. Text is normalized (lower case, accents
+# and 'đ' folded, punctuation removed) and split into trigrams, padded per word like
+# PostgreSQL's pg_trgm: "poter" -> "  p", " po", "pot", "ote", "ter", "er ".
+# books_trigram (FTS5, trigram tokenizer) holds the padded text of every book, so the
+# postings of a trigram are one index lookup; TRIGRAM_DF counts the books containing
+# each trigram. The trigram tokenizer cannot fold accents, so the triggers only queue
+# changed books in TRIGRAM_PENDING and the Python side indexes the queue after each
+# write that adds, renames or removes books (bulk loads: once, at the end of the
+# load) and in the end-of-day run. Searches only read the index.
+
+def normalize_search_text(text):
+    """'Nguyễn Du - Truyện Kiều' -> 'nguyen du truyen kieu'"""
+    text = (text or "").replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return " ".join(re.findall(r"[^\W_]+", text))
+
+def text_trigrams(text):
+    """Set of padded word trigrams of the text"""
+    grams = set()
+    for word in normalize_search_text(text).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def _trigram_document(title, author):
+    """Text stored in books_trigram: '  harry  potter ', so each trigram above occurs in it"""
+    return "  " + "  ".join(normalize_search_text(f"{title} {author or ''}").split()) + " "
+
+def _document_trigrams(document):
+    """text_trigrams() of a stored document, read off directly ('y  ' spans two words)"""
+    return {document[i:i + 3] for i in range(len(document) - 2) if document[i + 1:i + 3] != "  "}
+
+def create_trigram_index(conn):
+    """Creates the trigram index tables and the triggers that queue changed books"""
+    try:
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS books_trigram USING fts5(
+                            document, tokenize = 'trigram', detail = 'none')""")
+    except Error as e:
+        print(f"Fuzzy search is not available ({e}).")
+        return False
+
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS TRIGRAM_DF (
+        gram TEXT PRIMARY KEY,
+        df INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS TRIGRAM_PENDING (
+        book_id INTEGER PRIMARY KEY
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trigram_after_insert AFTER INSERT ON books BEGIN
+        INSERT OR IGNORE INTO TRIGRAM_PENDING(book_id) VALUES (new.book_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trigram_after_update AFTER UPDATE OF title, author ON books BEGIN
+        INSERT OR IGNORE INTO TRIGRAM_PENDING(book_id) VALUES (new.book_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trigram_after_delete AFTER DELETE ON books BEGIN
+        INSERT OR IGNORE INTO TRIGRAM_PENDING(book_id) VALUES (old.book_id);
+    END;
+    """)
+    return True
+
+def _index_trigrams(cur, book_ids):
+    """(Re)indexes the given books inside the caller's transaction"""
+    marks = ", ".join("?" * len(book_ids))
+    df = Counter()
+    cur.execute(f"SELECT document FROM books_trigram WHERE rowid IN ({marks})", book_ids)
+    for (document,) in cur.fetchall():
+        df.subtract(_document_trigrams(document))
+    cur.execute(f"DELETE FROM books_trigram WHERE rowid IN ({marks})", book_ids)
+
+    cur.execute(f"SELECT book_id, title, author FROM books WHERE book_id IN ({marks})", book_ids)
+    documents = []
+    for book_id, title, author in cur.fetchall():
+        document = _trigram_document(title, author)
+        documents.append((book_id, document))
+        df.update(_document_trigrams(document))
+    cur.executemany("INSERT INTO books_trigram(rowid, document) VALUES (?, ?)", documents)
+
+    cur.executemany("""INSERT INTO TRIGRAM_DF(gram, df) VALUES (?, ?)
+                       ON CONFLICT(gram) DO UPDATE SET df = df + excluded.df""",
+                    [(gram, count) for gram, count in df.items() if count])
+    cur.executemany("DELETE FROM TRIGRAM_DF WHERE gram = ? AND df <= 0",
+                    [(gram,) for gram, count in df.items() if count < 0])
+    cur.execute(f"DELETE FROM TRIGRAM_PENDING WHERE book_id IN ({marks})", book_ids)
+
+def db_refresh_trigram_index(conn, batch_size=5000):
+    """
+    Indexes every book queued in TRIGRAM_PENDING, 'batch_size' books per transaction.
+    Returns the number of books indexed (None on error or without fuzzy search).
+    """
+    indexed = 0
+    try:
+        while True:
+            cur = conn.cursor()
+            cur.execute("SELECT book_id FROM TRIGRAM_PENDING LIMIT ?", (batch_size,))
+            book_ids = [row[0] for row in cur.fetchall()]
+            if not book_ids:
+                return indexed
+            run_in_transaction(conn, lambda cur: _index_trigrams(cur, book_ids))
+            indexed += len(book_ids)
+            # A fuzzy search cached before this batch may miss its books
+            invalidate_catalog()
+    except sqlite3.OperationalError as e:
+        # SQLite built without the FTS5 trigram tokenizer: there is no index to refresh
+        if "no such table" not in str(e):
+            print(f"Error updating the fuzzy search index: {e}")
+        return None
+    except Error as e:
+        print(f"Error updating the fuzzy search index: {e}")
+        return None
+
+def db_rebuild_trigram_index(conn):
+    """Rebuilds the trigram index from the books table (after restores or for recovery)"""
+    def work(cur):
+        cur.execute("DELETE FROM books_trigram")
+        cur.execute("DELETE FROM TRIGRAM_DF")
+        cur.execute("INSERT OR IGNORE INTO TRIGRAM_PENDING(book_id) SELECT book_id FROM books")
+
+    try:
+        run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error rebuilding the fuzzy search index: {e}")
+        return None
+    indexed = db_refresh_trigram_index(conn)
+    invalidate_catalog()
+    return indexed
+
+def db_fuzzy_search_books(conn, keyword, threshold=None, limit=FUZZY_LIMIT):
+    """
+    Typo-tolerant search: books whose title/author contain at least 'threshold' of
+    the keyword's trigrams, best first. Returns rows (book columns..., similarity),
+    where similarity is shared / (keyword grams + book grams - shared) as in pg_trgm.
+
+    Candidates come from the postings of the keyword's rarest trigrams: a book sharing
+    the required number of grams must contain one of the (grams - required + 1) rarest,
+    so common grams such as "the" are never read. When even those are too common
+    (large catalogs), candidates are the books matching a few blocks of rare grams
+    instead, intersected inside FTS5. At most FUZZY_MAX_CANDIDATES
+    candidates are then scored exactly.
+    """
+    threshold = FUZZY_THRESHOLD if threshold is None else threshold
+    grams = text_trigrams(keyword)
+    if not grams:
+        return []
+
+    cache_key = ("fuzzy", " ".join(sorted(grams)), threshold, limit)
+    rows = _search_cache.get(cache_key)
+    if rows is not None:
+        return list(rows)
+
+    version = _search_cache.version
+    try:
+        cur = conn.cursor()
+
+        required = max(1, math.ceil(len(grams) * threshold))
+        marks = ", ".join("?" * len(grams))
+        cur.execute(f"SELECT gram, df FROM TRIGRAM_DF WHERE gram IN ({marks})", list(grams))
+        df = dict(cur.fetchall())
+        # Grams no book contains can never be shared
+        present = sorted(df, key=df.get)
+        if len(present) < required:
+            return []
+
+        probe = present[:len(present) - required + 1]
+        if sum(df[gram] for gram in probe) <= FUZZY_MAX_POSTINGS:
+            # Count-merge of the probed postings lists, most shared grams first
+            postings_sql = " UNION ALL ".join(
+                ["SELECT rowid FROM books_trigram WHERE books_trigram MATCH ?"] * len(probe))
+            cur.execute(f"""SELECT b.rowid, b.document FROM books_trigram b
+                            JOIN (SELECT rowid, COUNT(*) AS hits FROM ({postings_sql})
+                                  GROUP BY rowid ORDER BY hits DESC LIMIT ?) c ON c.rowid = b.rowid""",
+                        [f'"{gram}"' for gram in probe] + [FUZZY_MAX_CANDIDATES])
+        else:
+            # Too many postings to count: take the books containing every gram of at
+            # least one block of rare grams. Blocks interleave the rarest grams, so a
+            # typo (which changes up to 3 neighbouring grams) breaks few blocks.
+            blocks = max(1, min(FUZZY_BLOCKS, len(present) // FUZZY_BLOCK_SIZE))
+            query = " OR ".join(
+                "(" + " AND ".join(f'"{gram}"' for gram in present[i::blocks][:FUZZY_BLOCK_SIZE]) + ")"
+                for i in range(blocks))
+            cur.execute("SELECT rowid, document FROM books_trigram WHERE books_trigram MATCH ? LIMIT ?",
+                        (query, FUZZY_MAX_CANDIDATES))
+
+        scores = {}
+        for book_id, document in cur.fetchall():
+            book_grams = _document_trigrams(document)
+            shared = len(grams & book_grams)
+            if shared >= required:
+                scores[book_id] = shared / (len(grams) + len(book_grams) - shared)
+        best = sorted(scores, key=lambda book_id: (-scores[book_id], book_id))[:limit]
+        if not best:
+            return []
+
+        marks = ", ".join("?" * len(best))
+        cur.execute(f"SELECT * FROM books WHERE book_id IN ({marks})", best)
+        by_id = {row[0]: row for row in cur.fetchall()}
+        rows = [by_id[book_id] + (scores[book_id],) for book_id in best if book_id in by_id]
+    except Error as e:
+        print(f"Error in fuzzy search: {e}")
+        return []
+
+    _search_cache.put(cache_key, tuple(rows), tags=[row[0] for row in rows], version=version)
+    return rows
+
+# ===============================================
+# ===== TRANSACTIONS =====
+# ===============================================
+
+class TransactionAborted(Exception):
+    """
+    Raised inside a run_in_transaction() work function to roll back everything
+    it has done so far. 'reason' tells the caller why.
+    """
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+def _is_busy_error(e):
+    """True if the error means another connection holds the write lock"""
+    message = str(e).lower()
+    return "locked" in message or "busy" in message
+
+def run_in_transaction(conn, work, retries=BUSY_RETRIES, backoff=BUSY_BACKOFF):
+    """
+    Runs work(cur) inside one BEGIN IMMEDIATE ... COMMIT and returns its result.
+    BEGIN IMMEDIATE takes the write lock up front, so the reads inside 'work'
+    cannot be invalidated by another writer before the commit.
+    If the database stays busy the whole transaction is retried (with back-off).
+    Any other error rolls back and is raised to the caller.
+    """
+    attempt = 0
+    while True:
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not _is_busy_error(e) or attempt >= retries:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+            attempt += 1
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+# ===============================================
+# ===== CRUD FUNCTIONS (CREATE, READ, UPDATE, DELETE) =====
+# ===============================================
+
+def db_add_user(conn, username, password, name, email, phone, user_type):
+    """Adds a new user and returns the user_id"""
+    sql = ''' INSERT INTO User(username, password, name, email, phone, user_type)
+              VALUES(?,?,?,?,?,?) '''
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, (username, password, name, email, phone, user_type))
+        conn.commit()
+        return cur.lastrowid # Return the ID of the just-created user
+    except sqlite3.IntegrityError as e:
+        print(f"Error: Username '{username}' or Email '{email}' already exists. {e}")
+        return None
+    except Error as e:
+        print(f"Error adding user: {e}")
+        return None
+
+def db_add_reader(conn, user_id, membership_date):
+    """Adds a new reader (linked to user_id)"""
+    sql = ''' INSERT INTO READER(user_id, membership_date) VALUES(?,?) '''
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, (user_id, membership_date))
+        conn.commit()
+        return cur.lastrowid
+    except Error as e:
+        print(f"Error adding reader: {e}")
+        return None
+
+def db_get_user_by_username(conn, username):
+    """Gets user info by username"""
+    sql = "SELECT * FROM User WHERE username = ?"
+    cur = conn.cursor()
+    cur.execute(sql, (username,))
+    # fetchone() returns one row as a tuple
+    return cur.fetchone()
+
+def db_update_user_password(conn, user_id, password_hash):
+    """Stores a new password hash for a user"""
+    sql = "UPDATE User SET password = ? WHERE user_id = ?"
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, (password_hash, user_id))
+        conn.commit()
+        return True
+    except Error as e:
+        print(f"Error updating password: {e}")
+        return False
+
+# --- NEW FUNCTION 1 ---
+def db_get_reader_by_user_id(conn, user_id):
+    """Gets Reader details by user_id"""
+    sql = "SELECT reader_id, membership_date, total_borrowed FROM READER WHERE user_id = ?"
+    cur = conn.cursor()
+    cur.execute(sql, (user_id,))
+    return cur.fetchone()
+
+# --- NEW FUNCTION 2 ---
+def db_get_librarian_by_user_id(conn, user_id):
+    """Gets Librarian details by user_id"""
+    sql = "SELECT librarian_id, staff_id, role, hire_date FROM LIBRARIAN WHERE user_id = ?"
+    cur = conn.cursor()
+    cur.execute(sql, (user_id,))
+    return cur.fetchone()
+
+# --- NEW FUNCTION 3 ---
+def db_get_admin_by_user_id(conn, user_id):
+    """Gets Admin details by user_id"""
+    sql = "SELECT admin_id, privileged_level FROM ADMIN WHERE user_id = ?"
+    cur = conn.cursor()
+    cur.execute(sql, (user_id,))
+    return cur.fetchone()
+
+# Everything needed to build any models.User subclass, in one round trip.
+# Every join is on a UNIQUE user_id column, so each one is a single index lookup.
+_IDENTITY_SQL = """
+SELECT u.user_id, u.username, u.password, u.name, u.email, u.phone, u.user_type,
+       r.reader_id, l.staff_id, l.role, a.admin_id, a.privileged_level
+FROM User u
+LEFT JOIN READER r ON r.user_id = u.user_id
+LEFT JOIN LIBRARIAN l ON l.user_id = u.user_id
+LEFT JOIN ADMIN a ON a.user_id = u.user_id
+"""
+
+def db_get_identity_by_username(conn, username):
+    """
+    Gets a user and all of their role details with one query.
+    Row: (user_id, username, password, name, email, phone, user_type,
+          reader_id, staff_id, role, admin_id, privileged_level) - role columns are None if absent
+    """
+    cur = conn.cursor()
+    cur.execute(_IDENTITY_SQL + "WHERE u.username = ?", (username,))
+    return cur.fetchone()
+
+def db_get_identity_by_user_id(conn, user_id):
+    """Same as db_get_identity_by_username, looked up by user_id"""
+    cur = conn.cursor()
+    cur.execute(_IDENTITY_SQL + "WHERE u.user_id = ?", (user_id,))
+    return cur.fetchone()
+
+def db_add_book(conn, title, author, genre, status='available'):
+    """Adds a new book"""
+    sql = ''' INSERT INTO books(title, author, genre, status)
+              VALUES(?,?,?,?) '''
+    try:
+        cur = conn.cursor()
+        cur.execute(sql, (title, author, genre, status))
+        conn.commit()
+        invalidate_catalog()
+    except Error as e:
+        print(f"Error adding book: {e}")
+        return None
+    db_refresh_trigram_index(conn)
+    return cur.lastrowid
+
+def db_add_books_bulk(conn, rows, index=True):
+    """
+    Inserts many books in one transaction with executemany.
+    rows is a list of (title, author, genre, status) tuples.
+    Returns the number of inserted rows (the whole batch is rolled back on error).
+    index=False leaves the new books queued for the fuzzy index: bulk loads
+    index every batch at once in db_resume_search_index().
+    """
+    sql = ''' INSERT INTO books(title, author, genre, status)
+              VALUES(?,?,?,?) '''
+
+    def work(cur):
+        cur.executemany(sql, rows)
+        return len(rows)
+
+    try:
+        inserted = run_in_transaction(conn, work)
+    finally:
+        invalidate_catalog()
+    if index:
+        db_refresh_trigram_index(conn)
+    return inserted
+
+def db_get_max_book_id(conn):
+    """Returns the highest book_id (0 for an empty catalog)"""
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(book_id), 0) FROM books")
+    return cur.fetchone()[0]
+
+def db_drop_secondary_indexes(conn, table):
+    """
+    Drops the explicitly created indexes of a table before a bulk load.
+    Returns their CREATE INDEX statements so db_restore_indexes() can rebuild them.
+    (Indexes backing PRIMARY KEY / UNIQUE constraints have no SQL and are kept.)
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,))
+    indexes = cur.fetchall()
+    # Saved in the same transaction as the drops: a crashed load is repaired by create_tables()
+    cur.executemany("INSERT OR REPLACE INTO SUSPENDED_INDEX(name, sql) VALUES (?, ?)", indexes)
+    for name, _ in indexes:
+        cur.execute(f'DROP INDEX IF EXISTS "{name}"')
+    conn.commit()
+    return [index_sql for _, index_sql in indexes]
+
+def db_restore_indexes(conn, index_sqls):
+    """Rebuilds indexes saved by db_drop_secondary_indexes() (skipping any that already exist)"""
+    cur = conn.cursor()
+    for index_sql in index_sqls:
+        cur.execute("SELECT name FROM SUSPENDED_INDEX WHERE sql = ?", (index_sql,))
+        row = cur.fetchone()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND sql = ?", (index_sql,))
+        if cur.fetchone() is None:
+            cur.execute(index_sql)
+        if row is not None:
+            cur.execute("DELETE FROM SUSPENDED_INDEX WHERE name = ?", row)
+    conn.commit()
+
+def db_restore_suspended_indexes(conn):
+    """
+    Restores indexes and the search trigger left dropped by a bulk load that never
+    finished (killed, power loss). Called by create_tables(). Returns how many were restored.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT name, sql FROM SUSPENDED_INDEX ORDER BY name")
+        suspended = cur.fetchall()
+        if not suspended:
+            return 0
+        print(f"Restoring {len(suspended)} index(es) left dropped by an interrupted bulk load...")
+        db_restore_indexes(conn, [index_sql for _, index_sql in suspended if index_sql is not None])
+        if any(index_sql is None for _, index_sql in suspended):
+            # Books loaded after the trigger was dropped are missing from the search index
+            if db_rebuild_search_index(conn) and create_search_index(conn):
+                conn.execute("DELETE FROM SUSPENDED_INDEX WHERE sql IS NULL")
+                conn.commit()
+        return len(suspended)
+    except Error as e:
+        print(f"Error restoring suspended indexes: {e}")
+        return 0
+
+def db_get_book_by_id(conn, book_id):
+    """Gets book info by ID (served from the book cache when possible)"""
+    row = _book_cache.get(book_id)
+    if row is not None:
+        return row
+
+    version = _book_cache.version
+    sql = "SELECT * FROM books WHERE book_id = ?"
+    cur = conn.cursor()
+    cur.execute(sql, (book_id,))
+    row = cur.fetchone()
+    if row is not None:
+        _book_cache.put(book_id, row, version=version)
+    return row
+
+def db_borrow_book(conn, book_id, reader_id, borrow_date, due_date, max_loans=None):
+    """
+    Borrows a book atomically: checks and bumps the reader's loan counters
+    (refusing if the reader already holds 'max_loans' books), claims the copy held
+    for this reader (or else any free copy of the title) and creates the borrow
+    record - all in the same transaction.
+    Returns (record_id, None) on success, or (None, reason) where reason is
+    'not_found', 'borrowed' (no free copy), 'invalid_reader', 'limit_reached',
+    'busy' or 'error'.
+    """
+    def work(cur):
+        # O(1) loan-limit check on the counter row, no scan of BORROWING_RECORD
+        cur.execute("""UPDATE READER SET total_borrowed = total_borrowed + 1,
+                                         current_borrowed = current_borrowed + 1
+                       WHERE reader_id = ? AND (? IS NULL OR current_borrowed < ?)""",
+                    (reader_id, max_loans, max_loans))
+        if cur.rowcount == 0:
+            cur.execute("SELECT 1 FROM READER WHERE reader_id = ?", (reader_id,))
+            raise TransactionAborted('limit_reached' if cur.fetchone() else 'invalid_reader')
+
+        # The copy waiting on the hold shelf for this reader, if any
+        cur.execute("""SELECT hold_id, copy_id, status FROM HOLD
+                       WHERE book_id = ? AND reader_id = ? AND status IN ('waiting', 'ready')""",
+                    (book_id, reader_id))
+        hold = cur.fetchone()
+        if hold is not None and hold[2] == 'ready':
+            copy_id = hold[1]
+            cur.execute("UPDATE HOLD SET status = 'fulfilled' WHERE hold_id = ?", (hold[0],))
+        else:
+            # Any free copy; the write lock taken by BEGIN IMMEDIATE makes the claim atomic
+            cur.execute("SELECT copy_id FROM BOOK_COPY WHERE book_id = ? AND status = 'available' LIMIT 1",
+                        (book_id,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("SELECT 1 FROM books WHERE book_id = ?", (book_id,))
+                raise TransactionAborted('borrowed' if cur.fetchone() else 'not_found')
+            copy_id = row[0]
+            if hold is not None:
+                # Borrowed a free copy while still queued: the hold is no longer needed
+                cur.execute("UPDATE HOLD SET status = 'fulfilled' WHERE hold_id = ?", (hold[0],))
+        cur.execute("UPDATE BOOK_COPY SET status = 'borrowed' WHERE copy_id = ?", (copy_id,))
+
+        cur.execute(''' INSERT INTO BORROWING_RECORD(book_id, copy_id, reader_id, borrow_date, due_date, fine_amount)
+                        VALUES(?,?,?,?,?,?) ''', (book_id, copy_id, reader_id, borrow_date, due_date, 0))
+        return cur.lastrowid, None
+
+    try:
+        result = run_in_transaction(conn, work)
+        invalidate_book(book_id)
+        return result
+    except TransactionAborted as e:
+        # Nothing was written: the counter update was rolled back too
+        return None, e.reason
+    except sqlite3.OperationalError as e:
+        if _is_busy_error(e):
+            print(f"Error: Database is busy, borrow of book {book_id} was not recorded.")
+            return None, 'busy'
+        print(f"Error borrowing book: {e}")
+        return None, 'error'
+    except Error as e:
+        print(f"Error borrowing book: {e}")
+        return None, 'error'
+
+def db_checkout_batch(conn, reader_id, book_ids, borrow_date, due_date, max_loans=None):
+    """
+    Borrows several books for one reader in a single transaction.
+    All titles are checked with one IN (...) query per table, then every claimable
+    copy is marked borrowed and every loan inserted with executemany, so the number
+    of statements does not grow with the basket.
+    Returns (outcomes, None), outcomes being a list of (book_id, record_id, reason) in
+    the order of book_ids: record_id is set for borrowed books, otherwise reason is
+    'not_found', 'borrowed', 'duplicate' or 'limit_reached'. Returns (None, reason)
+    with reason 'invalid_reader', 'busy' or 'error' if nothing could be processed.
+    """
+    unique_ids = list(dict.fromkeys(book_ids))
+    marks = ", ".join("?" * len(unique_ids))
+
+    def work(cur):
+        cur.execute("SELECT current_borrowed FROM READER WHERE reader_id = ?", (reader_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise TransactionAborted('invalid_reader')
+        room = None if max_loans is None else max(0, max_loans - row[0])
+
+        cur.execute(f"SELECT book_id FROM books WHERE book_id IN ({marks})", unique_ids)
+        existing = {r[0] for r in cur.fetchall()}
+        # The reader's own hold-shelf copies first, then one free copy per title
+        cur.execute(f"""SELECT book_id, hold_id, copy_id, status FROM HOLD
+                        WHERE reader_id = ? AND status IN ('waiting', 'ready') AND book_id IN ({marks})""",
+                    [reader_id] + unique_ids)
+        holds = {r[0]: r[1:] for r in cur.fetchall()}
+        cur.execute(f"""SELECT book_id, MIN(copy_id) FROM BOOK_COPY
+                        WHERE status = 'available' AND book_id IN ({marks}) GROUP BY book_id""", unique_ids)
+        free_copies = dict(cur.fetchall())
+
+        outcomes = {}
+        claims = []  # (book_id, copy_id, hold_id or None)
+        seen = set()
+        for book_id in book_ids:
+            if book_id in seen:
+                continue
+            seen.add(book_id)
+            hold = holds.get(book_id)
+            if book_id not in existing:
+                outcomes[book_id] = 'not_found'
+            elif hold is not None and hold[2] == 'ready':
+                claims.append((book_id, hold[1], hold[0]))
+            elif book_id in free_copies:
+                claims.append((book_id, free_copies[book_id], hold[0] if hold else None))
+            else:
+                outcomes[book_id] = 'borrowed'
+        if room is not None:
+            for book_id, _, _ in claims[room:]:
+                outcomes[book_id] = 'limit_reached'
+            claims = claims[:room]
+
+        if claims:
+            cur.executemany("UPDATE BOOK_COPY SET status = 'borrowed' WHERE copy_id = ?",
+                            [(copy_id,) for _, copy_id, _ in claims])
+            cur.executemany("UPDATE HOLD SET status = 'fulfilled' WHERE hold_id = ?",
+                            [(hold_id,) for _, _, hold_id in claims if hold_id is not None])
+            cur.executemany(''' INSERT INTO BORROWING_RECORD(book_id, copy_id, reader_id, borrow_date, due_date, fine_amount)
+                                VALUES(?,?,?,?,?,0) ''',
+                            [(book_id, copy_id, reader_id, borrow_date, due_date) for book_id, copy_id, _ in claims])
+            cur.execute("""UPDATE READER SET total_borrowed = total_borrowed + ?,
+                                             current_borrowed = current_borrowed + ?
+                           WHERE reader_id = ?""", (len(claims), len(claims), reader_id))
+            copy_marks = ", ".join("?" * len(claims))
+            cur.execute(f"""SELECT book_id, record_id FROM BORROWING_RECORD
+                            WHERE copy_id IN ({copy_marks}) AND return_date IS NULL""",
+                        [copy_id for _, copy_id, _ in claims])
+            outcomes.update((book_id, record_id) for book_id, record_id in cur.fetchall())
+
+        result, reported = [], set()
+        for book_id in book_ids:
+            if book_id in reported:
+                result.append((book_id, None, 'duplicate'))
+                continue
+            reported.add(book_id)
+            outcome = outcomes[book_id]
+            if isinstance(outcome, str):
+                result.append((book_id, None, outcome))
+            else:
+                result.append((book_id, outcome, None))
+        return result
+
+    if not unique_ids:
+        return [], None
+    try:
+        return run_in_transaction(conn, work), None
+    except TransactionAborted as e:
+        return None, e.reason
+    except sqlite3.OperationalError as e:
+        if _is_busy_error(e):
+            print(f"Error: Database is busy, checkout for reader {reader_id} was not recorded.")
+            return None, 'busy'
+        print(f"Error during checkout: {e}")
+        return None, 'error'
+    except Error as e:
+        print(f"Error during checkout: {e}")
+        return None, 'error'
+    finally:
+        for book_id in unique_ids:
+            invalidate_book(book_id)
+
+def db_reconcile_reader_counters(conn, fix=True):
+    """
+    Recomputes READER.total_borrowed / current_borrowed from BORROWING_RECORD in one
+    aggregate pass. Returns the readers whose counters had drifted, as rows
+    (reader_id, stored_total, stored_current, actual_total, actual_current);
+    with fix=True the counters are corrected in the same transaction.
+    """
+    sql = """SELECT r.reader_id, r.total_borrowed, r.current_borrowed,
+                    COALESCE(t.total, 0), COALESCE(t.open, 0)
+             FROM READER r
+             LEFT JOIN (SELECT reader_id, COUNT(*) AS total, SUM(return_date IS NULL) AS open
+                        FROM BORROWING_RECORD GROUP BY reader_id) t ON t.reader_id = r.reader_id
+             WHERE r.total_borrowed IS NOT COALESCE(t.total, 0)
+                OR r.current_borrowed IS NOT COALESCE(t.open, 0)"""
+
+    def work(cur):
+        cur.execute(sql)
+        drift = cur.fetchall()
+        if fix and drift:
+            cur.executemany("UPDATE READER SET total_borrowed = ?, current_borrowed = ? WHERE reader_id = ?",
+                            [(total, current, reader_id) for reader_id, _, _, total, current in drift])
+        return drift
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error reconciling reader counters: {e}")
+        return None
+
+# Days overdue, computed in SQL from ISO dates (never negative)
+_DAYS_OVERDUE_SQL = "MAX(0, CAST(julianday(?) - julianday(due_date) AS INTEGER))"
+
+def db_return_book(conn, book_id, return_date, fine_per_day, copy_id=None, shelf_days=3, reader_id=None):
+    """
+    Returns a book in one transaction: closes its open loan (fine computed in SQL)
+    and passes the copy to the next waiting hold (kept on the hold shelf for
+    'shelf_days' days) or makes it available again. With 'copy_id' the loan of
+    that copy is closed, otherwise the open loan of the title that is due first.
+    With 'reader_id' only a loan of that reader is closed.
+    Returns (record_id, fine_amount, hold, None) on success, where hold is the
+    (hold_id, reader_id) the copy was assigned to or None, or (None, 0, None, reason)
+    where reason is 'not_borrowed', 'busy' or 'error'.
+    """
+    def work(cur):
+        # Both use a partial index on open loans
+        if copy_id is not None:
+            cur.execute("""SELECT record_id, reader_id, copy_id, book_id FROM BORROWING_RECORD
+                           WHERE copy_id = ? AND return_date IS NULL
+                             AND (? IS NULL OR reader_id = ?)""", (copy_id, reader_id, reader_id))
+        else:
+            cur.execute("""SELECT record_id, reader_id, copy_id, book_id FROM BORROWING_RECORD
+                           WHERE book_id = ? AND return_date IS NULL AND (? IS NULL OR reader_id = ?)
+                           ORDER BY due_date LIMIT 1""", (book_id, reader_id, reader_id))
+        row = cur.fetchone()
+        if row is None:
+            return None, 0, None, 'not_borrowed'
+        record_id, loan_reader_id, loan_copy_id, loan_book_id = row
+
+        cur.execute(f"""UPDATE BORROWING_RECORD
+                        SET return_date = ?, fine_amount = {_DAYS_OVERDUE_SQL} * ?
+                        WHERE record_id = ?""",
+                    (return_date, return_date, fine_per_day, record_id))
+        hold = _pass_copy_to_next_hold(cur, loan_book_id, loan_copy_id, return_date, shelf_days)
+        cur.execute("UPDATE READER SET current_borrowed = current_borrowed - 1 "
+                    "WHERE reader_id = ? AND current_borrowed > 0", (loan_reader_id,))
+        cur.execute("SELECT fine_amount FROM BORROWING_RECORD WHERE record_id = ?", (record_id,))
+        return record_id, cur.fetchone()[0], hold, None
+
+    try:
+        result = run_in_transaction(conn, work)
+        invalidate_book(book_id)
+        return result
+    except sqlite3.OperationalError as e:
+        if _is_busy_error(e):
+            print(f"Error: Database is busy, return of book {book_id} was not recorded.")
+            return None, 0, None, 'busy'
+        print(f"Error returning book: {e}")
+        return None, 0, None, 'error'
+    except Error as e:
+        print(f"Error returning book: {e}")
+        return None, 0, None, 'error'
+
+def db_assess_overdue_fines(conn, as_of, fine_per_day):
+    """
+    End-of-day fine run for every open loan that is overdue on 'as_of'.
+    One set-based UPDATE recomputes all accrued fines and one aggregate query
+    summarises them - both walk only the open-loans index, no Python loop.
+    Returns (overdue_loans, total_accrued_fines), or None on error.
+    """
+    def work(cur):
+        cur.execute(f"""UPDATE BORROWING_RECORD
+                        SET fine_amount = {_DAYS_OVERDUE_SQL} * ?
+                        WHERE return_date IS NULL AND due_date < ?""",
+                    (as_of, fine_per_day, as_of))
+        cur.execute("""SELECT COUNT(*), COALESCE(SUM(fine_amount), 0) FROM BORROWING_RECORD
+                       WHERE return_date IS NULL AND due_date < ?""", (as_of,))
+        return cur.fetchone()
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error assessing overdue fines: {e}")
+        return None
+
+def db_search_books(conn, keyword):
+    """Finds books by title, author or genre, best matches first (cached per keyword)"""
+    cache_key = ("all", keyword)
+    rows = _search_cache.get(cache_key)
+    if rows is not None:
+        return list(rows)
+
+    version = _search_cache.version
+    rows = _search_books_uncached(conn, keyword)
+    if len(rows) <= SEARCH_CACHE_MAX_ROWS:
+        _search_cache.put(cache_key, tuple(rows), tags=[row[0] for row in rows], version=version)
+    return rows
+
+def _search_books_uncached(conn, keyword):
+    match_query = _build_fts_query(keyword)
+    if match_query is not None:
+        sql = """SELECT b.* FROM books_fts
+                 JOIN books b ON b.book_id = books_fts.rowid
+                 WHERE books_fts MATCH ?
+                 ORDER BY bm25(books_fts, ?, ?, ?)"""
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, (match_query, *SEARCH_RANK_WEIGHTS))
+            return cur.fetchall()
+        except sqlite3.OperationalError as e:
+            # No FTS5 index on this database: use the slow LIKE scan below
+            if "no such table" not in str(e):
+                raise
+
+    sql = "SELECT * FROM books WHERE title LIKE ? OR author LIKE ?"
+    cur = conn.cursor()
+    keyword_like = f"%{keyword}%" # Add % for wildcard search
+    cur.execute(sql, (keyword_like, keyword_like))
+    return cur.fetchall() # fetchall() returns a list of rows
+
+# ===============================================
+# ===== PAGINATED LISTINGS (KEYSET) =====
+# ===============================================
+# Keyset pagination: each page continues after the last key of the previous page
+# (WHERE key > ? ORDER BY key LIMIT ?), so every page is one index range scan -
+# no OFFSET, and no result set is ever loaded whole.
+
+def db_list_books_page(conn, after_book_id=0, limit=DEFAULT_PAGE_SIZE):
+    """Returns up to 'limit' books with book_id > after_book_id, by book_id"""
+    sql = "SELECT * FROM books WHERE book_id > ? ORDER BY book_id LIMIT ?"
+    cur = conn.cursor()
+    cur.execute(sql, (after_book_id, limit))
+    return cur.fetchall()
+
+def db_iter_books(conn, batch_size=500):
+    """Generator over the whole catalog, one keyset page at a time"""
+    after_book_id = 0
+    while True:
+        rows = db_list_books_page(conn, after_book_id, batch_size)
+        if not rows:
+            return
+        yield from rows
+        after_book_id = rows[-1][0]
+
+def db_list_readers_page(conn, after_reader_id=0, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns up to 'limit' readers with reader_id > after_reader_id, by reader_id.
+    Row: (reader_id, user_id, username, name, email, phone, membership_date, total_borrowed)
+    """
+    sql = """SELECT r.reader_id, u.user_id, u.username, u.name, u.email, u.phone,
+                    r.membership_date, r.total_borrowed
+             FROM READER r JOIN User u ON u.user_id = r.user_id
+             WHERE r.reader_id > ?
+             ORDER BY r.reader_id LIMIT ?"""
+    cur = conn.cursor()
+    cur.execute(sql, (after_reader_id, limit))
+    return cur.fetchall()
+
+def db_search_books_page(conn, keyword, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of search results, best matches first (cached per keyword and cursor).
+    'after' is the cursor returned with the previous page (None for the first page).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    cache_key = ("page", keyword, after, limit)
+    cached = _search_cache.get(cache_key)
+    if cached is not None:
+        return list(cached[0]), cached[1]
+
+    version = _search_cache.version
+    rows, next_cursor = _search_books_page_uncached(conn, keyword, after, limit)
+    _search_cache.put(cache_key, (tuple(rows), next_cursor), tags=[row[0] for row in rows], version=version)
+    return rows, next_cursor
+
+def _search_books_page_uncached(conn, keyword, after, limit):
+    match_query = _build_fts_query(keyword)
+    if match_query is not None:
+        # Cursor = (score, book_id) of the last row; the book_id breaks ties between equal scores
+        sql = """SELECT * FROM (
+                     SELECT b.*, bm25(books_fts, ?, ?, ?) AS score FROM books_fts
+                     JOIN books b ON b.book_id = books_fts.rowid
+                     WHERE books_fts MATCH ?)
+                 WHERE score > ? OR (score = ? AND book_id > ?)
+                 ORDER BY score, book_id LIMIT ?"""
+        last_score, last_id = after if after is not None else (float("-inf"), 0)
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, (*SEARCH_RANK_WEIGHTS, match_query,
+                              last_score, last_score, last_id, limit + 1))
+            rows = cur.fetchall()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = (rows[-1][-1], rows[-1][0])
+            return [row[:-1] for row in rows], next_cursor
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+
+    # LIKE fallback: cursor = last book_id
+    sql = """SELECT * FROM books WHERE (title LIKE ? OR author LIKE ?) AND book_id > ?
+             ORDER BY book_id LIMIT ?"""
+    keyword_like = f"%{keyword}%"
+    last_id = after[1] if after is not None else 0
+    cur = conn.cursor()
+    cur.execute(sql, (keyword_like, keyword_like, last_id, limit + 1))
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (None, rows[-1][0])
+    return rows, next_cursor
+
+# ===============================================
+# ===== FACETED SEARCH =====
+# ===============================================
+# Keyword + filters (genre, status, author) + sort key, one keyset page at a time,
+# with the number of matching books per genre and per status. The counts come from
+# a genre x status "cube" of (genre, status, count) cells: for the whole catalog it is
+# BOOK_FACET_COUNT (kept up to date by triggers); with a keyword or author it is one
+# GROUP BY over the FTS matches or the covering author index. Genre/status filters
+# are applied to the cube, which has only a few cells.
+
+# Sort keys: (SQL expression used for ORDER BY and the cursor, direction)
+SEARCH_SORT_KEYS = {
+    "relevance": (None, "ASC"),   # bm25 of the keyword (title order without a keyword)
+    "title": ("b.title", "ASC"),
+    "author": ("b.author", "ASC"),
+    "newest": ("b.book_id", "DESC"),
+}
+
+def create_facet_tables(conn):
+    """Creates BOOK_FACET_COUNT and the triggers that maintain it"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS BOOK_FACET_COUNT (
+        genre TEXT NOT NULL,   -- '' for books without a genre
+        status TEXT NOT NULL,
+        book_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (genre, status)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS facet_after_insert AFTER INSERT ON books BEGIN
+        INSERT INTO BOOK_FACET_COUNT(genre, status, book_count) VALUES (COALESCE(new.genre, ''), new.status, 1)
+            ON CONFLICT(genre, status) DO UPDATE SET book_count = book_count + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS facet_after_delete AFTER DELETE ON books BEGIN
+        UPDATE BOOK_FACET_COUNT SET book_count = book_count - 1
+        WHERE genre = COALESCE(old.genre, '') AND status = old.status;
+    END;
+    CREATE TRIGGER IF NOT EXISTS facet_after_update AFTER UPDATE OF genre, status ON books
+    WHEN old.genre IS NOT new.genre OR old.status <> new.status BEGIN
+        UPDATE BOOK_FACET_COUNT SET book_count = book_count - 1
+        WHERE genre = COALESCE(old.genre, '') AND status = old.status;
+        INSERT INTO BOOK_FACET_COUNT(genre, status, book_count) VALUES (COALESCE(new.genre, ''), new.status, 1)
+            ON CONFLICT(genre, status) DO UPDATE SET book_count = book_count + 1;
+    END;
+    """)
+
+def db_rebuild_facet_counts(conn):
+    """Recomputes BOOK_FACET_COUNT from the books table"""
+    def work(cur):
+        cur.execute("DELETE FROM BOOK_FACET_COUNT")
+        cur.execute("""INSERT INTO BOOK_FACET_COUNT(genre, status, book_count)
+                       SELECT COALESCE(genre, ''), status, COUNT(*) FROM books
+                       GROUP BY COALESCE(genre, ''), status""")
+        return True
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error rebuilding facet counts: {e}")
+        return False
+    finally:
+        invalidate_catalog()
+
+def _keyword_source(keyword, use_fts):
+    """FROM clause, WHERE conditions and parameters of the books matching 'keyword'"""
+    match_query = _build_fts_query(keyword) if keyword else None
+    if match_query is None or not use_fts:
+        if not keyword:
+            return "books b", [], []
+        keyword_like = f"%{keyword}%"
+        return "books b", ["(b.title LIKE ? OR b.author LIKE ?)"], [keyword_like, keyword_like]
+    return ("books_fts JOIN books b ON b.book_id = books_fts.rowid",
+            ["books_fts MATCH ?"], [match_query])
+
+def _facet_cube(cur, source, conditions, params):
+    """(genre, status, count) cells of the books matching the keyword/author conditions"""
+    if conditions:
+        cur.execute(f"""SELECT b.genre, b.status, COUNT(*) FROM {source}
+                        WHERE {" AND ".join(conditions)} GROUP BY b.genre, b.status""", params)
+        return cur.fetchall()
+    cur.execute("SELECT NULLIF(genre, ''), status, book_count FROM BOOK_FACET_COUNT WHERE book_count > 0")
+    return cur.fetchall()
+
+def _facet_counts(cube, genre, status):
+    """
+    Per-genre and per-status counts. Each facet ignores its own filter, so the
+    other genres (statuses) still show how many books selecting them would give.
+    """
+    genres, statuses, total = Counter(), Counter(), 0
+    for cell_genre, cell_status, count in cube:
+        if status is None or cell_status == status:
+            genres[cell_genre] += count
+        if genre is None or cell_genre == genre:
+            statuses[cell_status] += count
+            if status is None or cell_status == status:
+                total += count
+    return {"genre": genres.most_common(), "status": statuses.most_common(), "total": total}
+
+def db_faceted_search(conn, keyword="", genre=None, status=None, author=None, sort=None,
+                      after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of books matching 'keyword' (may be empty) and the exact-match filters,
+    ordered by 'sort' (a SEARCH_SORT_KEYS name; default relevance with a keyword,
+    title without). 'after' is the cursor returned with the previous page.
+    Returns (rows, next_cursor, facets) with facets = {"genre": [(genre, count), ...],
+    "status": [(status, count), ...], "total": matching books}, or None on error.
+    """
+    sort = sort or ("relevance" if keyword else "title")
+    if sort not in SEARCH_SORT_KEYS:
+        raise ValueError(f"Unknown sort key '{sort}'")
+    cache_key = ("facets", keyword, genre, status, author, sort, after, limit)
+    cached = _search_cache.get(cache_key)
+    if cached is not None:
+        return list(cached[0]), cached[1], cached[2]
+
+    version = _search_cache.version
+    try:
+        try:
+            result = _faceted_search_uncached(conn, keyword, genre, status, author, sort, after, limit, True)
+        except sqlite3.OperationalError as e:
+            # No FTS5 index on this database: match the keyword with LIKE
+            if "no such table" not in str(e):
+                raise
+            result = _faceted_search_uncached(conn, keyword, genre, status, author, sort, after, limit, False)
+    except Error as e:
+        print(f"Error in faceted search: {e}")
+        return None
+
+    rows, next_cursor, facets = result
+    _search_cache.put(cache_key, (tuple(rows), next_cursor, facets),
+                      tags=[row[0] for row in rows] + [FACETS_TAG], version=version)
+    return rows, next_cursor, facets
+
+def _faceted_search_uncached(conn, keyword, genre, status, author, sort, after, limit, use_fts):
+    source, conditions, params = _keyword_source(keyword, use_fts)
+    if author is not None:
+        conditions.append("b.author = ?")
+        params.append(author)
+
+    cur = conn.cursor()
+    facets = _facet_counts(_facet_cube(cur, source, conditions, params), genre, status)
+
+    for column, value in (("b.genre", genre), ("b.status", status)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    sort_key, direction = SEARCH_SORT_KEYS[sort]
+    if sort_key is None:
+        if source.startswith("books_fts"):
+            sort_key = "bm25(books_fts, ?, ?, ?)"
+            params = list(SEARCH_RANK_WEIGHTS) + params
+        else:
+            sort_key = "b.title"
+
+    # Keyset page: cursor = (sort value, book_id) of the last row. NULLs come first
+    # in ascending order (only 'author' can be NULL, and it sorts ascending).
+    page_conditions, page_params = [], []
+    if after is not None:
+        last_value, last_id = after
+        if last_value is None:
+            page_conditions.append("((sort_key IS NULL AND book_id > ?) OR sort_key IS NOT NULL)")
+            page_params = [last_id]
+        else:
+            page_conditions.append(f"(sort_key, book_id) {'>' if direction == 'ASC' else '<'} (?, ?)")
+            page_params = [last_value, last_id]
+    where = " AND ".join(conditions) or "1"
+    page_where = " AND ".join(page_conditions) or "1"
+    cur.execute(f"""SELECT * FROM (SELECT b.*, {sort_key} AS sort_key FROM {source} WHERE {where})
+                    WHERE {page_where} ORDER BY sort_key {direction}, book_id {direction} LIMIT ?""",
+                params + page_params + [limit + 1])
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][-1], rows[-1][0])
+    return [row[:-1] for row in rows], next_cursor, facets
+
+# ===============================================
+# ===== AUDIT LOG =====
+# ===============================================
+# Circulation events (borrowed, returned, registered, ...) written in batches by the
+# background writer in audit.py. AUDIT_EVENT is append-only: triggers reject every
+# UPDATE and DELETE. It has no foreign keys, so the trail outlives deleted rows.
+
+AUDIT_EVENT_COLUMNS = ("event_id", "event_time", "event_type", "user_id", "reader_id",
+                       "book_id", "record_id", "details")
+
+def create_audit_tables(conn):
+    """Creates AUDIT_EVENT, its indexes and the triggers that keep it append-only"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS AUDIT_EVENT (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_time TEXT NOT NULL,         -- local time, ISO 8601 with milliseconds
+        event_type TEXT NOT NULL,
+        user_id INTEGER,
+        reader_id INTEGER,
+        book_id INTEGER,
+        record_id INTEGER,                -- BORROWING_RECORD of borrow/return events
+        details TEXT                      -- JSON object
+    );
+    CREATE INDEX IF NOT EXISTS idx_audit_time ON AUDIT_EVENT(event_time);
+    CREATE INDEX IF NOT EXISTS idx_audit_reader ON AUDIT_EVENT(reader_id, event_id)
+        WHERE reader_id IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS idx_audit_book ON AUDIT_EVENT(book_id, event_id)
+        WHERE book_id IS NOT NULL;
+
+    CREATE TRIGGER IF NOT EXISTS audit_no_update BEFORE UPDATE ON AUDIT_EVENT BEGIN
+        SELECT RAISE(ABORT, 'AUDIT_EVENT is append-only');
+    END;
+    CREATE TRIGGER IF NOT EXISTS audit_no_delete BEFORE DELETE ON AUDIT_EVENT BEGIN
+        SELECT RAISE(ABORT, 'AUDIT_EVENT is append-only');
+    END;
+    """)
+
+def db_append_audit_events(conn, events):
+    """
+    Appends events in one transaction. events is a list of
+    (event_time, event_type, user_id, reader_id, book_id, record_id, details_json).
+    A missing reader_id is taken from the loan ('returned' events only know the record).
+    Returns the number of events written, or None on error.
+    """
+    sql = """INSERT INTO AUDIT_EVENT(event_time, event_type, user_id, reader_id, book_id, record_id, details)
+             VALUES (?1, ?2, ?3,
+                     COALESCE(?4, (SELECT reader_id FROM BORROWING_RECORD WHERE record_id = ?6)),
+                     ?5, ?6, ?7)"""
+
+    def work(cur):
+        cur.executemany(sql, events)
+        return len(events)
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error writing audit events: {e}")
+        return None
+
+def db_query_audit_events(conn, reader_id=None, book_id=None, event_types=None, since=None, until=None,
+                          after_event_id=0, limit=DEFAULT_PAGE_SIZE):
+    """
+    Up to 'limit' events with event_id > after_event_id, oldest first, filtered by
+    reader, book, event types and time (since inclusive, until exclusive, ISO strings).
+    Rows follow AUDIT_EVENT_COLUMNS.
+    """
+    conditions, params = ["event_id > ?"], [after_event_id]
+    for column, value in (("reader_id", reader_id), ("book_id", book_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if event_types:
+        conditions.append(f"event_type IN ({', '.join('?' * len(event_types))})")
+        params.extend(event_types)
+    if since is not None:
+        conditions.append("event_time >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("event_time < ?")
+        params.append(until)
+
+    cur = conn.cursor()
+    cur.execute(f"""SELECT {", ".join(AUDIT_EVENT_COLUMNS)} FROM AUDIT_EVENT
+                    WHERE {" AND ".join(conditions)} ORDER BY event_id LIMIT ?""", params + [limit])
+    return cur.fetchall()
+
+# ===============================================
+# ===== STATISTICS (SUMMARY TABLES) =====
+# ===============================================
+# Reports read small summary tables instead of scanning BORROWING_RECORD.
+# Triggers on BORROWING_RECORD keep them up to date on every borrow and return,
+# whichever code path writes the record; db_rebuild_statistics() recomputes
+# them from scratch (used by the migration and for recovery).
+
+def create_statistics_tables(conn):
+    """Creates the summary tables and the triggers that maintain them"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS STAT_DAILY (
+        day TEXT PRIMARY KEY,
+        loans INTEGER NOT NULL DEFAULT 0,
+        returns INTEGER NOT NULL DEFAULT 0,
+        fines_collected REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS STAT_BOOK_LOANS (
+        book_id INTEGER PRIMARY KEY,
+        loan_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_stat_book_loans_count ON STAT_BOOK_LOANS(loan_count);
+    CREATE TABLE IF NOT EXISTS STAT_READER_ACTIVITY (
+        reader_id INTEGER PRIMARY KEY,
+        loan_count INTEGER NOT NULL DEFAULT 0,
+        last_borrow_date TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_stat_reader_last_borrow ON STAT_READER_ACTIVITY(last_borrow_date);
+
+    CREATE TRIGGER IF NOT EXISTS stat_after_borrow AFTER INSERT ON BORROWING_RECORD BEGIN
+        INSERT INTO STAT_DAILY(day, loans) VALUES (new.borrow_date, 1)
+            ON CONFLICT(day) DO UPDATE SET loans = loans + 1;
+        INSERT INTO STAT_BOOK_LOANS(book_id, loan_count) VALUES (new.book_id, 1)
+            ON CONFLICT(book_id) DO UPDATE SET loan_count = loan_count + 1;
+        INSERT INTO STAT_READER_ACTIVITY(reader_id, loan_count, last_borrow_date)
+            VALUES (new.reader_id, 1, new.borrow_date)
+            ON CONFLICT(reader_id) DO UPDATE SET
+                loan_count = loan_count + 1,
+                last_borrow_date = MAX(COALESCE(last_borrow_date, ''), excluded.last_borrow_date);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS stat_after_return AFTER UPDATE OF return_date ON BORROWING_RECORD
+    WHEN old.return_date IS NULL AND new.return_date IS NOT NULL BEGIN
+        INSERT INTO STAT_DAILY(day, returns, fines_collected) VALUES (new.return_date, 1, new.fine_amount)
+            ON CONFLICT(day) DO UPDATE SET
+                returns = returns + 1,
+                fines_collected = fines_collected + excluded.fines_collected;
+    END;
+    """)
+
+def db_rebuild_statistics(conn):
+    """Recomputes every summary table from BORROWING_RECORD in one transaction"""
+    def work(cur):
+        cur.execute("DELETE FROM STAT_DAILY")
+        cur.execute("DELETE FROM STAT_BOOK_LOANS")
+        cur.execute("DELETE FROM STAT_READER_ACTIVITY")
+        cur.execute("""INSERT INTO STAT_DAILY(day, loans, returns, fines_collected)
+                       SELECT day, SUM(loans), SUM(returns), SUM(fines) FROM (
+                           SELECT borrow_date AS day, 1 AS loans, 0 AS returns, 0 AS fines
+                           FROM BORROWING_RECORD
+                           UNION ALL
+                           SELECT return_date, 0, 1, fine_amount
+                           FROM BORROWING_RECORD WHERE return_date IS NOT NULL)
+                       GROUP BY day""")
+        cur.execute("""INSERT INTO STAT_BOOK_LOANS(book_id, loan_count)
+                       SELECT book_id, COUNT(*) FROM BORROWING_RECORD GROUP BY book_id""")
+        cur.execute("""INSERT INTO STAT_READER_ACTIVITY(reader_id, loan_count, last_borrow_date)
+                       SELECT reader_id, COUNT(*), MAX(borrow_date) FROM BORROWING_RECORD
+                       GROUP BY reader_id""")
+        return True
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error rebuilding statistics: {e}")
+        return False
+
+def db_get_daily_activity(conn, since, until):
+    """Rows (day, loans, returns, fines_collected) for since <= day <= until"""
+    cur = conn.cursor()
+    cur.execute("""SELECT day, loans, returns, fines_collected FROM STAT_DAILY
+                   WHERE day BETWEEN ? AND ? ORDER BY day""", (since, until))
+    return cur.fetchall()
+
+def db_get_top_borrowed_books(conn, limit=10):
+    """Rows (book_id, title, loan_count), most borrowed first"""
+    cur = conn.cursor()
+    cur.execute("""SELECT s.book_id, b.title, s.loan_count FROM STAT_BOOK_LOANS s
+                   LEFT JOIN books b ON b.book_id = s.book_id
+                   ORDER BY s.loan_count DESC LIMIT ?""", (limit,))
+    return cur.fetchall()
+
+def db_count_active_readers(conn, since):
+    """Number of readers who borrowed at least once on or after 'since'"""
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM STAT_READER_ACTIVITY WHERE last_borrow_date >= ?", (since,))
+    return cur.fetchone()[0]
+
+def db_count_overdue_loans(conn, as_of):
+    """Open loans past their due date (a range scan of the open-loans index)"""
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM BORROWING_RECORD WHERE return_date IS NULL AND due_date < ?",
+                (as_of,))
+    return cur.fetchone()[0]
+
+# ===============================================
+# ===== HOLDINGS (PHYSICAL COPIES) =====
+# ===============================================
+# 'books' holds one row per title; each physical copy is a BOOK_COPY row with its
+# own barcode and status. Triggers on BOOK_COPY keep books.total_copies,
+# books.available_copies and books.status ('available' while at least one copy is)
+# up to date, so searches read availability from the title row without a GROUP BY.
+# Inserting a book creates its first copy, so existing insert paths need no change.
+
+# Barcode given to copies added without one (C + zero-padded copy_id)
+AUTO_BARCODE_SQL = "printf('C%08d', new.copy_id)"
+
+def _copy_counter_sql(book_id, sign, status):
+    """UPDATE of the title counters when one copy (of 'status') is added (+) or removed (-)"""
+    available = f"({status} = 'available')"
+    return f"""UPDATE books SET
+            total_copies = total_copies {sign} 1,
+            available_copies = available_copies {sign} {available},
+            status = CASE WHEN available_copies {sign} {available} > 0 THEN 'available' ELSE 'borrowed' END
+        WHERE book_id = {book_id};"""
+
+# 'on_hold': waiting on the hold shelf for the reader at the head of the queue
+_BOOK_COPY_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        copy_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL,
+        barcode TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'available' CHECK(status IN ('available', 'borrowed', 'on_hold')),
+        added_date TEXT NOT NULL DEFAULT (date('now')),
+        FOREIGN KEY (book_id) REFERENCES books (book_id)
+    );
+"""
+
+def create_holdings_tables(conn):
+    """Creates BOOK_COPY and the triggers that maintain the per-title copy counters"""
+    conn.executescript(_BOOK_COPY_TABLE_SQL.format(name="BOOK_COPY") + f"""
+    -- Free copy of a title (borrow), copies of a title (listing)
+    CREATE INDEX IF NOT EXISTS idx_copy_book_status ON BOOK_COPY(book_id, status);
+
+    CREATE TRIGGER IF NOT EXISTS books_after_insert_copy AFTER INSERT ON books BEGIN
+        INSERT INTO BOOK_COPY(book_id, status) VALUES (new.book_id, new.status);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS copy_after_insert AFTER INSERT ON BOOK_COPY BEGIN
+        {_copy_counter_sql("new.book_id", "+", "new.status")}
+    END;
+    CREATE TRIGGER IF NOT EXISTS copy_auto_barcode AFTER INSERT ON BOOK_COPY
+    WHEN new.barcode IS NULL BEGIN
+        UPDATE BOOK_COPY SET barcode = {AUTO_BARCODE_SQL} WHERE copy_id = new.copy_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS copy_after_delete AFTER DELETE ON BOOK_COPY BEGIN
+        {_copy_counter_sql("old.book_id", "-", "old.status")}
+    END;
+    CREATE TRIGGER IF NOT EXISTS copy_after_status AFTER UPDATE OF status ON BOOK_COPY
+    WHEN old.status <> new.status AND old.book_id = new.book_id BEGIN
+        UPDATE books SET
+            available_copies = available_copies + (new.status = 'available') - (old.status = 'available'),
+            status = CASE WHEN available_copies + (new.status = 'available') - (old.status = 'available') > 0
+                          THEN 'available' ELSE 'borrowed' END
+        WHERE book_id = new.book_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS copy_after_move AFTER UPDATE OF book_id ON BOOK_COPY
+    WHEN old.book_id <> new.book_id BEGIN
+        {_copy_counter_sql("old.book_id", "-", "old.status")}
+        {_copy_counter_sql("new.book_id", "+", "new.status")}
+    END;
+    """)
+
+def db_rebuild_copy_counters(conn):
+    """Recomputes total/available copies and the status of every title in one pass"""
+    def work(cur):
+        cur.execute("""UPDATE books SET
+                           total_copies = (SELECT COUNT(*) FROM BOOK_COPY c WHERE c.book_id = books.book_id),
+                           available_copies = (SELECT COUNT(*) FROM BOOK_COPY c
+                                               WHERE c.book_id = books.book_id AND c.status = 'available')""")
+        cur.execute("""UPDATE books SET status = CASE WHEN available_copies > 0
+                                                      THEN 'available' ELSE 'borrowed' END""")
+        return True
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error rebuilding copy counters: {e}")
+        return False
+    finally:
+        clear_caches()
+
+def db_add_copies(conn, book_id, count=1, barcodes=None, today=None, shelf_days=3):
+    """
+    Adds physical copies of a title: one per barcode in 'barcodes', or 'count'
+    copies with automatic barcodes. New copies go to waiting holds first.
+    Returns the number of copies added (0 on error).
+    """
+    rows = [(book_id, barcode) for barcode in barcodes] if barcodes else [(book_id, None)] * count
+    today = today or time.strftime("%Y-%m-%d")
+
+    def work(cur):
+        cur.execute("SELECT 1 FROM books WHERE book_id = ?", (book_id,))
+        if cur.fetchone() is None:
+            raise TransactionAborted('not_found')
+        cur.executemany("INSERT INTO BOOK_COPY(book_id, barcode) VALUES (?, ?)", rows)
+        _assign_free_copies(cur, book_id, today, shelf_days)
+        return len(rows)
+
+    try:
+        return run_in_transaction(conn, work)
+    except TransactionAborted:
+        print(f"Error: Book with ID {book_id} not found.")
+        return 0
+    except Error as e:
+        print(f"Error adding copies: {e}")
+        return 0
+    finally:
+        invalidate_book(book_id)
+
+def db_get_copies(conn, book_id):
+    """Rows (copy_id, barcode, status, added_date) of a title's copies"""
+    cur = conn.cursor()
+    cur.execute("""SELECT copy_id, barcode, status, added_date FROM BOOK_COPY
+                   WHERE book_id = ? ORDER BY copy_id""", (book_id,))
+    return cur.fetchall()
+
+def db_get_copy_by_barcode(conn, barcode):
+    """Row (copy_id, book_id, status) of the copy with this barcode, or None"""
+    cur = conn.cursor()
+    cur.execute("SELECT copy_id, book_id, status FROM BOOK_COPY WHERE barcode = ?", (barcode,))
+    return cur.fetchone()
+
+def db_merge_duplicate_titles(conn, today=None, shelf_days=3):
+    """
+    Merges 'books' rows with the same title, author and genre (one row per physical
+    copy, as stored before holdings) into the lowest book_id: copies, loan history and
+    holds move to that title and the duplicate rows are deleted. A reader holding
+    several of the merged rows keeps one hold (a ready one, else the earliest); free
+    copies of the merged title then go to its waiting holds.
+    Returns the number of rows merged away, or None on error.
+    """
+    today = today or time.strftime("%Y-%m-%d")
+
+    def work(cur):
+        cur.execute("DROP TABLE IF EXISTS temp.title_merge")
+        cur.execute("""CREATE TEMP TABLE title_merge AS
+                       SELECT book_id, keep_id FROM (
+                           SELECT book_id, MIN(book_id) OVER (
+                               PARTITION BY title, COALESCE(author, ''), COALESCE(genre, '')) AS keep_id
+                           FROM books)
+                       WHERE book_id <> keep_id""")
+        cur.execute("CREATE UNIQUE INDEX temp.idx_title_merge ON title_merge(book_id)")
+        cur.execute("SELECT COUNT(*) FROM title_merge")
+        merged = cur.fetchone()[0]
+        if merged:
+            cur.execute("""UPDATE BOOK_COPY SET book_id =
+                               (SELECT keep_id FROM title_merge m WHERE m.book_id = BOOK_COPY.book_id)
+                           WHERE book_id IN (SELECT book_id FROM title_merge)""")
+            cur.execute("""UPDATE BORROWING_RECORD SET book_id =
+                               (SELECT keep_id FROM title_merge m WHERE m.book_id = BORROWING_RECORD.book_id)
+                           WHERE book_id IN (SELECT book_id FROM title_merge)""")
+            _merge_holds(cur)
+            cur.execute("DELETE FROM books WHERE book_id IN (SELECT book_id FROM title_merge)")
+            cur.execute("""SELECT DISTINCT keep_id FROM title_merge m
+                           WHERE EXISTS (SELECT 1 FROM HOLD h WHERE h.book_id = m.keep_id AND h.status = 'waiting')""")
+            for (keep_id,) in cur.fetchall():
+                _assign_free_copies(cur, keep_id, today, shelf_days)
+        cur.execute("DROP TABLE temp.title_merge")
+        return merged
+
+    try:
+        merged = run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error merging duplicate titles: {e}")
+        return None
+    finally:
+        clear_caches()
+    # The merged rows left the catalog
+    db_refresh_trigram_index(conn)
+    if merged:
+        # Per-book loan counts were keyed by the merged book_ids
+        db_rebuild_statistics(conn)
+    return merged
+
+def _merge_holds(cur):
+    """
+    Moves the holds of the rows in temp.title_merge to their kept title.
+    Runs inside the caller's transaction, before the duplicate rows are deleted.
+    """
+    # Active holds of one reader that would land on the same title (idx_hold_active_reader):
+    # keep a ready hold (its copy is on the shelf), else the earliest place in a queue
+    cur.execute("DROP TABLE IF EXISTS temp.hold_merge_dupes")
+    cur.execute("""CREATE TEMP TABLE hold_merge_dupes AS
+                   SELECT hold_id, status, copy_id FROM (
+                       SELECT h.hold_id, h.status, h.copy_id, ROW_NUMBER() OVER (
+                           PARTITION BY COALESCE(m.keep_id, h.book_id), h.reader_id
+                           ORDER BY h.status = 'ready' DESC, h.hold_id) AS position
+                       FROM HOLD h LEFT JOIN title_merge m ON m.book_id = h.book_id
+                       WHERE h.status IN ('waiting', 'ready')
+                         AND COALESCE(m.keep_id, h.book_id) IN (SELECT keep_id FROM title_merge))
+                   WHERE position > 1""")
+    cur.execute("UPDATE HOLD SET status = 'cancelled' WHERE hold_id IN (SELECT hold_id FROM hold_merge_dupes)")
+    # Copies those holds kept on the shelf are free again (handed on below)
+    cur.execute("""UPDATE BOOK_COPY SET status = 'available'
+                   WHERE copy_id IN (SELECT copy_id FROM hold_merge_dupes WHERE status = 'ready')""")
+    cur.execute("DROP TABLE temp.hold_merge_dupes")
+    cur.execute("""UPDATE HOLD SET book_id =
+                       (SELECT keep_id FROM title_merge m WHERE m.book_id = HOLD.book_id)
+                   WHERE book_id IN (SELECT book_id FROM title_merge)""")
+
+# ===============================================
+# ===== HOLDS (RESERVATIONS) =====
+# ===============================================
+# Readers queue for a title when no copy is free. The queue position is the hold_id
+# order, so "next in line" is the first entry of the partial index idx_hold_queue
+# (one B-tree lookup, however long the queue). A returned copy goes straight to the
+# next waiting hold and stays on the hold shelf ('on_hold') until it is borrowed by
+# that reader or the hold expires and the copy moves on down the queue.
+
+def create_hold_tables(conn):
+    """Creates the HOLD table and its indexes"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS HOLD (
+        hold_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER NOT NULL,
+        reader_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'waiting'
+            CHECK(status IN ('waiting', 'ready', 'fulfilled', 'cancelled', 'expired')),
+        placed_date TEXT NOT NULL,
+        copy_id INTEGER,
+        ready_date TEXT,
+        expires_on TEXT,
+        FOREIGN KEY (book_id) REFERENCES books (book_id),
+        FOREIGN KEY (reader_id) REFERENCES READER (reader_id),
+        FOREIGN KEY (copy_id) REFERENCES BOOK_COPY (copy_id)
+    );
+    -- The queue of a title, in order (only waiting holds are indexed)
+    CREATE INDEX IF NOT EXISTS idx_hold_queue ON HOLD(book_id, hold_id) WHERE status = 'waiting';
+    -- One active hold per reader and title
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_hold_active_reader
+        ON HOLD(book_id, reader_id) WHERE status IN ('waiting', 'ready');
+    -- Hold-shelf copies by expiry date
+    CREATE INDEX IF NOT EXISTS idx_hold_shelf_expiry ON HOLD(expires_on) WHERE status = 'ready';
+    -- Holds of a reader
+    CREATE INDEX IF NOT EXISTS idx_hold_reader ON HOLD(reader_id, hold_id);
+    """)
+
+def _pass_copy_to_next_hold(cur, book_id, copy_id, today, shelf_days):
+    """
+    Gives a copy that just became free to the first waiting hold of its title
+    (the copy goes on the hold shelf), or makes it available if nobody waits.
+    Runs inside the caller's transaction. Returns (hold_id, reader_id) or None.
+    """
+    cur.execute("SELECT hold_id, reader_id FROM HOLD WHERE book_id = ? AND status = 'waiting' "
+                "ORDER BY hold_id LIMIT 1", (book_id,))
+    hold = cur.fetchone()
+    if hold is None:
+        cur.execute("UPDATE BOOK_COPY SET status = 'available' WHERE copy_id = ?", (copy_id,))
+        return None
+
+    cur.execute("""UPDATE HOLD SET status = 'ready', copy_id = ?, ready_date = ?,
+                                   expires_on = date(?, '+' || ? || ' days')
+                   WHERE hold_id = ?""", (copy_id, today, today, int(shelf_days), hold[0]))
+    cur.execute("UPDATE BOOK_COPY SET status = 'on_hold' WHERE copy_id = ?", (copy_id,))
+    return hold
+
+def db_place_hold(conn, book_id, reader_id, placed_date):
+    """
+    Queues a reader for a title that has no free copy.
+    Returns (hold_id, None) or (None, reason) where reason is 'not_found',
+    'invalid_reader', 'available' (a copy can be borrowed now), 'duplicate'
+    (the reader already holds this title), 'busy' or 'error'.
+    """
+    def work(cur):
+        cur.execute("SELECT available_copies FROM books WHERE book_id = ?", (book_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise TransactionAborted('not_found')
+        if row[0] > 0:
+            raise TransactionAborted('available')
+        cur.execute("SELECT 1 FROM READER WHERE reader_id = ?", (reader_id,))
+        if cur.fetchone() is None:
+            raise TransactionAborted('invalid_reader')
+        cur.execute("INSERT INTO HOLD(book_id, reader_id, placed_date) VALUES (?, ?, ?)",
+                    (book_id, reader_id, placed_date))
+        return cur.lastrowid, None
+
+    try:
+        return run_in_transaction(conn, work)
+    except TransactionAborted as e:
+        return None, e.reason
+    except sqlite3.IntegrityError:
+        # idx_hold_active_reader
+        return None, 'duplicate'
+    except sqlite3.OperationalError as e:
+        if _is_busy_error(e):
+            return None, 'busy'
+        print(f"Error placing hold: {e}")
+        return None, 'error'
+    except Error as e:
+        print(f"Error placing hold: {e}")
+        return None, 'error'
+
+def db_cancel_hold(conn, hold_id, today, shelf_days=3, reader_id=None):
+    """
+    Cancels a waiting or ready hold (only the reader's own if 'reader_id' is given).
+    A copy already on the hold shelf passes to the next reader in line.
+    Returns (True, next_hold) where next_hold is (hold_id, reader_id) or None,
+    or (False, reason) where reason is 'not_found' or 'error'.
+    """
+    def work(cur):
+        cur.execute("""SELECT book_id, status, copy_id FROM HOLD
+                       WHERE hold_id = ? AND status IN ('waiting', 'ready')
+                         AND (? IS NULL OR reader_id = ?)""", (hold_id, reader_id, reader_id))
+        row = cur.fetchone()
+        if row is None:
+            raise TransactionAborted('not_found')
+        book_id, status, copy_id = row
+        cur.execute("UPDATE HOLD SET status = 'cancelled' WHERE hold_id = ?", (hold_id,))
+        next_hold = None
+        if status == 'ready':
+            next_hold = _pass_copy_to_next_hold(cur, book_id, copy_id, today, shelf_days)
+        return book_id, next_hold
+
+    try:
+        book_id, next_hold = run_in_transaction(conn, work)
+        invalidate_book(book_id)
+        return True, next_hold
+    except TransactionAborted as e:
+        return False, e.reason
+    except Error as e:
+        print(f"Error cancelling hold: {e}")
+        return False, 'error'
+
+def db_expire_holds(conn, as_of, shelf_days=3, batch_size=500):
+    """
+    Expires ready holds whose pick-up date has passed; each copy moves on to the
+    next reader in line (or back to the shelf). Works in batches of 'batch_size'
+    holds per transaction. Returns (expired, reassigned) or None on error.
+    """
+    expired = reassigned = 0
+
+    def work(cur):
+        cur.execute("""SELECT hold_id, book_id, copy_id FROM HOLD
+                       WHERE status = 'ready' AND expires_on < ? LIMIT ?""", (as_of, batch_size))
+        rows = cur.fetchall()
+        passed = 0
+        for hold_id, book_id, copy_id in rows:
+            cur.execute("UPDATE HOLD SET status = 'expired' WHERE hold_id = ?", (hold_id,))
+            if _pass_copy_to_next_hold(cur, book_id, copy_id, as_of, shelf_days) is not None:
+                passed += 1
+        return {book_id for _, book_id, _ in rows}, len(rows), passed
+
+    try:
+        while True:
+            book_ids, count, passed = run_in_transaction(conn, work)
+            # After the commit: a reader must not re-cache the rows as they were before it
+            for book_id in book_ids:
+                invalidate_book(book_id)
+            expired += count
+            reassigned += passed
+            if count < batch_size:
+                return expired, reassigned
+    except Error as e:
+        print(f"Error expiring holds: {e}")
+        return None
+
+def _assign_free_copies(cur, book_id, today, shelf_days):
+    """Hands free copies of a title to its waiting holds; returns the (hold_id, reader_id) served"""
+    assigned = []
+    while True:
+        cur.execute("SELECT copy_id FROM BOOK_COPY WHERE book_id = ? AND status = 'available' LIMIT 1",
+                    (book_id,))
+        row = cur.fetchone()
+        if row is None:
+            return assigned
+        hold = _pass_copy_to_next_hold(cur, book_id, row[0], today, shelf_days)
+        if hold is None:
+            return assigned
+        assigned.append(hold)
+
+def db_get_hold_position(conn, hold_id):
+    """1-based queue position of a waiting hold (0 if it is not waiting)"""
+    cur = conn.cursor()
+    cur.execute("""SELECT COUNT(*) FROM HOLD q, HOLD h
+                   WHERE h.hold_id = ? AND h.status = 'waiting'
+                     AND q.book_id = h.book_id AND q.status = 'waiting' AND q.hold_id <= h.hold_id""",
+                (hold_id,))
+    return cur.fetchone()[0]
+
+def db_get_reader_holds(conn, reader_id):
+    """
+    Active holds of a reader: rows (hold_id, book_id, title, status, placed_date,
+    expires_on, position), position being 0 for holds that are ready.
+    """
+    cur = conn.cursor()
+    cur.execute("""SELECT h.hold_id, h.book_id, b.title, h.status, h.placed_date, h.expires_on,
+                          CASE WHEN h.status = 'waiting' THEN
+                              (SELECT COUNT(*) FROM HOLD q WHERE q.book_id = h.book_id
+                                 AND q.status = 'waiting' AND q.hold_id <= h.hold_id)
+                          ELSE 0 END
+                   FROM HOLD h JOIN books b ON b.book_id = h.book_id
+                   WHERE h.reader_id = ? AND h.status IN ('waiting', 'ready')
+                   ORDER BY h.hold_id""", (reader_id,))
+    return cur.fetchall()
+
+# ===============================================
+# ===== OVERDUE & DUE-SOON NOTICES =====
+# ===============================================
+# The notice job (notices.py) walks the open loans due in a date window in
+# (due_date, record_id) order - the key of the partial index idx_borrow_open_due,
+# whose entries end with the rowid - one chunk per transaction. Each chunk joins the
+# reader's contact details and is written to NOTICE_OUTBOX together with the job's
+# cursor in NOTICE_JOB, so an interrupted run resumes where it stopped. The UNIQUE
+# key (record_id, notice_type, due_date) makes reruns insert nothing twice.
+
+NOTICE_TYPES = ('due_soon', 'overdue')
+
+NOTICE_COLUMNS = ("notice_id", "notice_type", "record_id", "reader_id", "book_id", "due_date",
+                  "days", "recipient_name", "email", "phone", "title", "created_on", "status", "sent_at")
+
+def create_notice_tables(conn):
+    """Creates NOTICE_OUTBOX, its indexes and the NOTICE_JOB cursor table"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS NOTICE_OUTBOX (
+        notice_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        notice_type TEXT NOT NULL CHECK(notice_type IN ('due_soon', 'overdue')),
+        record_id INTEGER NOT NULL,
+        reader_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        due_date TEXT NOT NULL,
+        days INTEGER NOT NULL,            -- days overdue, or days left until due_date
+        recipient_name TEXT,
+        email TEXT,
+        phone TEXT,
+        title TEXT,
+        created_on TEXT NOT NULL,         -- date of the run that created the notice
+        status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'sent')),
+        sent_at TEXT,
+        UNIQUE (record_id, notice_type, due_date)
+    );
+    -- Delivery picks up pending notices in order
+    CREATE INDEX IF NOT EXISTS idx_notice_pending ON NOTICE_OUTBOX(notice_id) WHERE status = 'pending';
+
+    -- Where each job's scan has got to on its run date
+    CREATE TABLE IF NOT EXISTS NOTICE_JOB (
+        notice_type TEXT PRIMARY KEY,
+        run_date TEXT NOT NULL,
+        last_due_date TEXT NOT NULL DEFAULT '',
+        last_record_id INTEGER NOT NULL DEFAULT 0,
+        finished INTEGER NOT NULL DEFAULT 0,
+        notices INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+
+def db_get_notice_job(conn, notice_type, run_date):
+    """
+    Cursor of a notice job for 'run_date': (last_due_date, last_record_id, finished, notices).
+    A job last run on another date starts again from the beginning.
+    """
+    cur = conn.cursor()
+    cur.execute("""SELECT last_due_date, last_record_id, finished, notices FROM NOTICE_JOB
+                   WHERE notice_type = ? AND run_date = ?""", (notice_type, run_date))
+    row = cur.fetchone()
+    return row if row is not None else ('', 0, 0, 0)
+
+def db_queue_notices_chunk(conn, notice_type, run_date, due_from, due_before, after, chunk_size=1000):
+    """
+    Queues notices for the next 'chunk_size' open loans with due_from <= due_date < due_before
+    (due_from None = no lower bound) after the cursor 'after' = (due_date, record_id).
+    Loans, reader contacts and book titles are read with one keyset query; the notices
+    (INSERT OR IGNORE, so existing ones are kept) and the job cursor are written in the
+    same transaction. Returns (loans_scanned, notices_queued, next_cursor) where
+    next_cursor is None once the window is exhausted, or None on error.
+    """
+    sql = """SELECT br.record_id, br.reader_id, br.book_id, br.due_date,
+                    CAST(ABS(julianday(?) - julianday(br.due_date)) AS INTEGER),
+                    u.name, u.email, u.phone, b.title
+             FROM BORROWING_RECORD br
+             JOIN READER r ON r.reader_id = br.reader_id
+             JOIN User u ON u.user_id = r.user_id
+             JOIN books b ON b.book_id = br.book_id
+             WHERE br.return_date IS NULL AND br.due_date >= ? AND br.due_date < ?
+               AND (br.due_date, br.record_id) > (?, ?)
+             ORDER BY br.due_date, br.record_id
+             LIMIT ?"""
+
+    def work(cur):
+        # One lower bound: given two, the planner may seek the index by the window's
+        # start instead of the cursor and rescan every earlier chunk
+        cur.execute(sql, (run_date, max(due_from or '', after[0]), due_before, after[0], after[1], chunk_size))
+        rows = cur.fetchall()
+        before = conn.total_changes
+        cur.executemany("""INSERT OR IGNORE INTO NOTICE_OUTBOX(notice_type, record_id, reader_id, book_id,
+                                  due_date, days, recipient_name, email, phone, title, created_on)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        [(notice_type,) + row + (run_date,) for row in rows])
+        queued = conn.total_changes - before
+        next_cursor = (rows[-1][3], rows[-1][0]) if len(rows) == chunk_size else None
+        last_due_date, last_record_id = next_cursor or after
+        cur.execute("""INSERT INTO NOTICE_JOB(notice_type, run_date, last_due_date, last_record_id,
+                                              finished, notices)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(notice_type) DO UPDATE SET
+                           notices = CASE WHEN run_date = excluded.run_date
+                                          THEN notices + excluded.notices ELSE excluded.notices END,
+                           run_date = excluded.run_date, last_due_date = excluded.last_due_date,
+                           last_record_id = excluded.last_record_id, finished = excluded.finished""",
+                    (notice_type, run_date, last_due_date, last_record_id, int(next_cursor is None), queued))
+        return len(rows), queued, next_cursor
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error queueing {notice_type} notices: {e}")
+        return None
+
+def db_get_pending_notices(conn, after_notice_id=0, limit=1000):
+    """Up to 'limit' pending notices after 'after_notice_id', oldest first (rows follow NOTICE_COLUMNS)"""
+    cur = conn.cursor()
+    cur.execute(f"""SELECT {", ".join(NOTICE_COLUMNS)} FROM NOTICE_OUTBOX
+                    WHERE status = 'pending' AND notice_id > ? ORDER BY notice_id LIMIT ?""",
+                (after_notice_id, limit))
+    return cur.fetchall()
+
+def db_mark_notices_sent(conn, notice_ids, sent_at):
+    """Marks notices as sent in one transaction. Returns the number marked, or None on error."""
+    def work(cur):
+        cur.executemany("UPDATE NOTICE_OUTBOX SET status = 'sent', sent_at = ? WHERE notice_id = ? "
+                        "AND status = 'pending'", [(sent_at, notice_id) for notice_id in notice_ids])
+        return cur.rowcount
+
+    try:
+        return run_in_transaction(conn, work)
+    except Error as e:
+        print(f"Error marking notices as sent: {e}")
+        return None
 
 # --- NAME ERROR FIX ---
 # Moved this block to the END of the file
@@ -255,29 +2956,61 @@ if __name__ == '__main__':
     
     if db_conn is not None:
         create_tables(db_conn)
-        
-        # --- ADD 1 ADMIN/LIBRARIAN FOR TESTING ---
-        try:
-            print("Attempting to add test users 'admin' and 'lib'...")
-            # 1. Create User "lib"
-            user_lib_id = db_add_user(db_conn, "lib", "123", "Librarian User", "lib@test.com", "0123", "librarian")
-            if user_lib_id:
-                # 2. Create linked Librarian
-                db_conn.execute("INSERT INTO LIBRARIAN(user_id, staff_id, role) VALUES (?, ?, ?)", (user_lib_id, "S001", "Librarian"))
-                print("Created user 'lib' (pass: 123) successfully.")
-
-            # 1. Create User "admin"
-            user_admin_id = db_add_user(db_conn, "admin", "123", "Power Admin", "admin@test.com", "999", "admin")
-            if user_admin_id:
-                # 2. Admin must also have a Librarian record (due to inheritance)
-                db_conn.execute("INSERT INTO LIBRARIAN(user_id, staff_id, role) VALUES (?, ?, ?)", (user_admin_id, "A001", "Admin"))
-                # 3. And an Admin record
-                db_conn.execute("INSERT INTO ADMIN(user_id, privileged_level) VALUES (?, ?)", (user_admin_id, "Full"))
-                print("Created user 'admin' (pass: 123) successfully.")
+
+        if "--check-plans" in sys.argv:
+            # --- python database.py --check-plans: check the hot queries use their indexes ---
+            for query_name, uses_index, plan_text in db_check_query_plans(db_conn):
+                label = "OK" if uses_index else "NOT USING INDEX"
+                print(f"[{label}] {query_name}: {plan_text}")
+        elif "--reconcile-readers" in sys.argv:
+            # --- python database.py --reconcile-readers: fix drifted reader loan counters ---
+            drifted = db_reconcile_reader_counters(db_conn)
+            if drifted is not None:
+                for reader_id, old_total, old_current, new_total, new_current in drifted:
+                    print(f"Reader {reader_id}: total {old_total} -> {new_total}, "
+                          f"current {old_current} -> {new_current}")
+                print(f"{len(drifted)} reader(s) corrected.")
+        elif "--merge-duplicate-titles" in sys.argv:
+            # --- python database.py --merge-duplicate-titles: one title row per book, copies underneath ---
+            merged_rows = db_merge_duplicate_titles(db_conn)
+            if merged_rows is not None:
+                print(f"{merged_rows} duplicate book row(s) merged into their title.")
+        elif "--rebuild-copies" in sys.argv:
+            # --- python database.py --rebuild-copies: recompute the copy counters of every title ---
+            if db_rebuild_copy_counters(db_conn):
+                print("Copy counters rebuilt.")
+        elif "--rebuild-trigrams" in sys.argv:
+            # --- python database.py --rebuild-trigrams: rebuild the fuzzy search index ---
+            indexed_books = db_rebuild_trigram_index(db_conn)
+            if indexed_books is not None:
+                print(f"Fuzzy search index rebuilt ({indexed_books} book(s)).")
+        elif "--rebuild-stats" in sys.argv:
+            # --- python database.py --rebuild-stats: recompute the statistics summary tables ---
+            if db_rebuild_statistics(db_conn) and db_rebuild_facet_counts(db_conn):
+                print("Statistics rebuilt.")
+        else:
+            # --- ADD 1 ADMIN/LIBRARIAN FOR TESTING ---
+            try:
+                print("Attempting to add test users 'admin' and 'lib'...")
+                # 1. Create User "lib"
+                user_lib_id = db_add_user(db_conn, "lib", security.hash_password("123"), "Librarian User", "lib@test.com", "0123", "librarian")
+                if user_lib_id:
+                    # 2. Create linked Librarian
+                    db_conn.execute("INSERT INTO LIBRARIAN(user_id, staff_id, role) VALUES (?, ?, ?)", (user_lib_id, "S001", "Librarian"))
+                    print("Created user 'lib' (pass: 123) successfully.")
+
+                # 1. Create User "admin"
+                user_admin_id = db_add_user(db_conn, "admin", security.hash_password("123"), "Power Admin", "admin@test.com", "999", "admin")
+                if user_admin_id:
+                    # 2. Admin must also have a Librarian record (due to inheritance)
+                    db_conn.execute("INSERT INTO LIBRARIAN(user_id, staff_id, role) VALUES (?, ?, ?)", (user_admin_id, "A001", "Admin"))
+                    # 3. And an Admin record
+                    db_conn.execute("INSERT INTO ADMIN(user_id, privileged_level) VALUES (?, ?)", (user_admin_id, "Full"))
+                    print("Created user 'admin' (pass: 123) successfully.")
             
-            db_conn.commit()
-        except Exception as e:
-            print(f"Could not add test users (may already exist): {e}")
+                db_conn.commit()
+            except Exception as e:
+                print(f"Could not add test users (may already exist): {e}")
         
         db_conn.close()
         print("Database connection closed.")
\ No newline at end of file
@@ -1,7 +1,36 @@
 import controller as controller
+import audit as audit
 import database as database
 import models as models 
 
+def page_through(fetch_page, describe, empty_message="Nothing to show."):
+    """
+    Prints a listing one page at a time.
+    fetch_page(cursor) returns a models.Page, or None if the page could not be read
+    (paging stops there); describe(item) returns one line of text.
+    """
+    cursor = None
+    shown = 0
+    while True:
+        page = fetch_page(cursor)
+        if page is None:
+            return shown
+        if shown == 0 and len(page) == 0:
+            print(empty_message)
+            return 0
+
+        for item in page:
+            print(f"  - {describe(item)}")
+        shown += len(page)
+
+        if not page.has_next():
+            print(f"--- End of list ({shown} shown) ---")
+            return shown
+        answer = input("Press Enter for the next page, or 'q' to stop: ")
+        if answer.strip().lower() == 'q':
+            return shown
+        cursor = page.next_cursor
+
 def book_management_menu():
     """Book Management submenu"""
     while True:
@@ -10,7 +39,9 @@ def book_management_menu():
         print("2. Update book information")
         print("3. Delete book")
         print("4. View list of all books")
-        print("5. Back to Librarian Menu")
+        print("5. Import books from file (CSV/JSONL)")
+        print("6. Manage copies of a book")
+        print("7. Back to Librarian Menu")
         choice = input("Enter your choice: ")
 
         if choice == '1':
@@ -29,9 +60,38 @@ def book_management_menu():
             print("--- Delete Book (Not implemented) ---")
         
         elif choice == '4': 
-            print("--- View All Books (Not implemented) ---")
-            
+            print("--- View All Books ---")
+            page_through(lambda cursor: controller.controller_list_books(cursor or 0),
+                         lambda book: book.get_details(),
+                         "The catalog is empty.")
+            print("Press Enter to continue...")
+            input()
+
         elif choice == '5':
+            print("--- Import Books ---")
+            file_path = input("Enter path of the CSV/JSONL file: ").strip()
+            controller.controller_import_books(file_path)
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '6':
+            print("--- Copies of a Book ---")
+            try:
+                book_id = int(input("Enter Book ID: "))
+                barcodes = input("Barcodes of new copies (comma-separated), "
+                                 "a number of copies, or Enter to only list: ").strip()
+                if barcodes.isdigit():
+                    controller.controller_add_copies(book_id, count=int(barcodes))
+                elif barcodes:
+                    controller.controller_add_copies(book_id, barcodes=[b.strip() for b in barcodes.split(',') if b.strip()])
+                for copy_id, barcode, status, added_date in controller.controller_get_copies(book_id):
+                    print(f"  - Copy {copy_id}, Barcode: {barcode}, Status: {status}, Added: {added_date}")
+            except ValueError:
+                print("Error: ID must be a number.")
+            print("Press Enter to continue...")
+            input()
+            
+        elif choice == '7':
             break
         else:
             print("Invalid choice. Please try again.")
@@ -58,6 +118,14 @@ def reader_management_menu():
             print("Press Enter to continue...")
             input()
 
+        elif choice == '4':
+            print("--- View All Readers ---")
+            page_through(lambda cursor: controller.controller_list_readers(cursor or 0),
+                         lambda reader: f"Reader ID: {reader.reader_id}, Username: {reader.username}, "
+                                        f"Name: {reader.name}, Email: {reader.contact_info}",
+                         "No readers registered yet.")
+            print("Press Enter to continue...")
+            input()
         
         elif choice == '5':
             break
@@ -70,22 +138,92 @@ def borrow_return_menu():
         print("\n--- 3. Borrow/Return Management ---")
         print("1. Record new borrow transaction")
         print("2. Process book return")
-        print("3. Back to Librarian Menu")
+        print("3. Run end-of-day fine assessment, hold expiry and notices")
+        print("4. Place a hold")
+        print("5. Cancel a hold")
+        print("6. View holds of a reader")
+        print("7. Back to Librarian Menu")
         choice = input("Enter yourM choice: ")
 
         if choice == '1':
             print("--- Borrow Book ---")
             try:
                 reader_id = int(input("Enter Reader ID: "))
-                book_id = int(input("Enter Book ID: "))
-                controller.controller_borrow_book(reader_id, book_id)
+                book_ids = [int(b) for b in input("Enter Book ID(s), comma-separated: ").split(',') if b.strip()]
+                if len(book_ids) == 1:
+                    controller.controller_borrow_book(reader_id, book_ids[0])
+                else:
+                    for book_id, borrowed, message in controller.controller_checkout_batch(reader_id, book_ids):
+                        print(f"  - Book {book_id}: {message}")
             except ValueError:
                 print("Error: ID must be a number.")
             print("Press Enter to continue...")
             input()
             
-        
+        elif choice == '2':
+            print("--- Return Book ---")
+            # Barcodes may be numeric too, so ask which one is being entered
+            by = input("Return by (1) Book ID or (2) copy barcode? ").strip()
+            if by == '1':
+                try:
+                    controller.controller_process_return(int(input("Enter Book ID: ")))
+                except ValueError:
+                    print("Error: ID must be a number.")
+            elif by == '2':
+                barcode = input("Enter copy barcode: ").strip()
+                if barcode:
+                    controller.controller_process_return(None, barcode=barcode)
+            else:
+                print("Invalid choice. Please try again.")
+            print("Press Enter to continue...")
+            input()
+
         elif choice == '3':
+            print("--- End-of-day Fine Assessment ---")
+            controller.controller_assess_fines()
+            controller.controller_expire_holds()
+            controller.controller_refresh_fuzzy_index()
+            controller.controller_queue_notices()
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '4':
+            print("--- Place Hold ---")
+            try:
+                reader_id = int(input("Enter Reader ID: "))
+                book_id = int(input("Enter Book ID: "))
+                controller.controller_place_hold(reader_id, book_id)
+            except ValueError:
+                print("Error: ID must be a number.")
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '5':
+            print("--- Cancel Hold ---")
+            try:
+                hold_id = int(input("Enter Hold ID: "))
+                controller.controller_cancel_hold(hold_id)
+            except ValueError:
+                print("Error: ID must be a number.")
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '6':
+            print("--- Holds of a Reader ---")
+            try:
+                reader_id = int(input("Enter Reader ID: "))
+                holds = controller.controller_get_reader_holds(reader_id)
+                if not holds:
+                    print("No active holds.")
+                for hold_id, book_id, title, status, placed_date, expires_on, position in holds:
+                    where = f"ready, pick up by {expires_on}" if status == 'ready' else f"position {position}"
+                    print(f"  - Hold {hold_id}: '{title}' (Book ID: {book_id}), placed {placed_date}, {where}")
+            except ValueError:
+                print("Error: ID must be a number.")
+            print("Press Enter to continue...")
+            input()
+        
+        elif choice == '7':
             break
         else:
             print("Invalid choice. Please try again.")
@@ -95,25 +233,103 @@ def search_statistics_menu():
     while True:
         print("\n--- 4. Search & Statistics ---")
         print("1. Search for books (by keyword)")
-        print("2. View statistics")
-        print("3. Back to Librarian Menu")
+        print("2. Search with filters (genre, status, author)")
+        print("3. View statistics")
+        print("4. View performance statistics")
+        print("5. Back to Librarian Menu")
         choice = input("Enter your choice: ")
 
         if choice == '1':
             print("--- Search Books ---")
             keyword = input("Enter title or author keyword: ")
-            results = controller.controller_search_book(keyword)
-            
-            if not results:
-                print(f"No books found matching '{keyword}'.")
-            else:
-                print(f"Found {len(results)} book(s):")
-                for book in results:
-                    print(f"  - {book.get_details()}")
+            shown = page_through(lambda cursor: controller.controller_search_book_page(keyword, cursor),
+                                 lambda book: book.get_details(),
+                                 f"No books found matching '{keyword}'.")
+            if shown == 0:
+                # Nothing matched exactly: maybe a typo, so offer the closest titles
+                close_matches = controller.controller_search_book(keyword, fuzzy=True)
+                if len(close_matches) > 0:
+                    print("Did you mean:")
+                    for book in close_matches:
+                        print(f"  - {book.get_details()}")
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '2':
+            print("--- Search with Filters (leave blank for any) ---")
+            keyword = input("Keyword: ").strip()
+            genre = input("Genre: ").strip() or None
+            status = input("Status (available/borrowed): ").strip() or None
+            author = input("Author (exact name): ").strip() or None
+            sort = input("Sort by (relevance/title/author/newest): ").strip() or None
+            search = lambda cursor: controller.controller_search_books_faceted(
+                keyword, genre, status, author, sort, cursor)
+            result = search(None)
+            if result:
+                first_page, facets = result
+                print(f"{facets['total']} book(s) found.")
+                print("By genre: " + ", ".join(f"{g or '(none)'} ({n})" for g, n in facets['genre']))
+                print("By status: " + ", ".join(f"{s} ({n})" for s, n in facets['status']))
+
+                def fetch_page(cursor):
+                    if cursor is None:
+                        return first_page
+                    # None when a later page fails: page_through stops there
+                    next_result = search(cursor)
+                    return next_result[0] if next_result else None
+
+                page_through(fetch_page, lambda book: book.get_details(), "No books match these filters.")
             print("Press Enter to continue...")
             input()
 
         elif choice == '3':
+            print("--- Library Statistics (last 30 days) ---")
+            report = controller.controller_get_statistics(days=30)
+            if report:
+                print(f"Period: {report['since']} to {report['until']}")
+                print(f"Loans: {report['total_loans']}, Returns: {report['total_returns']}, "
+                      f"Fines collected: {report['fines_collected']:,.0f} VND")
+                print(f"Active readers: {report['active_readers']}, "
+                      f"Overdue loans today: {report['overdue_loans']}")
+                print("Loans per day:")
+                for day, loans, returns, fines in report['daily']:
+                    print(f"  {day}: {loans} loan(s), {returns} return(s)")
+                print("Top borrowed books:")
+                for book_id, title, loan_count in report['top_books']:
+                    print(f"  - [{book_id}] {title}: {loan_count} loan(s)")
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '4':
+            print("--- Performance Statistics ---")
+            stats = controller.controller_get_performance_stats()
+            print("Caches:")
+            for cache_name, cache in stats['caches'].items():
+                print(f"  {cache_name}: {cache['size']}/{cache['maxsize']} entries, "
+                      f"{cache['hits']} hit(s), {cache['misses']} miss(es) "
+                      f"({cache['hit_rate']:.0%} hit rate), {cache['evictions']} eviction(s), "
+                      f"{cache['invalidations']} invalidation(s)")
+            queries = stats['queries']
+            print(f"SQL: {queries['calls']} call(s) of {queries['statements']} statement(s), "
+                  f"{queries['errors']} error(s), {queries['slow_queries']} slow quer(ies), "
+                  f"{queries['lock_waits']} transaction(s) waited {queries['lock_wait_ms']:.1f} ms for the write lock")
+            events = stats['audit']
+            print(f"Audit log: {events['written']} event(s) written, {events['queued']} queued, "
+                  f"{events['dropped']} dropped, {events['failed']} sent to the fallback file")
+            print("Most expensive statements (by total time):")
+            for query in queries['top']:
+                print(f"  {query['total_ms']:9.1f} ms total, {query['calls']} call(s), "
+                      f"avg {query['avg_ms']:.3f} ms, max {query['max_ms']:.1f} ms, {query['rows']} row(s): "
+                      f"{query['sql'][:80]}")
+            file_path = input("File name to dump all query statistics to (JSON, leave empty to skip): ").strip()
+            if file_path:
+                controller.controller_dump_query_stats(file_path)
+            if input("Reset query statistics? (y/N): ").strip().lower() == 'y':
+                controller.controller_reset_query_stats()
+            print("Press Enter to continue...")
+            input()
+
+        elif choice == '5':
             break
         else:
             print("Invalid choice. Please try again.")
@@ -144,6 +360,7 @@ def librarian_menu(librarian_user):
             search_statistics_menu()
         elif choice == '5':
             print(f"Logging out user {librarian_user.username}...")
+            controller.controller_logout(librarian_user)
             break
         else:
             print("Invalid choice. Please try again.")
@@ -217,6 +434,8 @@ def initialize_database():
     if conn:
         database.create_tables(conn)
         conn.close()
+        database.start_checkpointer()
+        audit.start_writer()
         print("Database is ready.")
               
     else:
@@ -227,3 +446,6 @@ def initialize_database():
 if __name__ == "__main__":
     initialize_database()
     main_menu()
+    audit.stop_writer()
+    database.stop_checkpointer()
+    database.close_pool()
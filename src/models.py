@@ -1,18 +1,37 @@
 from datetime import date
 from typing import List
 
+# Fine for each day a book is returned late (VND)
+FINE_PER_DAY = 1000
+
 # --- Important Note ---
 # The models.py file defines what the "data" looks like.
+# Models use __slots__: no per-object __dict__, so large result sets take much less memory.
 class Book:
     """
-    Represents a book in the library.
+    Represents a book (a title) in the library.
+    Physical copies are counted in total_copies / available_copies.
     """
-    def __init__(self, book_id: int, title: str, author: str, genre: str, status: str = 'available'):
+    __slots__ = ('book_id', 'title', 'author', 'genre', 'status', 'total_copies', 'available_copies')
+
+    def __init__(self, book_id: int, title: str, author: str, genre: str, status: str = 'available',
+                 total_copies: int = 1, available_copies: int = None):
         self.book_id = book_id
         self.title = title
         self.author = author
         self.genre = genre
-        self.status = status  # 'available' or 'borrowed'
+        self.status = status  # 'available' (at least one copy is) or 'borrowed'
+        self.total_copies = total_copies
+        if available_copies is None:
+            available_copies = total_copies if status == 'available' else 0
+        self.available_copies = available_copies
+
+    @classmethod
+    def from_row(cls, row) -> 'Book':
+        """Builds a Book from a 'books' table row (book_id, title, author, genre, status, total_copies, available_copies)"""
+        if len(row) >= 7:
+            return cls(row[0], row[1], row[2], row[3], row[4], row[5], row[6])
+        return cls(row[0], row[1], row[2], row[3], row[4])
 
     def update_status(self, new_status: str):
         """Updates the book's status (available/borrowed)"""
@@ -22,7 +41,8 @@ class Book:
 
     def get_details(self) -> str:
         """Returns a detailed info string for the book"""
-        return f"ID: {self.book_id}, Title: {self.title}, Author: {self.author}, Status: {self.status}"
+        return (f"ID: {self.book_id}, Title: {self.title}, Author: {self.author}, "
+                f"Status: {self.status} ({self.available_copies} of {self.total_copies} available)")
 
     def get_status(self) -> str:
         """Returns the current status of the book"""
@@ -35,10 +55,62 @@ class Book:
         """Checks if the book is available for borrowing"""
         return self.status == 'available'
 
+class ResultView:
+    """
+    Read-only sequence over raw database rows.
+    Rows stay as plain tuples; a model object is only built when an item is accessed,
+    e.g. ResultView(rows, Book.from_row).
+    """
+    __slots__ = ('_rows', '_factory')
+
+    def __init__(self, rows, factory):
+        self._rows = rows
+        self._factory = factory
+
+    @property
+    def rows(self):
+        """The underlying rows (no conversion)"""
+        return self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ResultView(self._rows[index], self._factory)
+        return self._factory(self._rows[index])
+
+    def __iter__(self):
+        factory = self._factory
+        for row in self._rows:
+            yield factory(row)
+
+class Page:
+    """
+    One page of a listing or search.
+    'next_cursor' is passed back to fetch the following page (None on the last page).
+    """
+    __slots__ = ('items', 'next_cursor')
+
+    def __init__(self, items: list, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
 class User:
     """
     Base class for all system users.
     """
+    __slots__ = ('user_id', 'username', 'name', 'contact_info', 'password')
+
     def __init__(self, user_id: int, username: str, name: str, contact_info: str, password: str):
         self.user_id = user_id
         self.username = username
@@ -60,6 +132,8 @@ class BorrowingRecord:
     """
     Represents a book borrowing/returning record.
     """
+    __slots__ = ('record_id', 'book_id', 'reader_id', 'borrow_date', 'due_date', 'return_date', 'fine_amount')
+
     def __init__(self, record_id: int, book_id: int, reader_id: int, borrow_date: date, due_date: date):
         self.record_id = record_id
         self.book_id = book_id
@@ -73,8 +147,7 @@ class BorrowingRecord:
         """Calculates the fine if the book is returned late (Logic will be in the controller)"""
         if self.return_date and self.return_date > self.due_date:
             days_overdue = (self.return_date - self.due_date).days
-            # Assuming the fine is 1000 VND/day
-            self.fine_amount = days_overdue * 1000
+            self.fine_amount = days_overdue * FINE_PER_DAY
         
         return self.fine_amount
 
@@ -82,6 +155,8 @@ class Reader(User):
     """
     Class representing a Reader, inherits from User.
     """
+    __slots__ = ('reader_id', 'borrowing_history')
+
     def __init__(self, user_id: int, username: str, name: str, contact_info: str, password: str, reader_id: int):
         # Call the constructor of the parent class (User)
         super().__init__(user_id, username, name, contact_info, password)
@@ -102,6 +177,8 @@ class Librarian(User):
     """
     Class representing a Librarian, inherits from User.
     """
+    __slots__ = ('staff_id', 'role')
+
     def __init__(self, user_id: int, username: str, name: str, contact_info: str, password: str, staff_id: str, role: str):
         super().__init__(user_id, username, name, contact_info, password)
         self.staff_id = staff_id
@@ -146,6 +223,8 @@ class Admin(Librarian):
     """
     Class representing an Admin, inherits from Librarian.
     """
+    __slots__ = ('admin_id', 'privilege_level')
+
     def __init__(self, user_id: int, username: str, name: str, contact_info: str, password: str, 
                  staff_id: str, role: str, admin_id: int, privilege_level: str):
         super().__init__(user_id, username, name, contact_info, password, staff_id, role)
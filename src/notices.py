@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import database as db
+
+# --- NOTICE SETTINGS ---
+# A "due soon" notice goes out this many days before the due date (0 turns them off)
+DUE_SOON_DAYS = int(os.environ.get("LIBRARY_NOTICE_DUE_SOON_DAYS", "2"))
+# Open loans read (and notices written) per transaction
+CHUNK_SIZE = int(os.environ.get("LIBRARY_NOTICE_CHUNK", "1000"))
+# ---------------------
+
+# ===============================================
+# ===== NOTICE JOB =====
+# ===============================================
+# Meant to run once a day from cron / Task Scheduler (python notices.py run).
+# Only one chunk of loans is in memory at a time, however many loans are open.
+
+def _window(notice_type, as_of, due_soon_days):
+    """(due_from, due_before) of the loans a job looks at on 'as_of'"""
+    if notice_type == 'overdue':
+        return None, as_of.isoformat()
+    return as_of.isoformat(), (as_of + timedelta(days=due_soon_days + 1)).isoformat()
+
+def run_notice_job(notice_type, as_of=None, due_soon_days=DUE_SOON_DAYS, chunk_size=CHUNK_SIZE,
+                   restart=False):
+    """
+    Queues the notices of one job ('overdue' or 'due_soon') for 'as_of' (default today),
+    continuing from where an interrupted run of the same day stopped.
+    A job that already finished today is skipped unless restart=True
+    (rerunning never queues a notice twice).
+    Returns (loans_scanned, notices_queued), or None on error.
+    """
+    as_of = as_of or date.today()
+    run_date = as_of.isoformat()
+    due_from, due_before = _window(notice_type, as_of, due_soon_days)
+
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return None
+
+        last_due_date, last_record_id, finished, _ = db.db_get_notice_job(conn, notice_type, run_date)
+        if finished and not restart:
+            return 0, 0
+        cursor = ('', 0) if restart else (last_due_date, last_record_id)
+
+        scanned = queued = 0
+        while cursor is not None:
+            chunk = db.db_queue_notices_chunk(conn, notice_type, run_date, due_from, due_before,
+                                              cursor, chunk_size)
+            if chunk is None:
+                return None
+            loans, added, cursor = chunk
+            scanned += loans
+            queued += added
+        return scanned, queued
+
+def run_all(as_of=None, due_soon_days=DUE_SOON_DAYS, chunk_size=CHUNK_SIZE, restart=False):
+    """
+    Scheduler entry point: runs the overdue job, then the due-soon job.
+    Returns {notice_type: (loans_scanned, notices_queued)}, or None if a job failed.
+    """
+    summary = {}
+    for notice_type in db.NOTICE_TYPES:
+        if notice_type == 'due_soon' and due_soon_days <= 0:
+            continue
+        result = run_notice_job(notice_type, as_of, due_soon_days, chunk_size, restart)
+        if result is None:
+            return None
+        summary[notice_type] = result
+    return summary
+
+# ===============================================
+# ===== OUTBOX DELIVERY =====
+# ===============================================
+
+def iter_pending_notices(batch_size=CHUNK_SIZE):
+    """Generator over pending notices (dicts), oldest first, one keyset page at a time"""
+    after = 0
+    with db.pooled_connection() as conn:
+        if conn is None:
+            return
+        while True:
+            rows = db.db_get_pending_notices(conn, after, batch_size)
+            for row in rows:
+                yield dict(zip(db.NOTICE_COLUMNS, row))
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+def deliver_pending(send, batch_size=CHUNK_SIZE):
+    """
+    Passes every pending notice to send(notice) and marks a batch as sent once all of
+    its notices were handed over (send raising an exception stops the delivery; the
+    rest of that batch stays pending). Returns the number of notices marked as sent.
+    """
+    delivered = 0
+    batch = []
+
+    def mark(ids):
+        with db.pooled_connection() as conn:
+            if conn is None:
+                return 0
+            return db.db_mark_notices_sent(conn, ids, datetime.now().isoformat(timespec="seconds")) or 0
+
+    try:
+        for notice in iter_pending_notices(batch_size):
+            send(notice)
+            batch.append(notice['notice_id'])
+            if len(batch) >= batch_size:
+                delivered += mark(batch)
+                batch = []
+    finally:
+        if batch:
+            delivered += mark(batch)
+    return delivered
+
+def export_pending(file_path, batch_size=CHUNK_SIZE):
+    """
+    Appends every pending notice to a JSONL file (one notice per line) for the mail/SMS
+    gateway and marks them as sent. Returns the number of notices exported.
+    """
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_path, "a", encoding="utf-8") as f:
+        def write(notice):
+            f.write(json.dumps(notice, ensure_ascii=False) + "\n")
+        return deliver_pending(write, batch_size)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Overdue and due-soon notices.")
+    parser.add_argument("--db", help="database file (default: library.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="queue today's overdue and due-soon notices in the outbox")
+    p.add_argument("--date", help="run as of this ISO date (default: today)")
+    p.add_argument("--due-soon-days", type=int, default=DUE_SOON_DAYS)
+    p.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="loans per transaction")
+    p.add_argument("--restart", action="store_true", help="scan again even if today's run finished")
+
+    p = commands.add_parser("export", help="append pending notices to a JSONL file and mark them sent")
+    p.add_argument("file")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure_pool(args.db)
+    ok = True
+    if args.command == "run":
+        as_of = date.fromisoformat(args.date) if args.date else None
+        started = time.perf_counter()
+        summary = run_all(as_of, args.due_soon_days, args.chunk, args.restart)
+        ok = summary is not None
+        if ok:
+            for notice_type, (scanned, queued) in summary.items():
+                print(f"{notice_type}: {scanned} loan(s) scanned, {queued} new notice(s) queued")
+            print(f"Done in {time.perf_counter() - started:.1f} s.")
+    elif args.command == "export":
+        exported = export_pending(args.file)
+        print(f"{exported} notice(s) written to '{args.file}'.")
+    db.close_pool()
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
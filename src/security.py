@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# --- PASSWORD HASHING SETTINGS ---
+# scrypt cost parameters: N (CPU/memory cost, power of 2), r (block size), p (parallelism).
+# Raising them makes each login slower for attackers and for us; stored hashes made
+# with older values are upgraded automatically on the next successful login.
+SCRYPT_N = int(os.environ.get("LIBRARY_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("LIBRARY_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("LIBRARY_SCRYPT_P", "1"))
+SALT_BYTES = 16
+KEY_BYTES = 32
+HASH_PREFIX = "scrypt"
+# ---------------------
+
+# --- LOGIN RATE LIMIT ---
+# Token bucket per username and per client IP: LOGIN_BURST attempts at once,
+# then one more every 1 / LOGIN_REFILL_PER_SECOND seconds.
+LOGIN_BURST = int(os.environ.get("LIBRARY_LOGIN_BURST", "5"))
+LOGIN_REFILL_PER_SECOND = float(os.environ.get("LIBRARY_LOGIN_REFILL_PER_SECOND", "0.2"))
+# ---------------------
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover the 128 * n * r * p bytes scrypt needs
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+def hash_password(password, n=None, r=None, p=None):
+    """
+    Returns a salted scrypt hash: 'scrypt$N$r$p$<salt>$<hash>' (salt and hash in base64).
+    """
+    n = n or SCRYPT_N
+    r = r or SCRYPT_R
+    p = p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return f"{HASH_PREFIX}${n}${r}${p}${_b64(salt)}${_b64(key)}"
+
+def is_hashed(stored):
+    """False for legacy accounts whose password is still stored in plain text"""
+    return isinstance(stored, str) and stored.startswith(HASH_PREFIX + "$")
+
+def verify_password(password, stored):
+    """Checks a password against a stored hash (or a legacy plain-text password)"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), str(stored).encode("utf-8"))
+    try:
+        _, n, r, p, salt, key = stored.split("$")
+        expected = base64.b64decode(key)
+        actual = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(actual, expected)
+
+def needs_rehash(stored):
+    """True if the stored value is plain text or was hashed with other cost parameters"""
+    if not is_hashed(stored):
+        return True
+    try:
+        _, n, r, p, _, _ = stored.split("$")
+        return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    except ValueError:
+        return True
+
+# Verified when the username does not exist, so unknown and known usernames take
+# the same time to reject
+_DUMMY_HASH = None
+
+def burn_verification_time(password):
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = hash_password("not-a-real-password")
+    verify_password(password, _DUMMY_HASH)
+
+# ===============================================
+# ===== LOGIN RATE LIMITING =====
+# ===============================================
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets, one per key (e.g. 'user:alice', 'ip:10.0.0.5').
+    Each attempt takes one token; tokens refill at a fixed rate up to 'capacity'.
+    At most 'max_keys' buckets are kept: the least recently used one is dropped
+    when a new key arrives, so every call stays O(1) even under a flood of
+    distinct usernames.
+    """
+    def __init__(self, capacity=LOGIN_BURST, refill_per_second=LOGIN_REFILL_PER_SECOND, max_keys=100000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last_update), least recently used first
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Takes one token for 'key'; returns False if the bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                # The oldest bucket has had the longest time to refill
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+login_limiter = TokenBucketLimiter()
+
+def allow_login_attempt(username, client_ip=None):
+    """Rate-limits login attempts per username and per client IP"""
+    allowed = login_limiter.allow(f"user:{username}")
+    if client_ip is not None:
+        allowed = login_limiter.allow(f"ip:{client_ip}") and allowed
+    return allowed
+
+# ===============================================
+# ===== BENCHMARK =====
+# ===============================================
+
+def benchmark_hashing(n=None, r=None, p=None, rounds=5):
+    """Returns the average time in milliseconds to verify one password"""
+    stored = hash_password("benchmark-password", n, r, p)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        verify_password("benchmark-password", stored)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+if __name__ == '__main__':
+    # python security.py [budget_ms]: per-login hashing cost for several N values
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    print(f"Per-login latency budget: {budget_ms:.0f} ms (r={SCRYPT_R}, p={SCRYPT_P})")
+    for exponent in range(12, 18):
+        cost = 2 ** exponent
+        elapsed = benchmark_hashing(n=cost)
+        marker = " <- current" if cost == SCRYPT_N else ""
+        verdict = "OK" if elapsed <= budget_ms else "over budget"
+        print(f"  N=2^{exponent:<2} {elapsed:8.1f} ms  {verdict}{marker}")
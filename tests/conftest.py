@@ -0,0 +1,43 @@
+import os
+import sys
+
+# Cheap password hashes, no audit writer thread and no slow query log while testing
+os.environ.setdefault("LIBRARY_SCRYPT_N", "16")
+os.environ.setdefault("LIBRARY_AUDIT", "0")
+os.environ.setdefault("LIBRARY_DB_SLOW_QUERY_LOG", "")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pytest
+
+import controller
+import database as db
+import security
+
+
+@pytest.fixture(autouse=True)
+def _fresh_process_state():
+    """Caches and the login limiter are module globals: start every test without them"""
+    security.login_limiter = security.TokenBucketLimiter()
+    yield
+    db.close_pool()
+    db.clear_caches()
+    controller._identity_cache.clear()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh library database; the pool points at it"""
+    path = str(tmp_path / "library.db")
+    conn = db.connect_db(path)
+    db.create_tables(conn)
+    conn.close()
+    db.configure_pool(path)
+    yield path
+
+
+@pytest.fixture
+def conn(db_path):
+    """A pooled connection to the test database"""
+    with db.pooled_connection() as connection:
+        yield connection
@@ -0,0 +1,185 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+import pytest
+
+import api_server
+import controller
+import database as db
+import security
+
+
+def _request(method, path, body=None, token=None, query=None):
+    headers = {'authorization': f"Bearer {token}"} if token else {}
+    raw = json.dumps(body).encode() if body is not None else b''
+    return api_server.Request(method, path, query or {}, headers, raw, '127.0.0.1')
+
+
+def _login(api, username, password="pw"):
+    status, payload = api.login(_request('POST', '/api/login', {'username': username, 'password': password}))
+    assert status == HTTPStatus.OK
+    return payload['token']
+
+
+def _error(call, *args):
+    with pytest.raises(api_server.ApiError) as error:
+        call(*args)
+    return error.value.status
+
+
+@pytest.fixture
+def api(db_path):
+    return api_server.LibraryApi(api_server.SessionStore())
+
+
+@pytest.fixture
+def loan(api):
+    """Reader 'alice' has book 1 on loan; 'bob' is another reader"""
+    alice = controller.controller_register_reader("alice", "pw", "Alice", "alice@test.com", "1")
+    controller.controller_register_reader("bob", "pw", "Bob", "bob@test.com", "2")
+    controller.controller_add_new_book("Truyện Kiều", "Nguyễn Du", "Poetry")
+    assert controller.controller_borrow_book(alice, 1)
+    return alice
+
+
+def _librarian_token(api):
+    with db.pooled_connection() as conn:
+        user_id = db.db_add_user(conn, "lib", "x", "Librarian", "lib@test.com", "3", "librarian")
+        conn.execute("INSERT INTO LIBRARIAN(user_id, staff_id, role) VALUES (?, 'S1', 'Librarian')", (user_id,))
+        conn.commit()
+    return api.sessions.create(user_id)
+
+
+def test_register_then_login(api):
+    status, payload = api.register(_request('POST', '/api/register', {
+        'username': "alice", 'password': "pw", 'name': "Alice", 'email': "alice@test.com", 'phone': "1"}))
+    assert status == HTTPStatus.CREATED
+    assert _error(api.register, _request('POST', '/api/register', {
+        'username': "alice", 'password': "pw", 'name': "Alice", 'email': "other@test.com"})) == HTTPStatus.CONFLICT
+    assert _error(api.register, _request('POST', '/api/register', {'username': "bob"})) == HTTPStatus.BAD_REQUEST
+
+    status, login = api.login(_request('POST', '/api/login', {'username': "alice", 'password': "pw"}))
+    assert login['user'] == {'user_id': 1, 'username': "alice", 'name': "Alice", 'role': 'reader',
+                             'reader_id': payload['reader_id']}
+    assert _error(api.login, _request('POST', '/api/login', {'username': "alice", 'password': "no"})) == \
+        HTTPStatus.UNAUTHORIZED
+
+
+def test_register_shares_the_login_rate_limit(api):
+    security.login_limiter = security.TokenBucketLimiter(capacity=2, refill_per_second=0)
+    for i in range(2):
+        api.register(_request('POST', '/api/register', {
+            'username': f"user{i}", 'password': "pw", 'name': "User", 'email': f"user{i}@test.com"}))
+    assert _error(api.register, _request('POST', '/api/register', {
+        'username': "user9", 'password': "pw", 'name': "User", 'email': "user9@test.com"})) == \
+        HTTPStatus.TOO_MANY_REQUESTS
+    with db.pooled_connection() as conn:
+        assert db.db_get_identity_by_username(conn, "user9") is None
+
+
+def test_logout_ends_the_session(api, loan):
+    token = _login(api, "alice")
+    assert api.logout(_request('POST', '/api/logout', token=token))[0] == HTTPStatus.OK
+    assert _error(api.logout, _request('POST', '/api/logout', token=token)) == HTTPStatus.UNAUTHORIZED
+
+
+def test_search_pages_through_the_cursor(api):
+    for i in range(5):
+        controller.controller_add_new_book(f"Thơ {i}", "Nguyễn Du", "Poetry")
+    seen, cursor = [], None
+    while True:
+        query = {'q': ["nguyen du"], 'page_size': ["2"]}
+        if cursor:
+            query['cursor'] = [cursor]
+        status, payload = api.search_books(_request('GET', '/api/books', query=query))
+        seen += [book['book_id'] for book in payload['books']]
+        cursor = payload['next_cursor']
+        if cursor is None:
+            break
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+    assert _error(api.search_books, _request('GET', '/api/books', query={'cursor': ["{"]})) == \
+        HTTPStatus.BAD_REQUEST
+
+
+@pytest.mark.parametrize("cursor", ['5', '"x"', '{}', '[1]', '[1, 2, 3]', '[[1], 2]', '["x", "2"]', '["x", true]'])
+def test_malformed_cursors_are_rejected(api, cursor):
+    query = {'q': ["nguyen du"], 'cursor': [cursor]}
+    assert _error(api.search_books, _request('GET', '/api/books', query=query)) == HTTPStatus.BAD_REQUEST
+    assert _error(api.faceted_search, _request('GET', '/api/books/search', query=query)) == HTTPStatus.BAD_REQUEST
+
+
+def test_faceted_search_pages_through_the_cursor(api):
+    for i in range(5):
+        controller.controller_add_new_book(f"Thơ {i}", "Nguyễn Du", "Poetry")
+    seen, cursor = [], None
+    while True:
+        query = {'genre': ["Poetry"], 'sort': ["title"], 'page_size': ["2"]}
+        if cursor:
+            query['cursor'] = [cursor]
+        status, payload = api.faceted_search(_request('GET', '/api/books/search', query=query))
+        assert payload['facets']['total'] == 5
+        seen += [book['book_id'] for book in payload['books']]
+        cursor = payload['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [1, 2, 3, 4, 5]
+
+
+def test_readers_borrow_for_themselves(api, loan):
+    controller.controller_add_new_book("Số đỏ", "Vũ Trọng Phụng", "Novel")
+    token = _login(api, "bob")
+    status, payload = api.borrow(_request('POST', '/api/borrow', {'book_id': 2, 'reader_id': loan}, token))
+    assert status == HTTPStatus.OK and payload['reader_id'] == loan + 1
+    assert _error(api.borrow, _request('POST', '/api/borrow', {'book_id': 1}, token)) == HTTPStatus.CONFLICT
+
+
+def test_librarians_borrow_for_a_given_reader(api, loan):
+    controller.controller_add_new_book("Số đỏ", "Vũ Trọng Phụng", "Novel")
+    token = _librarian_token(api)
+    assert _error(api.borrow, _request('POST', '/api/borrow', {'book_id': 2}, token)) == HTTPStatus.BAD_REQUEST
+    status, payload = api.borrow(_request('POST', '/api/borrow', {'book_id': 2, 'reader_id': loan}, token))
+    assert status == HTTPStatus.OK and payload['reader_id'] == loan
+
+
+def test_reader_cannot_return_another_readers_loan(api, loan):
+    token = _login(api, "bob")
+    assert _error(api.return_book, _request('POST', '/api/return', {'book_id': 1}, token)) == HTTPStatus.CONFLICT
+    with db.pooled_connection() as conn:
+        assert db.db_count_overdue_loans(conn, "9999-01-01") == 1
+
+
+def test_reader_returns_own_loan(api, loan):
+    token = _login(api, "alice")
+    status, payload = api.return_book(_request('POST', '/api/return', {'book_id': 1}, token))
+    assert status == HTTPStatus.OK and payload['returned']
+
+
+def test_librarian_returns_any_loan(api, loan):
+    status, _ = api.return_book(_request('POST', '/api/return', {'book_id': 1}, _librarian_token(api)))
+    assert status == HTTPStatus.OK
+
+
+def test_return_requires_login(api, loan):
+    assert _error(api.return_book, _request('POST', '/api/return', {'book_id': 1})) == HTTPStatus.UNAUTHORIZED
+
+
+def test_http_round_trip(db_path):
+    async def exchange(raw):
+        server = api_server.LibraryApiServer('127.0.0.1', 0, workers=2)
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(raw)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await server.close()
+        return response
+
+    response = asyncio.run(exchange(b"GET /api/health HTTP/1.1\r\nHost: x\r\n\r\n"
+                                    b"DELETE /api/books HTTP/1.1\r\nHost: x\r\n\r\n"
+                                    b"GET /nothing HTTP/1.1\r\nConnection: close\r\n\r\n"))
+    assert response.count(b"HTTP/1.1 ") == 3
+    assert b"200 OK" in response and b'{"status": "ok"}' in response
+    assert b"405 Method Not Allowed" in response and b"404 Not Found" in response
@@ -0,0 +1,60 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import audit
+import database as db
+
+
+def _event(event_type, **ids):
+    return (datetime.now().isoformat(timespec="milliseconds"), event_type, ids.get('user_id'),
+            ids.get('reader_id'), ids.get('book_id'), ids.get('record_id'), None)
+
+
+@pytest.fixture
+def writer(db_path):
+    audit_writer = audit.AuditWriter(db_path, flush_interval=0.05)
+    audit_writer.start()
+    yield audit_writer
+    audit_writer.stop()
+
+
+def test_writer_flushes_batches(writer):
+    for book_id in range(1, 51):
+        assert writer.put(_event('book_added', book_id=book_id))
+    writer.flush()
+    assert writer.written == 50
+    events = audit.query_events(book_id=7)
+    assert [(event['event_type'], event['book_id']) for event in events] == [('book_added', 7)]
+    assert len(audit.query_events(limit=1000)) == 50
+
+
+def test_log_is_append_only(writer, db_path):
+    writer.put(_event('login_failed'))
+    writer.flush()
+    conn = sqlite3.connect(db_path)
+    for statement in ("UPDATE AUDIT_EVENT SET event_type = 'x'", "DELETE FROM AUDIT_EVENT"):
+        with pytest.raises(sqlite3.DatabaseError, match="append-only"):
+            conn.execute(statement)
+        conn.rollback()
+    conn.close()
+
+
+def test_replay_rebuilds_open_loans(writer, conn):
+    user_id = db.db_add_user(conn, "alice", "x", "Alice", "alice@test.com", "0", "reader")
+    reader = db.db_add_reader(conn, user_id, "2026-01-01")
+    first = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    second = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    for book in (first, second):
+        record_id, _ = db.db_borrow_book(conn, book, reader, "2026-10-18", "2026-11-01")
+        writer.put(_event('borrowed', reader_id=reader, book_id=book, record_id=record_id))
+    record_id = db.db_return_book(conn, first, "2026-10-20", 1000)[0]
+    # Returns only know the loan: the writer fills in the reader
+    writer.put(_event('returned', book_id=first, record_id=record_id))
+    writer.flush()
+
+    assert [event['event_type'] for event in audit.query_events(reader_id=reader)] == \
+        ['borrowed', 'borrowed', 'returned']
+    assert list(audit.replay_open_loans()) == [2]
+    assert audit.check_open_loans() == ([], [])
@@ -0,0 +1,118 @@
+import sqlite3
+
+import backup
+import database as db
+
+
+def _fill(conn, books=300):
+    db.db_add_books_bulk(conn, [(f"Book {i}", f"Author {i % 17}", "Novel", "available") for i in range(books)])
+    user_id = db.db_add_user(conn, "alice", "x", "Alice", "alice@test.com", "0", "reader")
+    reader = db.db_add_reader(conn, user_id, "2026-01-01")
+    db.db_borrow_book(conn, 1, reader, "2026-10-18", "2026-11-01")
+
+
+def test_backup_verify_restore(conn, tmp_path):
+    _fill(conn)
+    archive = str(tmp_path / "library.db.gz")
+    assert backup.backup_database(archive, progress=None)
+
+    report = backup.verify_backup(archive)
+    assert report['ok'] and report['rows']['books'] == 300 and report['rows']['BORROWING_RECORD'] == 1
+
+    target = str(tmp_path / "restored.db")
+    assert backup.restore_backup(archive, target, progress=None)
+    restored = sqlite3.connect(target)
+    assert restored.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 300
+    restored.close()
+
+
+def test_export_verify_restore(conn, tmp_path):
+    _fill(conn)
+    export_dir = str(tmp_path / "export")
+    assert backup.export_tables(export_dir, fmt="csv")
+    assert backup.verify_export(export_dir) == []
+
+    target = str(tmp_path / "restored.db")
+    assert backup.restore_export(export_dir, target)
+    restored = db.connect_db(target)
+    assert restored.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 300
+    # The search index was rebuilt from the restored rows
+    assert restored.execute("SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH 'author'").fetchone()[0] == 300
+    restored.close()
+
+
+def test_verify_rejects_a_damaged_backup(tmp_path):
+    damaged = tmp_path / "broken.db"
+    damaged.write_bytes(b"not a database" * 100)
+    assert backup.verify_backup(str(damaged)) is None
+
+
+
+def test_backup_without_wal_does_not_block_writers(db_path, tmp_path, monkeypatch):
+    monkeypatch.setitem(db.STORAGE_PROFILE, "journal_mode", "DELETE")
+    with db.pooled_connection() as conn:
+        conn.execute("PRAGMA journal_mode = DELETE")
+        _fill(conn, books=2000)
+    writer = sqlite3.connect(db_path, timeout=0)
+    writes = []
+
+    def write_during_backup(status, remaining, total):
+        if not writes:
+            writer.execute("INSERT INTO books(title, author, genre, status) VALUES ('New', 'A', 'Novel', 'available')")
+            writer.commit()
+            writes.append(remaining)
+
+    archive = str(tmp_path / "library.db")
+    assert backup.backup_database(archive, pages=4, progress=write_during_backup)
+    writer.close()
+    assert writes
+    copy = sqlite3.connect(archive)
+    assert copy.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 2001
+    copy.close()
+
+
+def test_backup_leaves_no_temporary_file_when_the_source_cannot_be_opened(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "connect_db", lambda *args: None)
+    assert not backup.backup_database(str(tmp_path / "library.db"), source=str(tmp_path / "live.db"), progress=None)
+    assert list(tmp_path.iterdir()) == []
+
+
+def _column_types(path, tables):
+    conn = sqlite3.connect(path)
+    try:
+        return {(table, column): conn.execute(f'SELECT typeof("{column}") FROM "{table}" ORDER BY rowid').fetchall()
+                for table in tables
+                for column in [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]}
+    finally:
+        conn.close()
+
+
+def test_csv_restore_keeps_column_types(conn, db_path, tmp_path):
+    _fill(conn, books=5)
+    db.db_return_book(conn, 1, "2026-11-20", 1000.5)
+    export_dir = str(tmp_path / "export")
+    assert backup.export_tables(export_dir, fmt="csv", compress=False)
+    target = str(tmp_path / "restored.db")
+    assert backup.restore_export(export_dir, target)
+
+    tables = ["books", "User", "READER", "BORROWING_RECORD", "BOOK_COPY", "STAT_DAILY"]
+    assert _column_types(target, tables) == _column_types(db_path, tables)
+    restored = sqlite3.connect(target)
+    assert restored.execute("SELECT typeof(fine_amount), typeof(reader_id) FROM BORROWING_RECORD").fetchone() == \
+        ("real", "integer")
+    restored.close()
+
+
+def test_failed_export_restore_leaves_no_files(conn, tmp_path, monkeypatch):
+    _fill(conn, books=5)
+    export_dir = tmp_path / "export"
+    assert backup.export_tables(str(export_dir), fmt="jsonl")
+    restore_dir = tmp_path / "restore"
+    restore_dir.mkdir()
+
+    def fail(conn):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db, "db_rebuild_search_index", fail)
+    assert not backup.restore_export(str(export_dir), str(restore_dir / "restored.db"))
+    assert list(restore_dir.iterdir()) == []
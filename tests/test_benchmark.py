@@ -0,0 +1,46 @@
+import pytest
+
+import benchmark
+import controller
+import database as db
+
+
+def test_generated_dataset_is_consistent(tmp_path):
+    path = str(tmp_path / "bench.db")
+    benchmark.generate_dataset(path, books=300, readers=20, loans=1000, years=1, progress=lambda message: None)
+    conn = db.connect_db(path)
+    assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 300
+    assert conn.execute("SELECT COUNT(*) FROM READER").fetchone()[0] == 20
+    loans = conn.execute("SELECT COUNT(*) FROM BORROWING_RECORD").fetchone()[0]
+    assert 980 <= loans <= 1000
+    # Counters, summaries and the search index were rebuilt after the load
+    assert db.db_reconcile_reader_counters(conn, fix=False) == []
+    assert conn.execute("SELECT SUM(loan_count) FROM STAT_BOOK_LOANS").fetchone()[0] == loans
+    assert conn.execute("SELECT COUNT(*) FROM books_fts").fetchone()[0] == 300
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'stat_after_borrow'").fetchone()[0] == 1
+    conn.close()
+
+
+def test_run_benchmarks(tmp_path):
+    path = str(tmp_path / "bench.db")
+    benchmark.generate_dataset(path, books=100, readers=10, loans=200, years=1, progress=lambda message: None)
+    limit = controller.MAX_LOANS_PER_READER
+    results = benchmark.run_benchmarks(path, iterations=5)
+    assert controller.MAX_LOANS_PER_READER == limit
+    names = [result["name"] for result in results]
+    assert "controller_borrow_book" in names and "controller_login" in names
+    assert all(result["p50_ms"] <= result["p99_ms"] for result in results)
+
+
+def test_loan_limit_is_restored_when_a_benchmark_fails(tmp_path, monkeypatch):
+    path = str(tmp_path / "bench.db")
+    benchmark.generate_dataset(path, books=50, readers=5, loans=20, years=1, progress=lambda message: None)
+    limit = controller.MAX_LOANS_PER_READER
+
+    def broken_borrow(reader_id, book_id):
+        raise RuntimeError("desk offline")
+
+    monkeypatch.setattr(controller, "controller_borrow_book", broken_borrow)
+    with pytest.raises(RuntimeError):
+        benchmark.run_benchmarks(path, iterations=3)
+    assert controller.MAX_LOANS_PER_READER == limit
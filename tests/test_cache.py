@@ -0,0 +1,89 @@
+import database as db
+
+
+def _reader(conn):
+    user_id = db.db_add_user(conn, "alice", "x", "Alice", "alice@test.com", "0", "reader")
+    return db.db_add_reader(conn, user_id, "2026-01-01")
+
+
+def test_book_lookups_read_through_the_cache(conn):
+    book = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    row = db.db_get_book_by_id(conn, book)
+    hits = db.get_cache_stats()["books"]["hits"]
+    assert db.db_get_book_by_id(conn, book) == row
+    assert db.get_cache_stats()["books"]["hits"] == hits + 1
+
+
+def test_borrow_and_return_refresh_cached_rows(conn):
+    reader = _reader(conn)
+    book = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    assert db.db_get_book_by_id(conn, book)[4] == 'available'
+    assert db.db_search_books(conn, "so do")[0][4] == 'available'
+
+    db.db_borrow_book(conn, book, reader, "2026-10-18", "2026-11-01")
+    assert db.db_get_book_by_id(conn, book)[4] == 'borrowed'
+    assert db.db_search_books(conn, "so do")[0][4] == 'borrowed'
+    db.db_return_book(conn, book, "2026-10-19", 1000)
+    assert db.db_get_book_by_id(conn, book)[4] == 'available'
+
+
+def test_search_results_follow_book_changes(conn):
+    book = db.db_add_book(conn, "Dế Mèn phiêu lưu ký", "Tô Hoài", "Children")
+    assert [row[0] for row in db.db_search_books(conn, "de men")] == [book]
+    db.db_add_book(conn, "Dế Mèn phiêu lưu ký", "Tô Hoài", "Comics")
+    assert len(db.db_search_books(conn, "de men")) == 2
+
+
+def test_lru_bound_and_ttl(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(db.time, "monotonic", lambda: clock[0])
+    cache = db.LRUCache(maxsize=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # 'b' was the least recently used
+    assert (cache.get("b"), cache.get("a"), cache.get("c")) == (None, 1, 3)
+    assert cache.stats()["evictions"] == 1
+    clock[0] += 10
+    assert cache.get("a") is None
+
+
+def test_tag_invalidation_and_stale_writes():
+    cache = db.LRUCache(maxsize=10, ttl=60)
+    cache.put("search:kieu", [1, 2], tags=(1, 2))
+    cache.put("search:so do", [3], tags=(3,))
+    cache.invalidate_tag(2)
+    assert cache.get("search:kieu") is None and cache.get("search:so do") == [3]
+
+    # A read that started before an invalidation must not store its (stale) row
+    version = cache.version
+    cache.invalidate(7)
+    cache.put(7, "stale", version=version)
+    assert cache.get(7) is None
+
+
+def test_merge_drops_cached_book_rows(conn):
+    first = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    second = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    before = db.db_get_book_by_id(conn, first)
+    assert db.db_get_book_by_id(conn, second) is not None
+
+    assert db.db_merge_duplicate_titles(conn) == 1
+    assert db.db_get_book_by_id(conn, second) is None
+    after = db.db_get_book_by_id(conn, first)
+    assert after != before
+    assert after == conn.execute("SELECT * FROM books WHERE book_id = ?", (first,)).fetchone()
+
+
+def test_rebuild_copy_counters_drops_cached_book_rows(conn):
+    book = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    db.db_get_book_by_id(conn, book)
+    # Drift the counters behind the cache's back, then repair them
+    conn.execute("DROP TRIGGER IF EXISTS copy_after_insert")
+    conn.execute("INSERT INTO BOOK_COPY(book_id, barcode) VALUES (?, 'EXTRA-1')", (book,))
+    conn.commit()
+
+    assert db.db_rebuild_copy_counters(conn)
+    assert db.db_get_book_by_id(conn, book) == conn.execute(
+        "SELECT * FROM books WHERE book_id = ?", (book,)).fetchone()
@@ -0,0 +1,53 @@
+import catalog_import
+import database as db
+
+
+def _index_names(conn):
+    return {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'books' AND sql IS NOT NULL")}
+
+
+def test_import_csv(conn, tmp_path):
+    path = tmp_path / "books.csv"
+    path.write_text("title,author,genre\nTruyện Kiều,Nguyễn Du,Poetry\n,No title,Novel\nSố đỏ,Vũ Trọng Phụng,Novel\n",
+                    encoding="utf-8")
+    before = _index_names(conn)
+    report = catalog_import.import_catalog(str(path), batch_size=1, progress=None)
+    assert (report.imported, report.rejected, report.batches) == (2, 1, 2)
+    assert report.rejects == [(3, "missing title")]
+    assert _index_names(conn) == before
+    assert [row[1] for row in db.db_search_books(conn, "nguyen du")] == ["Truyện Kiều"]
+    assert conn.execute("SELECT COUNT(*) FROM SUSPENDED_INDEX").fetchone()[0] == 0
+    assert [row[1] for row in db.db_fuzzy_search_books(conn, "so do")] == ["Số đỏ"]
+
+
+def test_import_jsonl_writes_rejects(conn, tmp_path):
+    path = tmp_path / "books.jsonl"
+    path.write_text('{"title": "Chí Phèo", "author": "Nam Cao", "status": "Borrowed"}\n'
+                    'not json\n'
+                    '\n'
+                    '{"title": "Lão Hạc", "status": "lost"}\n', encoding="utf-8")
+    rejects = tmp_path / "rejects.tsv"
+    report = catalog_import.import_catalog(str(path), progress=None, reject_path=str(rejects))
+    assert (report.imported, report.rejected) == (1, 2)
+    assert rejects.read_text(encoding="utf-8").splitlines() == ["2\tmalformed row", "4\tinvalid status 'lost'"]
+    assert conn.execute("SELECT title, author, status FROM books").fetchall() == [("Chí Phèo", "Nam Cao", "borrowed")]
+
+
+def test_missing_file(db_path, tmp_path):
+    assert catalog_import.import_catalog(str(tmp_path / "nothing.csv"), progress=None) is None
+
+
+def test_interrupted_bulk_load_is_repaired_on_startup(conn):
+    before = _index_names(conn)
+    # A load killed between dropping the indexes and restoring them
+    db.db_drop_secondary_indexes(conn, 'books')
+    db.db_suspend_search_index(conn)
+    db.db_add_books_bulk(conn, [("Chí Phèo", "Nam Cao", "Novel", "available")])
+    assert _index_names(conn) != before
+
+    db.create_tables(conn)
+    assert _index_names(conn) == before
+    assert len(db.db_search_books(conn, "nam cao")) == 1
+    db.db_add_book(conn, "Lão Hạc", "Nam Cao", "Story")
+    assert len(db.db_search_books(conn, "nam cao")) == 2
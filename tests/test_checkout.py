@@ -0,0 +1,85 @@
+import controller
+import database as db
+
+TODAY = "2026-10-18"
+DUE = "2026-11-01"
+
+
+def _reader(conn, name):
+    user_id = db.db_add_user(conn, name, "x", name.title(), f"{name}@test.com", "0", "reader")
+    return db.db_add_reader(conn, user_id, "2026-01-01")
+
+
+def _open_loans(conn, reader_id):
+    return [row[0] for row in conn.execute(
+        "SELECT book_id FROM BORROWING_RECORD WHERE reader_id = ? AND return_date IS NULL ORDER BY book_id",
+        (reader_id,))]
+
+
+def test_checkout_reports_every_book_in_basket_order(conn):
+    alice, bob = _reader(conn, "alice"), _reader(conn, "bob")
+    free = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    taken = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    db.db_borrow_book(conn, taken, bob, TODAY, DUE)
+
+    outcomes, reason = db.db_checkout_batch(conn, alice, [free, 999, taken, free], TODAY, DUE)
+    assert reason is None
+    assert [(book_id, failure) for book_id, _, failure in outcomes] == [
+        (free, None), (999, 'not_found'), (taken, 'borrowed'), (free, 'duplicate')]
+    record_id = outcomes[0][1]
+    assert conn.execute("SELECT book_id, reader_id FROM BORROWING_RECORD WHERE record_id = ?",
+                        (record_id,)).fetchone() == (free, alice)
+    assert _open_loans(conn, alice) == [free]
+    assert conn.execute("SELECT total_borrowed, current_borrowed FROM READER WHERE reader_id = ?",
+                        (alice,)).fetchone() == (1, 1)
+
+
+def test_checkout_takes_one_copy_per_title(conn):
+    alice = _reader(conn, "alice")
+    book = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    db.db_add_copies(conn, book, 2)
+
+    outcomes, _ = db.db_checkout_batch(conn, alice, [book], TODAY, DUE)
+    assert outcomes[0][1] is not None
+    statuses = [row[0] for row in conn.execute(
+        "SELECT status FROM BOOK_COPY WHERE book_id = ? ORDER BY copy_id", (book,))]
+    assert statuses == ['borrowed', 'available', 'available']
+
+
+def test_checkout_stops_at_the_loan_limit(conn):
+    alice = _reader(conn, "alice")
+    books = [db.db_add_book(conn, f"Book {i}", "Author", "Novel") for i in range(4)]
+    db.db_borrow_book(conn, books[0], alice, TODAY, DUE)
+
+    outcomes, _ = db.db_checkout_batch(conn, alice, books[1:], TODAY, DUE, max_loans=3)
+    assert [failure for _, _, failure in outcomes] == [None, None, 'limit_reached']
+    assert _open_loans(conn, alice) == books[:3]
+
+
+def test_checkout_collects_the_readers_ready_hold(conn):
+    alice, bob, carol = _reader(conn, "alice"), _reader(conn, "bob"), _reader(conn, "carol")
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    db.db_borrow_book(conn, book, alice, TODAY, DUE)
+    hold, _ = db.db_place_hold(conn, book, bob, TODAY)
+    db.db_return_book(conn, book, TODAY, 1000)
+
+    # The copy on the hold shelf is Bob's, not Carol's
+    assert db.db_checkout_batch(conn, carol, [book], TODAY, DUE)[0][0][2] == 'borrowed'
+    assert db.db_checkout_batch(conn, bob, [book], TODAY, DUE)[0][0][2] is None
+    assert conn.execute("SELECT status FROM HOLD WHERE hold_id = ?", (hold,)).fetchone()[0] == 'fulfilled'
+
+
+def test_checkout_for_an_unknown_reader_borrows_nothing(conn):
+    book = db.db_add_book(conn, "Lão Hạc", "Nam Cao", "Story")
+    assert db.db_checkout_batch(conn, 999, [book], TODAY, DUE) == (None, 'invalid_reader')
+    assert conn.execute("SELECT COUNT(*) FROM BORROWING_RECORD").fetchone()[0] == 0
+    assert conn.execute("SELECT available_copies FROM books WHERE book_id = ?", (book,)).fetchone()[0] == 1
+
+
+def test_controller_checkout_batch(conn):
+    alice = _reader(conn, "alice")
+    book = db.db_add_book(conn, "Vợ nhặt", "Kim Lân", "Story")
+    results = controller.controller_checkout_batch(alice, [book, 999])
+    assert [(book_id, ok) for book_id, ok, _ in results] == [(book, True), (999, False)]
+    assert results[1][2] == "not found"
+    assert controller.controller_checkout_batch(alice, list(range(controller.MAX_CHECKOUT_ITEMS + 1))) == []
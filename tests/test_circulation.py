@@ -0,0 +1,240 @@
+import threading
+
+import pytest
+
+import database as db
+
+TODAY = "2026-10-18"
+DUE = "2026-11-01"
+
+
+def _reader(conn, name):
+    user_id = db.db_add_user(conn, name, "x", name.title(), f"{name}@test.com", "0", "reader")
+    return db.db_add_reader(conn, user_id, "2026-01-01")
+
+
+def _hold_status(conn, hold_id):
+    return conn.execute("SELECT book_id, status FROM HOLD WHERE hold_id = ?", (hold_id,)).fetchone()
+
+
+def _book_status(conn, book_id):
+    return conn.execute("SELECT status FROM books WHERE book_id = ?", (book_id,)).fetchone()[0]
+
+
+def test_borrow_marks_the_book_and_records_the_loan(conn):
+    reader = _reader(conn, "alice")
+    book = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    record_id, reason = db.db_borrow_book(conn, book, reader, TODAY, DUE)
+    assert record_id and reason is None
+    assert _book_status(conn, book) == 'borrowed'
+    assert db.db_borrow_book(conn, book, reader, TODAY, DUE) == (None, 'borrowed')
+    assert db.db_borrow_book(conn, 999, reader, TODAY, DUE) == (None, 'not_found')
+
+
+def test_unknown_reader_leaves_the_book_available(conn):
+    book = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    assert db.db_borrow_book(conn, book, 999, TODAY, DUE) == (None, 'invalid_reader')
+    assert _book_status(conn, book) == 'available'
+    assert conn.execute("SELECT COUNT(*) FROM BORROWING_RECORD").fetchone()[0] == 0
+
+
+def test_two_desks_cannot_lend_the_same_book(db_path):
+    conn = db.connect_db(db_path)
+    readers = [_reader(conn, name) for name in ("alice", "bob", "carol", "dave")]
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    conn.close()
+    start = threading.Barrier(len(readers))
+    results = []
+
+    def desk(reader):
+        desk_conn = db.connect_db(db_path, check_same_thread=False)
+        start.wait()
+        results.append(db.db_borrow_book(desk_conn, book, reader, TODAY, DUE)[0])
+        desk_conn.close()
+
+    threads = [threading.Thread(target=desk, args=(reader,)) for reader in readers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(record_id is not None for record_id in results) == 1
+
+
+def test_failed_work_is_rolled_back(conn):
+    def work(cur):
+        cur.execute("INSERT INTO books(title, author, genre, status) VALUES ('Draft', 'A', 'Novel', 'available')")
+        raise ValueError("stop")
+
+    with pytest.raises(ValueError):
+        db.run_in_transaction(conn, work)
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 0
+
+
+def test_return_closes_the_loan_with_its_fine(conn):
+    reader = _reader(conn, "alice")
+    book = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    record_id, _ = db.db_borrow_book(conn, book, reader, TODAY, DUE)
+
+    # Two days late
+    result = db.db_return_book(conn, book, "2026-11-03", 1000)
+    assert (result[0], result[1], result[-1]) == (record_id, 2000, None)
+    assert _book_status(conn, book) == 'available'
+    assert conn.execute("SELECT return_date, fine_amount FROM BORROWING_RECORD WHERE record_id = ?",
+                        (record_id,)).fetchone() == ("2026-11-03", 2000)
+    assert db.db_return_book(conn, book, TODAY, 1000)[-1] == 'not_borrowed'
+
+
+def test_return_only_closes_the_given_readers_loan(conn):
+    alice, bob = _reader(conn, "alice"), _reader(conn, "bob")
+    book = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    db.db_borrow_book(conn, book, alice, TODAY, DUE)
+    assert db.db_return_book(conn, book, TODAY, 1000, reader_id=bob)[3] == 'not_borrowed'
+    assert db.db_return_book(conn, book, TODAY, 1000, reader_id=alice)[0] is not None
+
+
+def test_return_on_time_has_no_fine(conn):
+    reader = _reader(conn, "alice")
+    book = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    db.db_borrow_book(conn, book, reader, TODAY, DUE)
+    assert db.db_return_book(conn, book, DUE, 1000)[1] == 0
+
+
+def test_assess_overdue_fines(conn):
+    reader = _reader(conn, "alice")
+    books = [db.db_add_book(conn, f"Book {i}", "Author", "Novel") for i in range(3)]
+    db.db_borrow_book(conn, books[0], reader, TODAY, "2026-10-20")
+    db.db_borrow_book(conn, books[1], reader, TODAY, "2026-10-25")
+    db.db_borrow_book(conn, books[2], reader, TODAY, "2026-11-01")
+    assert db.db_assess_overdue_fines(conn, "2026-10-26", 500) == (2, 3000 + 500)
+    # Rerunning the same day recomputes instead of adding up
+    assert db.db_assess_overdue_fines(conn, "2026-10-26", 500) == (2, 3500)
+    assert db.db_assess_overdue_fines(conn, "2026-10-01", 500) == (0, 0)
+
+
+def _counters(conn, reader_id):
+    return conn.execute("SELECT total_borrowed, current_borrowed FROM READER WHERE reader_id = ?",
+                        (reader_id,)).fetchone()
+
+
+def test_counters_follow_borrows_and_returns(conn):
+    reader = _reader(conn, "alice")
+    books = [db.db_add_book(conn, f"Book {i}", "Author", "Novel") for i in range(2)]
+    for book in books:
+        db.db_borrow_book(conn, book, reader, TODAY, DUE)
+    assert _counters(conn, reader) == (2, 2)
+    db.db_return_book(conn, books[0], TODAY, 1000)
+    assert _counters(conn, reader) == (2, 1)
+    # A refused borrow leaves the counters alone
+    assert db.db_borrow_book(conn, books[1], reader, TODAY, DUE) == (None, 'borrowed')
+    assert _counters(conn, reader) == (2, 1)
+
+
+def test_loan_limit(conn):
+    reader = _reader(conn, "alice")
+    books = [db.db_add_book(conn, f"Book {i}", "Author", "Novel") for i in range(3)]
+    assert db.db_borrow_book(conn, books[0], reader, TODAY, DUE, max_loans=2)[0]
+    assert db.db_borrow_book(conn, books[1], reader, TODAY, DUE, max_loans=2)[0]
+    assert db.db_borrow_book(conn, books[2], reader, TODAY, DUE, max_loans=2) == (None, 'limit_reached')
+    assert _book_status(conn, books[2]) == 'available'
+    db.db_return_book(conn, books[0], TODAY, 1000)
+    assert db.db_borrow_book(conn, books[2], reader, TODAY, DUE, max_loans=2)[0]
+
+
+def test_reconcile_reader_counters(conn):
+    alice, bob = _reader(conn, "alice"), _reader(conn, "bob")
+    books = [db.db_add_book(conn, f"Book {i}", "Author", "Novel") for i in range(3)]
+    for book in books:
+        db.db_borrow_book(conn, book, alice, TODAY, DUE)
+    db.db_return_book(conn, books[0], TODAY, 1000)
+    conn.execute("UPDATE READER SET total_borrowed = 0, current_borrowed = 7 WHERE reader_id = ?", (alice,))
+    conn.commit()
+
+    assert db.db_reconcile_reader_counters(conn, fix=False) == [(alice, 0, 7, 3, 2)]
+    assert _counters(conn, alice) == (0, 7)
+    assert db.db_reconcile_reader_counters(conn) == [(alice, 0, 7, 3, 2)]
+    assert _counters(conn, alice) == (3, 2) and _counters(conn, bob) == (0, 0)
+    assert db.db_reconcile_reader_counters(conn) == []
+
+
+def test_hold_queue_gets_the_returned_copy(conn):
+    alice, bob, carol = _reader(conn, "alice"), _reader(conn, "bob"), _reader(conn, "carol")
+    book = db.db_add_book(conn, "Dế Mèn phiêu lưu ký", "Tô Hoài", "Children")
+    db.db_borrow_book(conn, book, alice, TODAY, DUE)
+    first, _ = db.db_place_hold(conn, book, bob, TODAY)
+    second, _ = db.db_place_hold(conn, book, carol, TODAY)
+    assert db.db_get_hold_position(conn, second) == 2
+
+    _, _, hold, _ = db.db_return_book(conn, book, TODAY, 1000)
+    assert hold == (first, bob)
+    assert db.db_borrow_book(conn, book, carol, TODAY, DUE) == (None, 'borrowed')
+    assert db.db_borrow_book(conn, book, bob, TODAY, DUE)[0] is not None
+    assert _hold_status(conn, first)[1] == 'fulfilled'
+
+
+def test_expired_hold_passes_the_copy_on(conn):
+    alice, bob, carol = _reader(conn, "alice"), _reader(conn, "bob"), _reader(conn, "carol")
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    db.db_borrow_book(conn, book, alice, TODAY, DUE)
+    first, _ = db.db_place_hold(conn, book, bob, TODAY)
+    second, _ = db.db_place_hold(conn, book, carol, TODAY)
+    db.db_return_book(conn, book, TODAY, 1000, shelf_days=3)
+    db.db_get_book_by_id(conn, book)
+
+    assert db.db_expire_holds(conn, "2026-10-22", shelf_days=3) == (1, 1)
+    assert _hold_status(conn, first)[1] == 'expired'
+    assert _hold_status(conn, second)[1] == 'ready'
+    fresh = conn.execute("SELECT * FROM books WHERE book_id = ?", (book,)).fetchone()
+    assert db.db_get_book_by_id(conn, book) == fresh
+
+
+def test_merge_duplicate_titles_moves_holds(conn):
+    alice, bob, carol, dave = (_reader(conn, name) for name in ("alice", "bob", "carol", "dave"))
+    first = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    second = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    db.db_borrow_book(conn, first, alice, TODAY, DUE)
+    db.db_borrow_book(conn, second, bob, TODAY, DUE)
+    carol_first, _ = db.db_place_hold(conn, first, carol, TODAY)
+    carol_second, _ = db.db_place_hold(conn, second, carol, TODAY)
+    dave_second, _ = db.db_place_hold(conn, second, dave, TODAY)
+    # Carol's hold on the second row becomes ready
+    db.db_return_book(conn, second, TODAY, 1000)
+
+    assert db.db_merge_duplicate_titles(conn, TODAY) == 1
+    assert _hold_status(conn, carol_second) == (first, 'ready')
+    assert _hold_status(conn, carol_first) == (first, 'cancelled')
+    assert _hold_status(conn, dave_second) == (first, 'waiting')
+    assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 1
+
+
+def test_merge_duplicate_titles_frees_a_second_ready_copy(conn):
+    alice, bob, carol, dave = (_reader(conn, name) for name in ("alice", "bob", "carol", "dave"))
+    first = db.db_add_book(conn, "Vợ nhặt", "Kim Lân", "Story")
+    second = db.db_add_book(conn, "Vợ nhặt", "Kim Lân", "Story")
+    db.db_borrow_book(conn, first, alice, TODAY, DUE)
+    db.db_borrow_book(conn, second, bob, TODAY, DUE)
+    carol_first, _ = db.db_place_hold(conn, first, carol, TODAY)
+    carol_second, _ = db.db_place_hold(conn, second, carol, TODAY)
+    dave_first, _ = db.db_place_hold(conn, first, dave, TODAY)
+    db.db_return_book(conn, first, TODAY, 1000)
+    db.db_return_book(conn, second, TODAY, 1000)
+
+    assert db.db_merge_duplicate_titles(conn, TODAY) == 1
+    assert _hold_status(conn, carol_first) == (first, 'ready')
+    assert _hold_status(conn, carol_second) == (first, 'cancelled')
+    # The copy Carol no longer needs goes to the next reader in line
+    assert _hold_status(conn, dave_first) == (first, 'ready')
+    assert conn.execute("SELECT COUNT(*) FROM BOOK_COPY WHERE status = 'on_hold'").fetchone()[0] == 2
+
+
+def test_expire_holds_invalidates_the_cache_after_commit(conn, monkeypatch):
+    alice, bob = _reader(conn, "alice"), _reader(conn, "bob")
+    book = db.db_add_book(conn, "Lão Hạc", "Nam Cao", "Story")
+    db.db_borrow_book(conn, book, alice, TODAY, DUE)
+    db.db_place_hold(conn, book, bob, TODAY)
+    db.db_return_book(conn, book, TODAY, 1000, shelf_days=3)
+
+    in_transaction = []
+    monkeypatch.setattr(db, "invalidate_book", lambda book_id: in_transaction.append(conn.in_transaction))
+    assert db.db_expire_holds(conn, "2026-10-22", shelf_days=3) == (1, 0)
+    assert in_transaction == [False]
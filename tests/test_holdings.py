@@ -0,0 +1,72 @@
+import controller
+import database as db
+
+TODAY = "2026-10-18"
+DUE = "2026-11-01"
+
+
+def _reader(conn, name):
+    user_id = db.db_add_user(conn, name, "x", name.title(), f"{name}@test.com", "0", "reader")
+    return db.db_add_reader(conn, user_id, "2026-01-01")
+
+
+def _title(conn, book_id):
+    return conn.execute("SELECT total_copies, available_copies, status FROM books WHERE book_id = ?",
+                        (book_id,)).fetchone()
+
+
+def test_every_new_book_has_one_copy(conn):
+    book = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    assert _title(conn, book) == (1, 1, 'available')
+    [(copy_id, barcode, status, _)] = db.db_get_copies(conn, book)
+    assert (barcode, status) == (f"C{copy_id:08d}", 'available')
+    assert db.db_get_copy_by_barcode(conn, barcode) == (copy_id, book, 'available')
+
+
+def test_title_stays_available_until_its_last_copy_is_out(conn):
+    alice, bob, carol = _reader(conn, "alice"), _reader(conn, "bob"), _reader(conn, "carol")
+    book = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    assert db.db_add_copies(conn, book, barcodes=["SD-2"]) == 1
+    assert db.db_borrow_book(conn, book, alice, TODAY, DUE)[0]
+    assert _title(conn, book) == (2, 1, 'available')
+    assert db.db_borrow_book(conn, book, bob, TODAY, "2026-10-25")[0]
+    assert _title(conn, book) == (2, 0, 'borrowed')
+    assert db.db_borrow_book(conn, book, carol, TODAY, DUE) == (None, 'borrowed')
+
+    # Without a barcode the loan due first is closed (Bob's)
+    record_id = db.db_return_book(conn, book, TODAY, 1000)[0]
+    assert conn.execute("SELECT reader_id FROM BORROWING_RECORD WHERE record_id = ?", (record_id,)).fetchone() == (bob,)
+    assert _title(conn, book) == (2, 1, 'available')
+
+
+def test_return_by_barcode_closes_that_copys_loan(db_path):
+    with db.pooled_connection() as conn:
+        alice, bob = _reader(conn, "alice"), _reader(conn, "bob")
+        book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+        db.db_add_copies(conn, book, barcodes=["12345"])
+        db.db_borrow_book(conn, book, alice, TODAY, "2026-10-20")
+        db.db_borrow_book(conn, book, bob, TODAY, DUE)
+    # A numeric barcode is still a barcode
+    assert controller.controller_process_return(None, barcode="12345") == 0
+    with db.pooled_connection() as conn:
+        assert conn.execute("SELECT reader_id FROM BORROWING_RECORD WHERE return_date IS NULL").fetchall() == [(alice,)]
+    assert controller.controller_process_return(None, barcode="99999") is None
+
+
+def test_add_copies_to_a_missing_title(conn):
+    assert db.db_add_copies(conn, 999, count=2) == 0
+
+
+def test_merge_duplicate_titles_moves_copies_and_loans(conn):
+    alice = _reader(conn, "alice")
+    first = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    second = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    other = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Comics")
+    db.db_borrow_book(conn, second, alice, TODAY, DUE)
+
+    assert db.db_merge_duplicate_titles(conn) == 1
+    assert [row[0] for row in conn.execute("SELECT book_id FROM books ORDER BY book_id")] == [first, other]
+    assert _title(conn, first) == (2, 1, 'available')
+    assert conn.execute("SELECT book_id FROM BORROWING_RECORD").fetchall() == [(first,)]
+    assert conn.execute("SELECT loan_count FROM STAT_BOOK_LOANS WHERE book_id = ?", (first,)).fetchone() == (1,)
+    assert db.db_merge_duplicate_titles(conn) == 0
@@ -0,0 +1,63 @@
+import controller
+import database as db
+import models
+import security
+
+
+def _staff(conn, username, user_type, staff_id, privilege=None):
+    user_id = db.db_add_user(conn, username, security.hash_password("pw"), username.title(),
+                             f"{username}@test.com", "0", user_type)
+    conn.execute("INSERT INTO LIBRARIAN(user_id, staff_id, role) VALUES (?, ?, 'Librarian')", (user_id, staff_id))
+    if privilege is not None:
+        conn.execute("INSERT INTO ADMIN(user_id, privileged_level) VALUES (?, ?)", (user_id, privilege))
+    conn.commit()
+    return user_id
+
+
+def test_identity_row_carries_every_role(conn):
+    user_id = _staff(conn, "boss", "admin", "S1", privilege="full")
+    row = db.db_get_identity_by_username(conn, "boss")
+    assert row[0] == user_id and row[6] == "admin"
+    assert row[7:] == (None, "S1", "Librarian", 1, "full")
+    assert db.db_get_identity_by_user_id(conn, user_id) == row
+    assert db.db_get_identity_by_username(conn, "nobody") is None
+
+
+def test_login_builds_the_role_model(conn):
+    _staff(conn, "lib", "librarian", "S2")
+    _staff(conn, "boss", "admin", "S3", privilege="full")
+    librarian = controller.controller_login("lib", "pw")
+    assert type(librarian) is models.Librarian and librarian.staff_id == "S2"
+    admin = controller.controller_login("boss", "pw")
+    assert type(admin) is models.Admin and (admin.staff_id, admin.admin_id) == ("S3", 1)
+
+
+def test_get_user_is_served_from_the_cache_until_logout(conn, monkeypatch):
+    user_id = _staff(conn, "lib", "librarian", "S2")
+    user = controller.controller_login("lib", "pw")
+    lookups = []
+    real_lookup = db.db_get_identity_by_user_id
+    monkeypatch.setattr(db, "db_get_identity_by_user_id", lambda *args: lookups.append(args) or real_lookup(*args))
+
+    assert controller.controller_get_user(user_id).staff_id == "S2"
+    assert lookups == []
+    controller.controller_logout(user)
+    assert controller.controller_get_user(user_id).staff_id == "S2"
+    assert len(lookups) == 1
+    assert controller.controller_get_user(999) is None
+
+
+def test_identity_cache_is_bounded_and_holds_no_password_hash(conn, monkeypatch):
+    user_id = _staff(conn, "lib", "librarian", "S2")
+    assert controller.controller_login("lib", "pw").password.startswith("scrypt$")
+    cached = controller._identity_cache.get(user_id)
+    assert cached[1] == "lib" and cached[2] is None
+    assert controller.controller_get_user(user_id).password is None
+
+    monkeypatch.setattr(controller._identity_cache, "maxsize", 2)
+    other = _staff(conn, "other", "librarian", "S3")
+    controller.controller_get_user(other)
+    controller.controller_get_user(999)
+    controller.controller_get_user(_staff(conn, "third", "librarian", "S4"))
+    assert controller._identity_cache.stats()["size"] == 2
+    assert controller._identity_cache.get(user_id) is None
@@ -0,0 +1,59 @@
+import json
+import sqlite3
+
+import pytest
+
+import database as db
+
+SELECT_BY_AUTHOR = "SELECT book_id FROM books WHERE author = ?"
+
+
+def _stats_for(sql):
+    key = " ".join(sql.split())
+    return next(stats for stats in db.get_query_stats()['top'] if stats['sql'] == key)
+
+
+def test_statements_are_counted_with_their_rows(conn):
+    for i in range(3):
+        db.db_add_book(conn, f"Book {i}", "Nam Cao", "Novel")
+    db.reset_query_stats()
+    for _ in range(2):
+        conn.execute(SELECT_BY_AUTHOR, ("Nam Cao",)).fetchall()
+    stats = _stats_for(SELECT_BY_AUTHOR)
+    assert (stats['calls'], stats['rows'], stats['errors']) == (2, 6, 0)
+    assert sum(stats['histogram'].values()) == 2
+
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("SELECT * FROM no_such_table")
+    assert _stats_for("SELECT * FROM no_such_table")['errors'] == 1
+
+
+def test_write_lock_waits_are_reported(conn):
+    db.reset_query_stats()
+    db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    user_id = db.db_add_user(conn, "alice", "x", "Alice", "alice@test.com", "0", "reader")
+    db.db_borrow_book(conn, 1, db.db_add_reader(conn, user_id, "2026-01-01"), "2026-10-18", "2026-11-01")
+    summary = db.get_query_stats()
+    assert summary['lock_waits'] >= 1
+    assert summary['calls'] >= summary['lock_waits']
+
+
+def test_slow_statements_are_logged_with_their_plan(conn, tmp_path, monkeypatch):
+    log = tmp_path / "slow.log"
+    monkeypatch.setattr(db, "SLOW_QUERY_MS", 0)
+    monkeypatch.setattr(db, "SLOW_QUERY_LOG", str(log))
+    db.reset_query_stats()
+    conn.execute("SELECT * FROM BORROWING_RECORD WHERE book_id = ? AND return_date IS NULL", (42,)).fetchall()
+    text = log.read_text(encoding="utf-8")
+    assert "SELECT * FROM BORROWING_RECORD WHERE book_id = ?" in text
+    assert "params: (42,)" in text
+    assert "plan: SEARCH BORROWING_RECORD USING INDEX idx_borrow_open_book" in text
+    assert db.get_query_stats()['slow_queries'] >= 1
+
+
+def test_dump_query_stats(conn, tmp_path):
+    conn.execute(SELECT_BY_AUTHOR, ("Tô Hoài",)).fetchall()
+    path = tmp_path / "stats.json"
+    assert db.dump_query_stats(str(path))
+    dumped = json.loads(path.read_text(encoding="utf-8"))
+    assert any(stats['sql'] == SELECT_BY_AUTHOR for stats in dumped['top'])
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+import database as db
+
+
+def _schema_sql(conn, name):
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def test_fresh_database_is_at_the_latest_version(conn):
+    assert db.db_get_schema_version(conn) == db.MIGRATIONS[-1][0]
+    applied = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert applied == [version for version, _, _ in db.MIGRATIONS]
+    # Nothing left to apply
+    assert db.run_migrations(conn)
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(db.MIGRATIONS)
+
+
+def test_failed_migration_is_not_recorded(conn, monkeypatch):
+    latest = db.MIGRATIONS[-1][0]
+    calls = []
+
+    def broken(conn):
+        calls.append(1)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS + [(latest + 1, "broken step", broken)])
+    assert not db.run_migrations(conn)
+    assert db.db_get_schema_version(conn) == latest
+    # Retried on the next run
+    assert not db.run_migrations(conn)
+    assert len(calls) == 2
+
+
+def test_hot_queries_use_their_indexes(conn):
+    for name, uses_index, plan in db.db_check_query_plans(conn):
+        assert uses_index, f"{name}: {plan}"
+
+
+def test_hold_migration_recovers_from_a_half_built_copy_table(conn):
+    db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    # Put back the pre-hold BOOK_COPY (no 'on_hold' status)...
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.executescript(db._BOOK_COPY_TABLE_SQL.replace(", 'on_hold'", "").format(name="BOOK_COPY_old") + """
+    INSERT INTO BOOK_COPY_old SELECT * FROM BOOK_COPY;
+    DROP TRIGGER books_after_insert_copy;
+    DROP TABLE BOOK_COPY;
+    ALTER TABLE BOOK_COPY_old RENAME TO BOOK_COPY;
+    """)
+    # ... and the leftovers of an earlier attempt that failed halfway
+    conn.executescript(db._BOOK_COPY_TABLE_SQL.format(name="BOOK_COPY_new") + """
+    INSERT INTO BOOK_COPY_new SELECT * FROM BOOK_COPY LIMIT 1;
+    """)
+    conn.execute("PRAGMA foreign_keys = ON")
+
+    db._migrate_holds(conn)
+    assert "'on_hold'" in _schema_sql(conn, "BOOK_COPY")
+    assert _schema_sql(conn, "BOOK_COPY_new") is None
+    assert conn.execute("SELECT COUNT(*) FROM BOOK_COPY").fetchone()[0] == 2
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    assert conn.execute("SELECT COUNT(*) FROM BOOK_COPY WHERE book_id = ?", (book,)).fetchone()[0] == 1
+    assert conn.execute("SELECT total_copies FROM books WHERE book_id = ?", (book,)).fetchone()[0] == 1
+
+
+@pytest.mark.parametrize("helper, version", [
+    ("db_rebuild_statistics", 3),
+    ("db_reconcile_reader_counters", 4),
+    ("db_rebuild_copy_counters", 5),
+])
+def test_migration_is_not_recorded_when_its_rebuild_fails(conn, monkeypatch, helper, version):
+    conn.execute("DELETE FROM schema_version WHERE version >= ?", (version,))
+    conn.commit()
+    monkeypatch.setattr(db, helper, lambda *args, **kwargs: None if helper == "db_reconcile_reader_counters" else False)
+    assert not db.run_migrations(conn)
+    assert db.db_get_schema_version(conn) == version - 1
+
+    monkeypatch.undo()
+    assert db.run_migrations(conn)
+    assert db.db_get_schema_version(conn) == db.MIGRATIONS[-1][0]
@@ -0,0 +1,32 @@
+import pytest
+
+import models
+
+ROWS = [(1, "Truyện Kiều", "Nguyễn Du", "Poetry", "available"),
+        (2, "Số đỏ", "Vũ Trọng Phụng", "Novel", "borrowed"),
+        (3, "Chí Phèo", "Nam Cao", "Novel", "available")]
+
+
+def test_models_have_no_instance_dict():
+    book = models.Book.from_row(ROWS[0])
+    assert (book.book_id, book.title, book.status) == (1, "Truyện Kiều", "available")
+    assert not hasattr(book, "__dict__")
+    with pytest.raises(AttributeError):
+        book.isbn = "978-0"
+    reader = models.Reader(1, "alice", "Alice", "alice@test.com", None, reader_id=7)
+    assert not hasattr(reader, "__dict__")
+
+
+def test_result_view_builds_models_on_access():
+    built = []
+
+    def factory(row):
+        built.append(row[0])
+        return models.Book.from_row(row)
+
+    view = models.ResultView(ROWS, factory)
+    assert len(view) == 3 and built == []
+    assert view[1].title == "Số đỏ" and built == [2]
+    tail = view[1:]
+    assert isinstance(tail, models.ResultView) and tail.rows == ROWS[1:]
+    assert [book.book_id for book in view] == [1, 2, 3]
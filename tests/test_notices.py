@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+import database as db
+import notices
+
+AS_OF = date(2026, 10, 18)
+
+
+def _loans(conn, days_from_today):
+    user_id = db.db_add_user(conn, "alice", "x", "Alice", "alice@test.com", "0901", "reader")
+    reader = db.db_add_reader(conn, user_id, "2026-01-01")
+    for offset in days_from_today:
+        book = db.db_add_book(conn, f"Book {offset}", "Author", "Novel")
+        due = (AS_OF + timedelta(days=offset)).isoformat()
+        db.db_borrow_book(conn, book, reader, "2026-10-01", due)
+
+
+def _outbox(conn):
+    return conn.execute("SELECT notice_type, due_date, days, email FROM NOTICE_OUTBOX ORDER BY notice_id").fetchall()
+
+
+def test_overdue_and_due_soon_notices(conn):
+    _loans(conn, [-3, -1, 0, 2, 3, 10])
+    summary = notices.run_all(AS_OF, due_soon_days=2, chunk_size=2)
+    assert summary == {'overdue': (2, 2), 'due_soon': (2, 2)}
+    assert _outbox(conn) == [
+        ('due_soon', '2026-10-18', 0, 'alice@test.com'),
+        ('due_soon', '2026-10-20', 2, 'alice@test.com'),
+        ('overdue', '2026-10-15', 3, 'alice@test.com'),
+        ('overdue', '2026-10-17', 1, 'alice@test.com'),
+    ]
+
+
+def test_reruns_never_duplicate_notices(conn):
+    _loans(conn, [-5, -4, -3, 1])
+    notices.run_all(AS_OF, chunk_size=1)
+    assert notices.run_all(AS_OF, chunk_size=1, restart=True) == {'overdue': (3, 0), 'due_soon': (1, 0)}
+    # The next day the loan due today is overdue: one new notice
+    assert notices.run_all(AS_OF + timedelta(days=1))['overdue'] == (3, 0)
+    assert notices.run_all(AS_OF + timedelta(days=2))['overdue'] == (4, 1)
+    assert len(_outbox(conn)) == 5
+
+
+def test_interrupted_run_resumes_from_its_cursor(conn, monkeypatch):
+    _loans(conn, [-5, -4, -3, -2])
+    real_chunk = db.db_queue_notices_chunk
+    calls = []
+
+    def failing_chunk(*args):
+        calls.append(args)
+        return real_chunk(*args) if len(calls) == 1 else None
+
+    monkeypatch.setattr(db, "db_queue_notices_chunk", failing_chunk)
+    assert notices.run_notice_job('overdue', AS_OF, chunk_size=2) is None
+    monkeypatch.setattr(db, "db_queue_notices_chunk", real_chunk)
+    # Only the two loans after the saved cursor are read again
+    assert notices.run_notice_job('overdue', AS_OF, chunk_size=2) == (2, 2)
+
+
+def test_export_marks_notices_sent(conn, tmp_path):
+    _loans(conn, [-1, 1])
+    notices.run_all(AS_OF)
+    path = tmp_path / "outbox" / "notices.jsonl"
+    assert notices.export_pending(str(path)) == 2
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    assert notices.export_pending(str(path)) == 0
@@ -0,0 +1,71 @@
+import controller
+import database as db
+import main
+
+
+def _catalog(conn, count=25):
+    return [db.db_add_book(conn, f"Sách số {i}", "Nguyễn Du", "Poetry") for i in range(count)]
+
+
+def test_book_pages_cover_the_catalog_once(conn):
+    books = _catalog(conn)
+    seen, after = [], 0
+    while True:
+        rows = db.db_list_books_page(conn, after, limit=10)
+        if not rows:
+            break
+        seen += [row[0] for row in rows]
+        after = rows[-1][0]
+    assert seen == books
+    assert [row[0] for row in db.db_iter_books(conn, batch_size=7)] == books
+
+
+def test_controller_page_knows_when_it_is_the_last(db_path):
+    with db.pooled_connection() as conn:
+        books = _catalog(conn, count=20)
+    first = controller.controller_list_books(page_size=10)
+    assert [book.book_id for book in first] == books[:10] and first.has_next()
+    second = controller.controller_list_books(first.next_cursor, page_size=10)
+    assert [book.book_id for book in second] == books[10:]
+    assert not second.has_next()
+
+
+def test_reader_pages_never_carry_passwords(db_path):
+    with db.pooled_connection() as conn:
+        for i in range(3):
+            user_id = db.db_add_user(conn, f"reader{i}", "secret", f"Reader {i}", f"r{i}@test.com", "0", "reader")
+            db.db_add_reader(conn, user_id, "2026-01-01")
+    page = controller.controller_list_readers(page_size=2)
+    assert [reader.username for reader in page] == ["reader0", "reader1"] and page.has_next()
+    assert all(reader.password is None for reader in page)
+    assert [reader.username for reader in controller.controller_list_readers(page.next_cursor)] == ["reader2"]
+
+
+def test_search_pages_follow_the_ranked_order(conn):
+    # Equal scores everywhere: the book_id in the cursor breaks the ties
+    _catalog(conn)
+    db.db_add_book(conn, "Nguyễn Du toàn tập", "Nguyễn Du", "Poetry")
+    ranked = [row[0] for row in db.db_search_books(conn, "nguyen du")]
+    paged, cursor = [], None
+    while True:
+        rows, cursor = db.db_search_books_page(conn, "nguyen du", cursor, limit=4)
+        paged += [row[0] for row in rows]
+        assert all(len(row) == len(rows[0]) for row in rows)
+        if cursor is None:
+            break
+    assert sorted(paged) == sorted(ranked) and len(paged) == len(set(paged))
+    assert paged[0] == ranked[0]
+
+
+def test_search_page_without_matches(conn):
+    _catalog(conn, count=2)
+    assert db.db_search_books_page(conn, "tolstoy") == ([], None)
+
+
+def test_page_through_stops_when_a_page_cannot_be_read(db_path, monkeypatch):
+    with db.pooled_connection() as conn:
+        _catalog(conn, 5)
+    first_page, _ = controller.controller_search_books_faceted(sort="title", page_size=2)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    pages = iter([first_page, None])
+    assert main.page_through(lambda cursor: next(pages), lambda book: book.title) == 2
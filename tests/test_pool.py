@@ -0,0 +1,61 @@
+import threading
+
+import database as db
+
+
+def test_nested_checkout_reuses_the_threads_connection(db_path):
+    pool = db.ConnectionPool(db_path, size=2)
+    with pool.connection() as outer:
+        with pool.connection() as inner:
+            assert inner is outer
+        # Still held by this thread after the inner block
+        assert pool.acquire() is outer
+        pool.release(outer)
+    pool.close_all()
+
+
+def test_threads_get_their_own_connections_up_to_the_pool_size(db_path):
+    pool = db.ConnectionPool(db_path, size=1, timeout=0.05)
+    held = pool.acquire()
+    seen = []
+    worker = threading.Thread(target=lambda: seen.append(pool.acquire()))
+    worker.start()
+    worker.join()
+    # The only connection is busy in this thread: the other thread times out
+    assert seen == [None]
+    pool.release(held)
+
+    worker = threading.Thread(target=lambda: seen.append(pool.acquire()))
+    worker.start()
+    worker.join()
+    assert seen[1] is held
+    pool.close_all()
+
+
+def test_open_transaction_is_rolled_back_on_release(db_path):
+    pool = db.ConnectionPool(db_path, size=1)
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO books(title, author, genre, status) VALUES ('Draft', 'A', 'Novel', 'available')")
+        assert conn.in_transaction
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM books WHERE title = 'Draft'").fetchone()[0] == 0
+    pool.close_all()
+
+
+def test_broken_connection_is_replaced(db_path):
+    pool = db.ConnectionPool(db_path, size=1)
+    with pool.connection() as conn:
+        broken = conn
+    broken.close()
+    with pool.connection() as conn:
+        assert conn is not broken
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+    pool.close_all()
+
+
+def test_closed_pool_hands_out_nothing(db_path):
+    pool = db.ConnectionPool(db_path)
+    pool.close_all()
+    with pool.connection() as conn:
+        assert conn is None
@@ -0,0 +1,201 @@
+import controller
+import database as db
+
+
+def test_search_ignores_diacritics_and_matches_prefixes(conn):
+    kieu = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    de_men = db.db_add_book(conn, "Dế Mèn phiêu lưu ký", "Tô Hoài", "Children")
+    assert [row[0] for row in db.db_search_books(conn, "truyen ki")] == [kieu]
+    assert [row[0] for row in db.db_search_books(conn, "TÔ HOÀI")] == [de_men]
+    assert db.db_search_books(conn, "kieu poetry")[0][0] == kieu
+
+
+def test_search_folds_d_with_stroke(conn):
+    book = db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    assert [row[0] for row in db.db_search_books(conn, "den")] == [book]
+    assert [row[0] for row in db.db_search_books(conn, "Đèn")] == [book]
+
+
+def test_title_matches_rank_above_genre_matches(conn):
+    genre_only = db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Poetry")
+    in_title = db.db_add_book(conn, "Poetry of the South", "Anonymous", "Essay")
+    assert [row[0] for row in db.db_search_books(conn, "poetry")] == [in_title, genre_only]
+
+
+def test_index_follows_updates_and_deletes(conn):
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    conn.execute("UPDATE books SET title = 'Lão Hạc' WHERE book_id = ?", (book,))
+    conn.commit()
+    assert db.db_search_books(conn, "chi pheo") == []
+    assert [row[0] for row in db.db_search_books(conn, "lao hac")] == [book]
+    conn.execute("DELETE FROM BOOK_COPY WHERE book_id = ?", (book,))
+    conn.execute("DELETE FROM books WHERE book_id = ?", (book,))
+    conn.commit()
+    assert db.db_search_books(conn, "nam cao") == []
+
+
+def test_rebuild_restores_a_wiped_index(conn):
+    book = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    conn.execute("DELETE FROM books_fts")
+    conn.commit()
+    assert db.db_search_books(conn, "kieu") == []
+    assert db.db_rebuild_search_index(conn)
+    assert [row[0] for row in db.db_search_books(conn, "nguyen du")] == [book]
+
+
+def test_punctuation_only_query_falls_back_to_like(conn):
+    db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    assert db.db_search_books(conn, "?!") == []
+
+
+def _fuzzy_ids(conn, keyword, **kwargs):
+    return [row[0] for row in db.db_fuzzy_search_books(conn, keyword, **kwargs)]
+
+
+def test_fuzzy_search_tolerates_typos_and_accents(conn):
+    kieu = db.db_add_book(conn, "Truyện Kiều", "Nguyễn Du", "Poetry")
+    potter = db.db_add_book(conn, "Harry Potter and the Philosopher's Stone", "J. K. Rowling", "Fantasy")
+    db.db_add_book(conn, "Số đỏ", "Vũ Trọng Phụng", "Novel")
+    assert _fuzzy_ids(conn, "harry poter") == [potter]
+    assert _fuzzy_ids(conn, "truyen kieuu") == [kieu]
+    assert _fuzzy_ids(conn, "nguyen du")[0] == kieu
+    assert _fuzzy_ids(conn, "xyz") == []
+    assert db.db_fuzzy_search_books(conn, "!!") == []
+
+
+def test_fuzzy_search_ranks_by_similarity(conn):
+    close = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    farther = db.db_add_book(conn, "Chí Phèo và những truyện ngắn khác", "Nam Cao", "Story")
+    rows = db.db_fuzzy_search_books(conn, "chi pheo nam cao")
+    assert [row[0] for row in rows] == [close, farther]
+    assert 0 < rows[1][-1] < rows[0][-1] <= 1
+
+
+def test_fuzzy_threshold_is_the_share_of_query_trigrams(conn):
+    lao_hac = db.db_add_book(conn, "Lão Hạc", "Nam Cao", "Story")
+    lao_kho = db.db_add_book(conn, "Lão Khổ", "Tô Hoài", "Story")
+    # "lao kho" shares half of the trigrams of "lao hac"
+    assert _fuzzy_ids(conn, "lao hac", threshold=0.5) == [lao_hac, lao_kho]
+    assert _fuzzy_ids(conn, "lao hac", threshold=0.9) == [lao_hac]
+
+
+def test_trigram_index_follows_updates_and_deletes(conn):
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    conn.execute("UPDATE books SET title = 'Lão Hạc' WHERE book_id = ?", (book,))
+    conn.commit()
+    assert db.db_refresh_trigram_index(conn) == 1
+    db.clear_caches()
+    assert _fuzzy_ids(conn, "lao hack") == [book]
+    assert _fuzzy_ids(conn, "chi pheo") == []
+    conn.execute("DELETE FROM BOOK_COPY WHERE book_id = ?", (book,))
+    conn.execute("DELETE FROM books WHERE book_id = ?", (book,))
+    conn.commit()
+    db.db_refresh_trigram_index(conn)
+    db.clear_caches()
+    assert _fuzzy_ids(conn, "nam cao") == []
+    assert conn.execute("SELECT COUNT(*) FROM TRIGRAM_DF").fetchone()[0] == 0
+
+
+def test_fuzzy_search_only_reads_the_index(conn):
+    book = db.db_add_book(conn, "Chí Phèo", "Nam Cao", "Novel")
+    conn.execute("UPDATE books SET title = 'Lão Hạc' WHERE book_id = ?", (book,))
+    conn.commit()
+    # The rename is queued; searching does not index it
+    assert _fuzzy_ids(conn, "lao hack") == []
+    assert conn.execute("SELECT COUNT(*) FROM TRIGRAM_PENDING").fetchone()[0] == 1
+    # The end-of-day run catches up and drops the cached result
+    assert controller.controller_refresh_fuzzy_index() == 1
+    assert _fuzzy_ids(conn, "lao hack") == [book]
+
+
+def test_rebuild_trigram_index_matches_the_incremental_one(conn):
+    db.db_add_books_bulk(conn, [(f"Book {i}", f"Author {i % 7}", "Novel", "available") for i in range(50)])
+    db.db_add_book(conn, "Tắt đèn", "Ngô Tất Tố", "Novel")
+    # Both writes indexed their books
+    assert conn.execute("SELECT COUNT(*) FROM TRIGRAM_PENDING").fetchone()[0] == 0
+    incremental = conn.execute("SELECT gram, df FROM TRIGRAM_DF ORDER BY gram").fetchall()
+    assert db.db_rebuild_trigram_index(conn) == 51
+    assert conn.execute("SELECT gram, df FROM TRIGRAM_DF ORDER BY gram").fetchall() == incremental
+
+
+def test_fuzzy_search_on_common_trigrams_uses_blocks(conn, monkeypatch):
+    potter = db.db_add_book(conn, "Harry Potter", "J. K. Rowling", "Fantasy")
+    db.db_add_books_bulk(conn, [(f"Harry {i}", "Someone", "Novel", "available") for i in range(20)])
+    monkeypatch.setattr(db, "FUZZY_MAX_POSTINGS", 0)
+    assert _fuzzy_ids(conn, "hary potter rowling")[0] == potter
+
+
+def _faceted_catalog(conn):
+    db.db_add_books_bulk(conn, [
+        ("Truyện Kiều", "Nguyễn Du", "Poetry", "available"),
+        ("Số đỏ", "Vũ Trọng Phụng", "Novel", "available"),
+        ("Giông tố", "Vũ Trọng Phụng", "Novel", "borrowed"),
+        ("Chí Phèo", "Nam Cao", "Story", "available"),
+        ("Lão Hạc", "Nam Cao", "Story", "borrowed"),
+        ("Đời thừa", "Nam Cao", "Story", "available"),
+        ("Sống mòn", "Nam Cao", "Novel", "available"),
+        ("Ca dao", None, "Poetry", "available"),
+    ])
+
+
+def _walk_pages(conn, limit=3, **kwargs):
+    """Every row id of a faceted search, following the cursor page by page"""
+    ids, cursor = [], None
+    while True:
+        rows, cursor, _ = db.db_faceted_search(conn, after=cursor, limit=limit, **kwargs)
+        ids.extend(row[0] for row in rows)
+        if cursor is None:
+            return ids
+
+
+def test_faceted_search_counts_each_facet_without_its_own_filter(conn):
+    _faceted_catalog(conn)
+    rows, _, facets = db.db_faceted_search(conn)
+    assert facets["total"] == 8
+    assert dict(facets["genre"]) == {"Story": 3, "Novel": 3, "Poetry": 2}
+    assert dict(facets["status"]) == {"available": 6, "borrowed": 2}
+
+    rows, _, facets = db.db_faceted_search(conn, genre="Novel", status="available")
+    assert sorted(row[1] for row in rows) == ["Số đỏ", "Sống mòn"]
+    assert facets["total"] == 2
+    # Genres as if only the status were chosen, statuses as if only the genre were
+    assert dict(facets["genre"]) == {"Story": 2, "Novel": 2, "Poetry": 2}
+    assert dict(facets["status"]) == {"available": 2, "borrowed": 1}
+
+
+def test_faceted_search_with_keyword_and_author(conn):
+    _faceted_catalog(conn)
+    rows, _, facets = db.db_faceted_search(conn, "nam cao", genre="Story")
+    assert {row[1] for row in rows} == {"Chí Phèo", "Lão Hạc", "Đời thừa"}
+    assert dict(facets["genre"]) == {"Story": 3, "Novel": 1}
+    rows, _, facets = db.db_faceted_search(conn, author="Vũ Trọng Phụng", sort="title")
+    assert [row[1] for row in rows] == ["Giông tố", "Số đỏ"]
+    assert dict(facets["status"]) == {"available": 1, "borrowed": 1}
+
+
+def test_facet_counts_follow_status_changes(conn):
+    _faceted_catalog(conn)
+    user_id = db.db_add_user(conn, "alice", "x", "Alice", "alice@test.com", "0", "reader")
+    reader = db.db_add_reader(conn, user_id, "2026-01-01")
+    assert dict(db.db_faceted_search(conn, genre="Poetry")[2]["status"]) == {"available": 2}
+    db.db_borrow_book(conn, 1, reader, "2026-10-18", "2026-11-01")
+    assert dict(db.db_faceted_search(conn, genre="Poetry")[2]["status"]) == {"available": 1, "borrowed": 1}
+    stored = conn.execute("SELECT * FROM BOOK_FACET_COUNT ORDER BY genre, status").fetchall()
+    assert db.db_rebuild_facet_counts(conn)
+    assert conn.execute("SELECT * FROM BOOK_FACET_COUNT ORDER BY genre, status").fetchall() == stored
+
+
+def test_faceted_search_cursor_visits_every_book_once(conn):
+    _faceted_catalog(conn)
+    by_title = [row[0] for row in conn.execute("SELECT book_id FROM books ORDER BY title, book_id")]
+    assert _walk_pages(conn, sort="title") == by_title
+    assert _walk_pages(conn, sort="newest") == list(range(8, 0, -1))
+    # The book without an author sorts first and the cursor steps over the NULL
+    by_author = _walk_pages(conn, limit=1, sort="author")
+    assert by_author[0] == 8 and sorted(by_author) == list(range(1, 9))
+    assert _walk_pages(conn, limit=2, keyword="nam cao", sort="relevance") == \
+        [row[0] for row in db.db_faceted_search(conn, "nam cao", limit=10)[0]]
+
+
+def test_faceted_search_rejects_unknown_sort_keys(conn):
+    assert controller.controller_search_books_faceted(sort="price") is None
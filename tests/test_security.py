@@ -0,0 +1,67 @@
+import time
+
+import controller
+import database as db
+import security
+
+
+def test_hash_and_verify():
+    stored = security.hash_password("secret")
+    assert stored.startswith("scrypt$16$")
+    assert stored != security.hash_password("secret")
+    assert security.verify_password("secret", stored)
+    assert not security.verify_password("Secret", stored)
+    assert not security.needs_rehash(stored)
+    assert security.needs_rehash(security.hash_password("secret", n=32))
+
+
+def test_plain_text_password_is_upgraded_on_login(conn):
+    db.db_add_user(conn, "legacy", "123", "Legacy", "legacy@test.com", "0", "reader")
+    user_id = conn.execute("SELECT user_id FROM User WHERE username = 'legacy'").fetchone()[0]
+    db.db_add_reader(conn, user_id, "2026-01-01")
+    assert controller.controller_login("legacy", "124") is None
+    assert controller.controller_login("legacy", "123") is not None
+    stored = db.db_get_user_by_username(conn, "legacy")[2]
+    assert security.is_hashed(stored) and security.verify_password("123", stored)
+
+
+def test_bucket_empties_then_refills(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(security.time, "monotonic", lambda: clock[0])
+    limiter = security.TokenBucketLimiter(capacity=3, refill_per_second=1)
+    assert [limiter.allow("user:alice") for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("user:bob")
+    clock[0] += 1
+    assert limiter.allow("user:alice")
+    assert not limiter.allow("user:alice")
+
+
+def test_login_attempts_are_limited_per_username_and_ip(db_path):
+    security.login_limiter = security.TokenBucketLimiter(capacity=2, refill_per_second=0)
+    assert security.allow_login_attempt("alice", "10.0.0.5")
+    assert security.allow_login_attempt("bob", "10.0.0.5")
+    # Same IP, new username: the IP bucket is empty
+    assert not security.allow_login_attempt("carol", "10.0.0.5")
+    assert security.allow_login_attempt("alice", "10.0.0.6")
+    assert not security.allow_login_attempt("alice", "10.0.0.7")
+    assert controller.controller_login("alice", "pw", "10.0.0.8") is None
+
+
+def test_map_stays_bounded_under_distinct_keys():
+    limiter = security.TokenBucketLimiter(capacity=5, refill_per_second=0.2, max_keys=1000)
+    started = time.perf_counter()
+    for i in range(50000):
+        limiter.allow(f"user:guess{i}")
+    elapsed = time.perf_counter() - started
+    assert len(limiter._buckets) == 1000
+    # Constant work per attempt: a full scan per call would take seconds here
+    assert elapsed < 1.0
+
+
+def test_recently_used_bucket_survives_eviction():
+    limiter = security.TokenBucketLimiter(capacity=2, refill_per_second=0, max_keys=10)
+    limiter.allow("user:victim")
+    limiter.allow("user:victim")
+    for i in range(5):
+        limiter.allow(f"user:other{i}")
+    assert not limiter.allow("user:victim")
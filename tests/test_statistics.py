@@ -0,0 +1,59 @@
+from datetime import date
+
+import controller
+import database as db
+
+
+def _summary(conn):
+    return [conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+            for table in ("STAT_DAILY", "STAT_BOOK_LOANS", "STAT_READER_ACTIVITY")]
+
+
+def _history(conn):
+    """Two readers, three books: five loans over three days, two of them returned late"""
+    readers = []
+    for name in ("alice", "bob"):
+        user_id = db.db_add_user(conn, name, "x", name.title(), f"{name}@test.com", "0", "reader")
+        readers.append(db.db_add_reader(conn, user_id, "2026-01-01"))
+    books = [db.db_add_book(conn, f"Book {i}", "Author", "Novel") for i in range(3)]
+    db.db_borrow_book(conn, books[0], readers[0], "2026-10-01", "2026-10-05")
+    db.db_borrow_book(conn, books[1], readers[1], "2026-10-01", "2026-10-15")
+    db.db_return_book(conn, books[0], "2026-10-07", 1000)
+    db.db_borrow_book(conn, books[0], readers[1], "2026-10-08", "2026-10-10")
+    db.db_return_book(conn, books[0], "2026-10-11", 1000)
+    db.db_borrow_book(conn, books[0], readers[0], "2026-10-11", "2026-10-25")
+    db.db_borrow_book(conn, books[2], readers[0], "2026-10-11", "2026-10-12")
+    return readers, books
+
+
+def test_triggers_keep_the_summary_tables_current(conn):
+    readers, books = _history(conn)
+    daily, book_loans, reader_activity = _summary(conn)
+    assert daily == [("2026-10-01", 2, 0, 0), ("2026-10-07", 0, 1, 2000), ("2026-10-08", 1, 0, 0),
+                     ("2026-10-11", 2, 1, 1000)]
+    assert book_loans == [(books[0], 3), (books[1], 1), (books[2], 1)]
+    assert reader_activity == [(readers[0], 3, "2026-10-11"), (readers[1], 2, "2026-10-08")]
+
+
+def test_rebuild_matches_the_triggers(conn):
+    _history(conn)
+    maintained = _summary(conn)
+    for table in ("STAT_DAILY", "STAT_BOOK_LOANS", "STAT_READER_ACTIVITY"):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute("INSERT INTO STAT_DAILY(day, loans) VALUES ('1999-01-01', 42)")
+    conn.commit()
+    assert db.db_rebuild_statistics(conn)
+    assert _summary(conn) == maintained
+
+
+def test_report(db_path):
+    with db.pooled_connection() as conn:
+        readers, books = _history(conn)
+    report = controller.controller_get_statistics(days=5, top_n=1, as_of=date(2026, 10, 12))
+    assert report['since'] == "2026-10-08"
+    assert (report['total_loans'], report['total_returns'], report['fines_collected']) == (3, 1, 1000)
+    assert report['top_books'] == [(books[0], "Book 0", 3)]
+    assert report['active_readers'] == 2
+    # Due on the 12th is not overdue on the 12th; by the 16th books 1 and 2 are
+    assert report['overdue_loans'] == 0
+    assert controller.controller_get_statistics(as_of=date(2026, 10, 16))['overdue_loans'] == 2
@@ -0,0 +1,31 @@
+import json
+
+import database as db
+
+
+def test_connections_use_the_storage_profile(db_path):
+    conn = db.connect_db(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == db.STORAGE_PROFILE["busy_timeout"]
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    conn.close()
+
+
+def test_config_file_then_environment(tmp_path, monkeypatch):
+    config = tmp_path / "library_db.json"
+    config.write_text(json.dumps({"storage": {"cache_size": -32768, "synchronous": "full"}}), encoding="utf-8")
+    monkeypatch.setenv("LIBRARY_DB_SYNCHRONOUS", "EXTRA")
+    profile = db.load_storage_profile(str(config))
+    assert profile["cache_size"] == -32768
+    assert profile["synchronous"] == "EXTRA"
+    assert profile["journal_mode"] == "WAL"
+
+
+def test_invalid_settings_are_ignored(tmp_path, monkeypatch, capsys):
+    config = tmp_path / "library_db.json"
+    config.write_text(json.dumps({"journal_mode": "FAST; DROP TABLE books", "page_size": 8192}), encoding="utf-8")
+    monkeypatch.setenv("LIBRARY_DB_CACHE_SIZE", "lots")
+    profile = db.load_storage_profile(str(config))
+    assert profile == db.DEFAULT_STORAGE_PROFILE
+    assert "page_size" in capsys.readouterr().out